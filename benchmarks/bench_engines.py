@@ -0,0 +1,160 @@
+"""pandas 与 DuckDB 执行引擎对比
+
+两个引擎使用同一份输入, 分别计时分类 (classify), 本期新增 (increase) 和四级汇总
+(countAll), 并校验输出完全一致.
+
+输入默认为随机生成的合同数据; 也可以指定 prog.py 的数据目录 (含 contract.csv 等
+缓存) 和 config 目录:
+
+    python benchmarks/bench_engines.py -n 1000000
+    python benchmarks/bench_engines.py --data src/irrcontract/data/20220901 \\
+        --config src/irrcontract/config
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import arrow
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from irrcontract import pipeline, pipeline_duckdb  # noqa: E402
+from irrcontract.constants import PRJ_IDS  # noqa: E402
+
+STAT_DATE = arrow.get("2022-09-01")
+LAST_STAT_DATE = STAT_DATE.shift(weeks=-1)
+
+
+def synthesize(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    organization = pd.DataFrame(
+        [
+            {
+                "division": "事业部",
+                "branch": f"分公司{b}",
+                "dept": f"项目部{b}-{d}",
+                "project": f"项目{b}-{d}-{p}",
+            }
+            for b in range(20)
+            for d in range(10)
+            for p in range(10)
+        ]
+    )
+    org = organization.iloc[rng.integers(0, len(organization), n)].reset_index(
+        drop=True
+    )
+    condition = pd.Timestamp("2022-01-01") + pd.to_timedelta(
+        rng.integers(0, 240, n), unit="D"
+    )
+    contract = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "contract_id": np.arange(n),
+                    "contract_no": [f"HT{i:09d}" for i in range(n)],
+                    "category": rng.choice(["RD", "TD", "SD", "OT"], n),
+                    "irr_category": [None] * n,
+                    "dept_id": rng.integers(1, 1000, n),
+                    "project_id": rng.choice(PRJ_IDS + list(range(100)), n),
+                    "condition_date": condition,
+                    "compute_date": condition
+                    + pd.to_timedelta(rng.integers(0, 10, n), unit="D"),
+                    "apply_approve_date": condition
+                    + pd.to_timedelta(rng.integers(-5, 20, n), unit="D"),
+                }
+            ),
+            org,
+        ],
+        axis=1,
+    )
+    ids = contract["contract_id"]
+    resPurpose = pd.DataFrame({"contract_id": ids.sample(frac=0.1, random_state=1)})
+    picked = contract.sample(frac=0.2, random_state=2)
+    unsettlement = pd.DataFrame(
+        {
+            "obj_id": picked["contract_id"],
+            "contract_no": picked["contract_no"],
+            "owe_fee": rng.integers(-50000, 50000, len(picked)),
+        }
+    )
+    whiteList = pd.DataFrame(
+        {
+            "contract_no": contract["contract_no"].sample(frac=0.05, random_state=3),
+            "irr_category": rng.choice(["RN", "TN", "SN"], int(n * 0.05)),
+        }
+    )
+    allContracts = contract.sample(frac=0.5, random_state=4).assign(
+        irr_category=lambda df: rng.choice(["RN", "TN", "SN", None], len(df)),
+        statistic_date=pd.Timestamp(LAST_STAT_DATE.date()),
+    )
+    return contract, resPurpose, unsettlement, whiteList, allContracts
+
+
+def load(data: Path, config: Path):
+    read = lambda key: pd.read_csv(data / f"{key}.csv")  # noqa: E731
+    return (
+        read("contract"),
+        read("resPurpose"),
+        read("unsettlement"),
+        pd.read_excel(config / "whitelist.xlsx"),
+        pd.read_excel(config / "allContracts.xlsx"),
+    )
+
+
+def timed(fn, *args, repeat: int):
+    best, res = float("inf"), None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        res = fn(*args)
+        best = min(best, time.perf_counter() - t)
+    return best, res
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=200_000, help="随机生成的合同数量")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="每个步骤重复次数")
+    parser.add_argument("--data", type=Path, help="prog.py 的数据目录")
+    parser.add_argument("--config", type=Path, help="prog.py 的 config 目录")
+    args = parser.parse_args()
+
+    contract, resPurpose, unsettlement, whiteList, allContracts = (
+        load(args.data, args.config) if args.data else synthesize(args.n)
+    )
+    print(f"contracts: {len(contract):,}")
+
+    results = {}
+    for name, engine in [("pandas", pipeline), ("duckdb", pipeline_duckdb)]:
+        tClassify, dfTp = timed(
+            engine.classify,
+            contract,
+            resPurpose,
+            unsettlement,
+            whiteList,
+            repeat=args.repeat,
+        )
+        dfIrr = pipeline.irregular(dfTp, unsettlement, STAT_DATE)
+        tIncrease, dfIncrease = timed(
+            engine.increase, dfIrr, allContracts, LAST_STAT_DATE, repeat=args.repeat
+        )
+        tCount, counts = timed(engine.countAll, dfTp, repeat=args.repeat)
+        results[name] = (dfTp, dfIncrease, counts)
+        print(
+            f"{name:<8} classify {tClassify:8.3f}s  increase {tIncrease:8.3f}s"
+            f"  countAll {tCount:8.3f}s"
+        )
+
+    (aTp, aInc, aCounts), (bTp, bInc, bCounts) = results["pandas"], results["duckdb"]
+    pd.testing.assert_frame_equal(aTp, bTp)
+    pd.testing.assert_frame_equal(aInc, bInc)
+    for a, b in zip(aCounts, bCounts):
+        pd.testing.assert_frame_equal(a, b)
+    print("outputs identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""导入耗时基准
+
+每个模块在独立的子进程中导入, 重复多次取中位数, 同时检查导入后是否加载了
+重量级依赖 (pandas, numpy, arrow, requests, urllib3, dotenv).
+
+    python benchmarks/bench_import.py [-n 10] [module ...]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+
+MODULES = [
+    "pyinpark.pyfp",
+    "pyinpark.utils",
+    "pyinpark.pdfp",
+    "pyinpark.archive",
+    "pyinpark.transport",
+    "pyinpark.cmcloud",
+    "pyinpark.cmcloud2",
+    "pyinpark.cmcloud3",
+    "pyinpark.cmcloud4",
+    "irrcontract.constants",
+    "irrcontract._inter_utils_",
+    "irrcontract.pipeline",
+    "irrcontract.export",
+    "irrcontract.prog",
+]
+
+HEAVY = ["pandas", "numpy", "arrow", "requests", "urllib3", "dotenv"]
+
+PROBE = """
+import json, sys, time
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+print(json.dumps({{"ms": elapsed * 1000, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str, n: int) -> dict:
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join([str(SRC), os.environ.get("PYTHONPATH", "")]),
+    )
+    results = [
+        json.loads(
+            subprocess.run(
+                [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY)],
+                check=True,
+                capture_output=True,
+                text=True,
+                env=env,
+            ).stdout
+        )
+        for _ in range(n)
+    ]
+    return {
+        "module": module,
+        "median_ms": statistics.median(r["ms"] for r in results),
+        "heavy": results[-1]["heavy"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=10, help="每个模块重复导入的次数")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    args = parser.parse_args()
+
+    print(f"{'module':<28}{'median (ms)':>12}  heavy dependencies loaded")
+    for module in args.modules:
+        r = measure(module, args.n)
+        print(
+            f"{r['module']:<28}{r['median_ms']:>12.2f}  {', '.join(r['heavy']) or '-'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
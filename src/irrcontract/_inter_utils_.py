@@ -1,13 +1,20 @@
+from __future__ import annotations
+
 from collections import namedtuple
 from pathlib import Path
-from typing import List
+from typing import TYPE_CHECKING, List
 
-import arrow
 import toolz.curried as tz
+from pyinpark.lazy import lazy_import
 from pyinpark.utils import Weekday, getLastDateByWeekday
 
 from irrcontract.constants import DATE_FORMAT
 
+if TYPE_CHECKING:
+    import arrow
+else:
+    arrow = lazy_import("arrow")
+
 
 def getDate(d: Weekday):
     """get exec, statistics, last statistics date
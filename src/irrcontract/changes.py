@@ -0,0 +1,239 @@
+"""按合同的行哈希增量识别
+
+相邻两期的合同大多没有变化. 每次运行保存每份合同的行哈希与识别结果
+(`compute_date`, `irr_category`, `reason`), 下次运行只对新增或哈希变化的合同执行
+识别规则和 `reason` 文本, 其余合同沿用上期的结果, 输出与全量识别完全相同:
+
+>>> snapshot = Snapshot.load(snapshotPath, engine)
+>>> result = classify(contract, resPurpose, unsettlement, whiteList, statDate,
+...                   snapshot, engine)
+>>> snapshotOf(result, engine).save(snapshotPath)
+
+行哈希覆盖决定识别结果的全部输入: 合同自身参与规则的列, 是否在 `resPurpose` 和
+`unsettlement` 中, 白名单中该合同编号的类型, 以及 `reason` 用到的欠费金额.
+识别规则的代码 (执行引擎, `pipeline`, 规则用到的 `constants` 和 `pyinpark.pdfp`
+的源码) 变化后上期的结果整体失效.
+`contract_id` 为空或重复以及 `contract_no` 为空的合同每次都重新识别.
+"""
+from __future__ import annotations
+
+import hashlib
+import inspect
+import pickle
+from collections import namedtuple
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from pyinpark import pdfp
+from pyinpark.lazy import lazy_import
+from pyinpark.pdfp import get_values_by_keys
+
+from irrcontract import constants, pipeline
+from irrcontract.constants import CATEGORY, IRR_CATEGORY
+
+if TYPE_CHECKING:
+    import arrow
+    import numpy as np
+    import pandas as pd
+else:
+    np = lazy_import("numpy")
+    pd = lazy_import("pandas")
+
+# 识别规则用到的合同列
+RULE_COLUMNS = [
+    "contract_id",
+    "contract_no",
+    "project_id",
+    CATEGORY,
+    IRR_CATEGORY,
+    "condition_date",
+    "compute_date",
+    "apply_approve_date",
+]
+
+# 识别规则修改的列
+RESULT_COLUMNS = ["compute_date", IRR_CATEGORY]
+
+# - dfTp, dfIrr: 与 `engine.classify`, `engine.irregular` 的结果相同
+# - hashes: dfTp 每行的行哈希
+# - changed: 重新识别的合同数
+Classified = namedtuple("Classified", ["dfTp", "dfIrr", "hashes", "changed"])
+
+
+def rulesDigest(engine=pipeline) -> str:
+    """执行引擎, `pipeline` 及规则用到的常量 (`PRJ_IDS`, `DPT_ID` 等) 和
+    `get_values_by_keys` 的源码摘要"""
+    sources = {
+        inspect.getsource(module) for module in (pipeline, engine, constants, pdfp)
+    }
+    return hashlib.sha256("".join(sorted(sources)).encode("utf8")).hexdigest()
+
+
+def _hashable(df: pd.DataFrame) -> pd.DataFrame:
+    """可空数值列 (Int64 等) 拆为 numpy 数组和空值标记; 按扩展类型哈希要慢一个数量级"""
+    columns = {}
+    for k, s in df.items():
+        if pd.api.types.is_extension_array_dtype(s.dtype) and s.dtype.kind in "iufb":
+            columns[k] = s.to_numpy(s.dtype.numpy_dtype, na_value=0)
+            columns[f"{k}_isna"] = s.isna().to_numpy()
+        else:
+            columns[k] = s
+    return pd.DataFrame(columns, index=df.index)
+
+
+def rowHashes(
+    df: pd.DataFrame,
+    resPurpose: pd.DataFrame,
+    unsettlement: pd.DataFrame,
+    whiteList: pd.DataFrame,
+) -> pd.Series:
+    """`prepareContract` 之后每份合同的行哈希 (uint64)"""
+    whiteCategories = (
+        whiteList[IRR_CATEGORY]
+        .astype(str)
+        .groupby(whiteList["contract_no"])
+        .agg(lambda s: ",".join(sorted(set(s))))
+    )
+    inputs = df[RULE_COLUMNS].assign(
+        _res_purpose=df["contract_id"].isin(resPurpose["contract_id"]),
+        _unsettlement=df["contract_id"].isin(unsettlement["obj_id"]),
+        _white_list=df["contract_no"].map(whiteCategories),
+        _owe_fee=get_values_by_keys(
+            0, unsettlement["contract_no"], unsettlement["owe_fee"], df["contract_no"]
+        ).to_numpy(),
+    )
+    return pd.util.hash_pandas_object(_hashable(inputs), index=False)
+
+
+# %%
+# 上期的识别结果
+# =============
+
+
+class Snapshot:
+    """按 `contract_id` 索引的行哈希与识别结果
+
+    - `rows`: 列为 `hash`, `RESULT_COLUMNS` 和 `reason` (不是不规范合同的为空)
+    - `digest`: 生成时的 `rulesDigest`
+    """
+
+    def __init__(self, rows: pd.DataFrame, digest: str) -> None:
+        self.rows = rows
+        self.digest = digest
+
+    @classmethod
+    def empty(cls, engine=pipeline) -> "Snapshot":
+        return cls(
+            pd.DataFrame(
+                columns=["hash"] + RESULT_COLUMNS + ["reason"],
+                index=pd.Index([], name="contract_id"),
+            ),
+            rulesDigest(engine),
+        )
+
+    @classmethod
+    def load(cls, path: Path, engine=pipeline) -> "Snapshot":
+        """读取 `path`; 文件不存在, 无法读取或规则已修改时返回空的 `Snapshot`"""
+        try:
+            with open(path, "rb") as f:
+                rows, digest = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+            return cls.empty(engine)
+        if digest != rulesDigest(engine):
+            return cls.empty(engine)
+        return cls(rows, digest)
+
+    def save(self, path: Path) -> Path:
+        from pyinpark.atomic import FileLock, atomic_open
+
+        with FileLock(path), atomic_open(path, "wb") as f:
+            pickle.dump((self.rows, self.digest), f, protocol=pickle.HIGHEST_PROTOCOL)
+        return path
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+def _keyed(df: pd.DataFrame) -> np.ndarray:
+    """可以沿用上期结果的行: `contract_id` 非空且不重复, `contract_no` 非空"""
+    ids = df["contract_id"]
+    return (
+        ids.notna() & ~ids.duplicated(keep=False) & df["contract_no"].notna()
+    ).to_numpy()
+
+
+def _concat(parts: list, dtype):
+    """拼接 `parts` 中的非空表并统一转为 `dtype`
+
+    空表或全为空的列参与 `pd.concat` 时结果的类型依赖于 pandas 版本, 因此先排除.
+    """
+    nonEmpty = [part.astype(dtype) for part in parts if len(part)]
+    if not nonEmpty:
+        return parts[0].astype(dtype)
+    return pd.concat(nonEmpty) if len(nonEmpty) > 1 else nonEmpty[0]
+
+
+def classify(
+    contract: pd.DataFrame,
+    resPurpose: pd.DataFrame,
+    unsettlement: pd.DataFrame,
+    whiteList: pd.DataFrame,
+    statDate: arrow.Arrow,
+    snapshot: Snapshot,
+    engine=pipeline,
+) -> Classified:
+    """只对新增或变化的合同执行 `engine.applyRules` 和 `engine.irregular`
+
+    返回的 `Classified` 与 `engine.classify` + `engine.irregular` 的结果相同.
+    新的 `Snapshot` 由 `snapshotOf` 生成.
+    """
+    df = pipeline.prepareContract(contract)
+    hashes = rowHashes(df, resPurpose, unsettlement, whiteList)
+
+    positions = snapshot.rows.index.get_indexer(df["contract_id"])
+    reuse = (
+        _keyed(df)
+        & (positions >= 0)
+        & (
+            snapshot.rows["hash"].to_numpy()[positions.clip(0)].astype("uint64")
+            == hashes.to_numpy()
+        )
+        if len(snapshot)
+        else np.zeros(len(df), dtype=bool)
+    )
+    previous = snapshot.rows.iloc[positions[reuse]].set_axis(df.index[reuse])
+
+    changed = engine.applyRules(df[~reuse], resPurpose, unsettlement, whiteList)
+    dtypes = changed[RESULT_COLUMNS].dtypes.to_dict()
+    results = _concat([changed[RESULT_COLUMNS], previous[RESULT_COLUMNS]], dtypes)
+    dfTp = df.assign(
+        **{k: results[k].reindex(df.index).astype(dtypes[k]) for k in RESULT_COLUMNS}
+    )
+
+    changedIrr = engine.irregular(changed, unsettlement, statDate)
+    irr = dfTp[IRR_CATEGORY].notna()
+    reasonDtype = (
+        changedIrr["reason"].dtype if len(changedIrr) or not irr.any() else object
+    )
+    reasons = _concat(
+        [changedIrr["reason"], previous.loc[previous[IRR_CATEGORY].notna(), "reason"]],
+        reasonDtype,
+    )
+    dfIrr = dfTp[irr].assign(
+        statistic_date=pd.to_datetime(statDate.date()),
+        reason=reasons.reindex(dfTp.index[irr]).astype(reasonDtype),
+    )
+    return Classified(dfTp, dfIrr, hashes, int((~reuse).sum()))
+
+
+def snapshotOf(result: Classified, engine=pipeline) -> Snapshot:
+    """由本期的识别结果生成 `Snapshot`"""
+    dfTp = result.dfTp
+    keyed = _keyed(dfTp)
+    rows = (
+        dfTp.loc[keyed, ["contract_id"] + RESULT_COLUMNS]
+        .assign(hash=result.hashes[keyed], reason=result.dfIrr["reason"])
+        .set_index("contract_id")
+        .reindex(columns=["hash"] + RESULT_COLUMNS + ["reason"])
+    )
+    return Snapshot(rows, rulesDigest(engine))
@@ -0,0 +1,202 @@
+"""分块执行
+
+合同表过大无法整体载入内存时, 按固定行数分块流式处理: 每块依次完成类型转换, 识别规则,
+白名单排除和全量不规范合同筛选, 较小的查找表 (`resPurpose`, `unsettlement`,
+`whiteList`) 各块共用. 各块按组织机构的计数在最后合并, 再计算合计和比率.
+
+逐块推断的数据类型可能与整表不同 (比如某一块中整列为空), 因此先扫描一遍合同表确定
+与整表一致的数据类型, 处理每块时统一转换, 保证输出与整表执行完全相同.
+
+分块只限制识别过程的内存. 历史清单 (`allContracts.xlsx`) 每次整体读入并重写, 更新
+时仍需要分类后的全部合同 (`execute(..., keep=True)`).
+"""
+
+from __future__ import annotations
+
+from collections import namedtuple
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from pyinpark.lazy import lazy_import
+from pyinpark.pyfp import over_all
+
+from irrcontract import pipeline
+from irrcontract.constants import CATEGORIES, ORGS
+from irrcontract.pipeline import Counts, withRate
+
+if TYPE_CHECKING:
+    import arrow
+    import numpy as np
+    import pandas as pd
+else:
+    np = lazy_import("numpy")
+    pd = lazy_import("pandas")
+
+# 合同表: DataFrame 或者 csv 缓存文件
+Source = Union["pd.DataFrame", Path, str]
+
+Dtypes = Dict[str, object]
+
+DEFAULT_CHUNKSIZE = 100_000
+
+# - dfTp: 分类后的全部合同, `keep=False` 时为 None
+# - dfIrr: 全量不规范合同
+# - counts: 四级组织机构汇总
+Chunked = namedtuple("Chunked", ["dfTp", "dfIrr", "counts"])
+
+
+def readChunks(
+    contract: Source, chunksize: int, dtype: Optional[Dtypes] = None
+) -> Iterator[pd.DataFrame]:
+    if isinstance(contract, (str, Path)):
+        with pd.read_csv(contract, chunksize=chunksize, dtype=dtype) as reader:
+            yield from reader
+    else:
+        # 空表也产出一块, 保证下游得到带列名的结果
+        for start in range(0, max(len(contract), 1), chunksize):
+            yield contract.iloc[start : start + chunksize]
+
+
+# %%
+# 数据类型
+# =======
+
+
+def _commonRawDtype(dtypes: Iterable) -> object:
+    """与 `read_csv` 一次读入整表时推断的类型一致"""
+    kinds = set(dtypes)
+    if len(kinds) == 1:
+        return kinds.pop()
+    if all(
+        pd.api.types.is_numeric_dtype(k) and not pd.api.types.is_bool_dtype(k)
+        for k in kinds
+    ):
+        return np.dtype("float64")
+    return np.dtype("object")
+
+
+def _commonDtype(dtypes: Iterable, default: object) -> object:
+    """与整表执行 `prepareContract` 得到的类型一致
+
+    `dtypes` 只包含该列存在非空值的块; 整列为空的块不参与推断.
+    """
+    kinds = set(dtypes)
+    if not kinds:
+        return default
+    if len(kinds) == 1:
+        return kinds.pop()
+    if kinds == {pd.Int64Dtype(), pd.Float64Dtype()}:
+        return pd.Float64Dtype()
+    return np.dtype("object")
+
+
+def rawDtypes(contract: Source, chunksize: int) -> Optional[Dtypes]:
+    """分块读取 csv 时与整表一致的类型; `contract` 为 DataFrame 时为 None"""
+    if not isinstance(contract, (str, Path)):
+        return None
+    observed = [chunk.dtypes for chunk in readChunks(contract, chunksize)]
+    return {
+        k: _commonRawDtype(dtypes[k] for dtypes in observed) for k in observed[0].index
+    }
+
+
+def scanDtypes(contract: Source, chunksize: int) -> Tuple[Optional[Dtypes], Dtypes]:
+    """扫描合同表, 返回 (读取 csv 的类型, `prepareContract` 之后的类型)"""
+    raw = rawDtypes(contract, chunksize)
+    return raw, resolveDtypes(
+        chunkDtypes(chunk) for chunk in readChunks(contract, chunksize, raw)
+    )
+
+
+def chunkDtypes(chunk: pd.DataFrame) -> Tuple[pd.Series, pd.Series]:
+    """一块合同执行 `prepareContract` 后的类型, 以及各列是否存在非空值"""
+    return pipeline.prepareContract(chunk).dtypes, chunk.notna().any()
+
+
+def resolveDtypes(observations: Iterable[Tuple[pd.Series, pd.Series]]) -> Dtypes:
+    """由各块的 `chunkDtypes` 得到与整表一致的类型"""
+    seen = {}
+    for dtypes, notna in observations:
+        for k, dtype in dtypes.items():
+            kinds = seen.setdefault(k, (dtype, set()))[1]
+            if notna[k]:
+                kinds.add(dtype)
+
+    return {k: _commonDtype(kinds, default) for k, (default, kinds) in seen.items()}
+
+
+# %%
+# 分块执行
+# =======
+
+
+def classifyChunks(
+    contract: Source,
+    resPurpose: pd.DataFrame,
+    unsettlement: pd.DataFrame,
+    whiteList: pd.DataFrame,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    engine=pipeline,
+) -> Iterator[pd.DataFrame]:
+    """逐块产出 `engine.classify` 的结果"""
+    raw, prepared = scanDtypes(contract, chunksize)
+    for chunk in readChunks(contract, chunksize, raw):
+        yield engine.applyRules(
+            pipeline.prepareContract(chunk).astype(prepared),
+            resPurpose,
+            unsettlement,
+            whiteList,
+        )
+
+
+def partialCounts(dfTp: pd.DataFrame) -> Counts:
+    """各级组织机构的不规范合同计数, 不含合计和比率"""
+    return Counts._make(
+        [
+            pipeline.countIrr(orgs, CATEGORIES, "contract_id", dfTp)
+            for orgs in over_all(ORGS)
+        ]
+    )
+
+
+def mergeCounts(partials: Iterable[Counts]) -> Counts:
+    """合并各块的计数并计算合计和比率, 结果与 `pipeline.countAll` 相同"""
+    return Counts._make(
+        [
+            pd.concat(parts)
+            .pipe(lambda df: df.groupby(level=df.index.names, dropna=False).sum())
+            .pipe(withRate)
+            for parts in zip(*partials)
+        ]
+    )
+
+
+def execute(
+    contract: Source,
+    resPurpose: pd.DataFrame,
+    unsettlement: pd.DataFrame,
+    whiteList: pd.DataFrame,
+    statDate: arrow.Arrow,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    engine=pipeline,
+    keep: bool = False,
+) -> Chunked:
+    """分块完成分类, 全量不规范合同筛选和组织机构汇总
+
+    默认不保留分类后的合同明细, 占用的内存只与分块大小和不规范合同数量有关;
+    `keep=True` 时 `dfTp` 为全部合同.
+    """
+    tps, irrs, partials = [], [], []
+    for dfTp in classifyChunks(
+        contract, resPurpose, unsettlement, whiteList, chunksize, engine
+    ):
+        if keep:
+            tps.append(dfTp)
+        irrs.append(engine.irregular(dfTp, unsettlement, statDate))
+        partials.append(partialCounts(dfTp))
+
+    return Chunked(
+        dfTp=pd.concat(tps) if keep else None,
+        dfIrr=pd.concat(irrs),
+        counts=mergeCounts(partials),
+    )
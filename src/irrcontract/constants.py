@@ -13,3 +13,7 @@ CATEGORY = "category"
 IRR_CATEGORY = "irr_category"
 CATEGORIES = [CATEGORY, IRR_CATEGORY]
 
+# 项目部: 无锡太湖新城
+DPT_ID = 1437241
+# 公寓项目: 武汉东湖公寓(壹间.东湖网谷), 重庆九龙公寓
+PRJ_IDS = [1437202, 1436221]
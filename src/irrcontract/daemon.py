@@ -0,0 +1,331 @@
+"""常驻进程模式
+
+代替 cron 定时执行 `prog.run`. 进程常驻, 导入的模块, 网关登录状态, 导出配置,
+白名单和历史不规范合同清单都保存在内存中, 源文件变化 (mtime 或大小) 时才重新读取;
+登录状态超过 `--session-ttl` 秒或运行出错后重新登录.
+
+    python -m irrcontract.daemon -s THU --at 08:00   # 每个统计日的次日 08:00 运行
+    python -m irrcontract.daemon trigger -s MON      # 立即运行一次, 可覆盖运行参数
+
+`trigger` 在 `--state-dir` 中写入一个触发文件 (内容为 `prog` 的命令行参数),
+并向常驻进程发送 SIGUSR1 使其立即处理; 无法发送信号时常驻进程每 `--poll` 秒检查
+一次触发文件. 同一个 `--state-dir` 只能有一个常驻进程.
+"""
+from __future__ import annotations
+
+import argparse
+import copy
+import logging
+import os
+import shlex
+import signal
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Generic, List, Optional, TypeVar
+
+from pyinpark.atomic import FileLock, atomic_open
+from pyinpark.lazy import lazy_import
+from pyinpark.utils import Weekday
+
+from irrcontract import prog
+
+if TYPE_CHECKING:
+    import pandas as pd
+    import requests
+
+    from irrcontract.export import ExportPlans
+else:
+    pd = lazy_import("pandas")
+
+T = TypeVar("T")
+
+log = logging.getLogger("irrcontract.daemon")
+
+TRIGGER_PREFIX = "trigger-"
+PID_FILE = "daemon.pid"
+
+
+# %%
+# 常驻内存的输入
+# =============
+
+
+class WatchedFile(Generic[T]):
+    """缓存 `load(path)` 的结果, 文件的 mtime 或大小变化后重新读取"""
+
+    def __init__(self, path: Path, load: Callable[[Path], T]) -> None:
+        self.path = path
+        self.load = load
+        self._lock = threading.Lock()
+        self._stamp: Optional[tuple] = None
+        self._value: Any = None
+
+    def get(self) -> T:
+        with self._lock:
+            st = self.path.stat()
+            stamp = (st.st_mtime_ns, st.st_size)
+            if stamp != self._stamp:
+                log.info("loading %s", self.path)
+                self._value = self.load(self.path)
+                self._stamp = stamp
+            return self._value
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._stamp = self._value = None
+
+    def reload(self) -> threading.Thread:
+        """在后台线程中重新读取; 读取完成前调用 `get` 会等待, 不会重复读取"""
+
+        def load() -> None:
+            try:
+                self.get()
+            except Exception:
+                log.exception("reloading %s failed", self.path)
+
+        thread = threading.Thread(target=load, name=f"reload-{self.path.name}")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+class WarmInputs(prog.Inputs):
+    """在内存中缓存的 `prog.Inputs`"""
+
+    def __init__(self, sessionTtl: float = 1800) -> None:
+        from irrcontract import export
+
+        self._plans = WatchedFile(
+            prog.configPath,
+            lambda p: export.loadPlans(p, check=export.checkConfig),
+        )
+        self._whiteList = WatchedFile(prog.whiteListPath, pd.read_excel)
+        self._allContracts = WatchedFile(prog.allContractsPath, pd.read_excel)
+        self.sessionTtl = sessionTtl
+        self._sessionLock = threading.Lock()
+        self._session: Optional[requests.Response] = None
+        self._signedInAt = 0.0
+
+    def plans(self) -> ExportPlans:
+        return self._plans.get()
+
+    # 调用方拿到的是副本, 缓存的 DataFrame 不会被修改
+
+    def whiteList(self) -> pd.DataFrame:
+        return self._whiteList.get().copy()
+
+    def allContracts(self) -> pd.DataFrame:
+        return self._allContracts.get().copy()
+
+    def updateAllContracts(
+        self, update: Callable[[pd.DataFrame], pd.DataFrame]
+    ) -> pd.DataFrame:
+        df = super().updateAllContracts(update)
+        # 从写入的文件重新读取, 与 cron 方式运行时的数据类型保持一致; 在后台读取,
+        # 下次运行不必等待解析 xlsx
+        self._allContracts.invalidate()
+        self._allContracts.reload()
+        return df
+
+    def signIn(self) -> requests.Response:  # type: ignore[override]
+        with self._sessionLock:
+            if (
+                self._session is None
+                or time.monotonic() - self._signedInAt > self.sessionTtl
+            ):
+                log.info("signing in")
+                self._session = prog.Inputs.signIn()
+                self._signedInAt = time.monotonic()
+            return self._session
+
+    def invalidateSession(self) -> None:
+        with self._sessionLock:
+            self._session = None
+
+    def warm(self) -> None:
+        """预先导入模块, 读取文件并登录; 失败的项目留到运行时再试"""
+        prog.getEngine("pandas")
+        for name in ["plans", "whiteList", "allContracts", "signIn"]:
+            try:
+                getattr(self, name)()
+            except Exception:
+                log.exception("warming %s failed", name)
+
+
+# %%
+# 调度与触发
+# =========
+
+
+def nextRun(now: datetime, statisticsDay: str, at: str) -> datetime:
+    """统计日次日的 `at` (HH:MM) 时刻中, 晚于 `now` 的第一个"""
+    hour, minute = map(int, at.split(":"))
+    runDay = (Weekday[statisticsDay].value + 1) % 7
+    candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    candidate += timedelta(days=(runDay - candidate.weekday()) % 7)
+    return candidate if candidate > now else candidate + timedelta(days=7)
+
+
+def trigger(stateDir: Path, progArgs: List[str]) -> Path:
+    """写入触发文件并唤醒常驻进程, 返回触发文件"""
+    stateDir.mkdir(parents=True, exist_ok=True)
+    path = stateDir / f"{TRIGGER_PREFIX}{time.time_ns()}"
+    with atomic_open(path, "w") as f:
+        f.write(shlex.join(progArgs))
+    try:
+        os.kill(int((stateDir / PID_FILE).read_text()), signal.SIGUSR1)
+    except (OSError, ValueError):
+        log.warning("daemon is not running or cannot be signalled; trigger queued")
+    return path
+
+
+def takeTriggers(stateDir: Path) -> List[List[str]]:
+    """按写入顺序取出 (并删除) 全部触发文件"""
+    triggers = []
+    for path in sorted(stateDir.glob(f"{TRIGGER_PREFIX}*")):
+        try:
+            triggers.append(shlex.split(path.read_text()))
+        finally:
+            path.unlink(missing_ok=True)
+    return triggers
+
+
+class Daemon:
+    def __init__(
+        self,
+        args: argparse.Namespace,
+        stateDir: Path,
+        at: str = "08:00",
+        poll: float = 5,
+        sessionTtl: float = 1800,
+    ) -> None:
+        self.args = args
+        self.stateDir = stateDir
+        self.at = at
+        self.poll = poll
+        self.inputs = WarmInputs(sessionTtl)
+        self.wake = threading.Event()
+        self.stopping = False
+
+    def runOnce(self, args: argparse.Namespace) -> bool:
+        started = time.monotonic()
+        log.info("run started: %s", vars(args))
+        try:
+            prog.run(args, self.inputs)
+        except Exception:
+            log.exception("run failed")
+            # 登录可能已失效, 下次运行重新登录
+            self.inputs.invalidateSession()
+            return False
+        log.info("run finished in %.1fs", time.monotonic() - started)
+        return True
+
+    def _stop(self, *_) -> None:
+        self.stopping = True
+        self.wake.set()
+
+    def serve(self, runNow: bool = False) -> None:
+        self.stateDir.mkdir(parents=True, exist_ok=True)
+        pidFile = self.stateDir / PID_FILE
+        lock = FileLock(pidFile, timeout=0)
+        try:
+            lock.acquire()
+        except TimeoutError:
+            raise RuntimeError(
+                f"another daemon is already running with state dir {self.stateDir}"
+            ) from None
+        with atomic_open(pidFile, "w") as f:
+            f.write(str(os.getpid()))
+        signal.signal(signal.SIGUSR1, lambda *_: self.wake.set())
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        self.inputs.warm()
+        statisticsDay = getattr(self.args, prog.arg_stat_name)
+        due = nextRun(datetime.now(), statisticsDay, self.at)
+        log.info("ready, next scheduled run at %s", due)
+        if runNow:
+            self.runOnce(self.args)
+
+        try:
+            while not self.stopping:
+                timeout = (due - datetime.now()).total_seconds()
+                self.wake.wait(timeout=max(0, min(self.poll, timeout)))
+                self.wake.clear()
+                for progArgs in takeTriggers(self.stateDir):
+                    if self.stopping:
+                        break
+                    try:
+                        args = prog.buildParser().parse_args(
+                            progArgs, namespace=copy.copy(self.args)
+                        )
+                    except SystemExit:
+                        log.error("invalid trigger arguments: %s", progArgs)
+                        continue
+                    self.runOnce(args)
+                if not self.stopping and datetime.now() >= due:
+                    self.runOnce(self.args)
+                    due = nextRun(datetime.now(), statisticsDay, self.at)
+                    log.info("next scheduled run at %s", due)
+        finally:
+            pidFile.unlink(missing_ok=True)
+            lock.release()
+
+
+# %%
+# 命令行
+# =====
+
+
+def buildParser() -> argparse.ArgumentParser:
+    parser = prog.buildParser()
+    parser.add_argument("--at", default="08:00", help="统计日次日的运行时刻 HH:MM")
+    parser.add_argument(
+        "--state-dir",
+        type=Path,
+        default=prog.root / "run",
+        help="存放 pid 文件和触发文件的目录",
+    )
+    parser.add_argument("--poll", type=float, default=5, help="检查触发文件的间隔秒数")
+    parser.add_argument(
+        "--session-ttl", type=float, default=1800, help="登录状态的有效秒数"
+    )
+    parser.add_argument("--now", action="store_true", help="启动后立即运行一次")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from dotenv import load_dotenv
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+    load_dotenv()
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+
+    if argv[:1] == ["trigger"]:
+        # trigger [--state-dir DIR] [prog 参数...]
+        parser = argparse.ArgumentParser(prog="python -m irrcontract.daemon trigger")
+        parser.add_argument("--state-dir", type=Path, default=prog.root / "run")
+        known, progArgs = parser.parse_known_args(argv[1:])
+        # 提前检查参数, 避免常驻进程收到无效的触发
+        prog.buildParser().parse_args(progArgs)
+        print(trigger(known.state_dir, progArgs))
+        return
+
+    args = buildParser().parse_args(argv)
+    Daemon(
+        args,
+        stateDir=args.state_dir,
+        at=args.at,
+        poll=args.poll,
+        sessionTtl=args.session_ttl,
+    ).serve(runNow=args.now)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,768 @@
+"""按配置文件 (config.fp3.json) 导出 Excel
+
+配置文件加载时一次性校验并编译为每个 sheet 的导出计划 (`SheetPlan`), 导出时只需
+应用计划. 编译结果按配置文件内容的 sha256 缓存在磁盘上, 配置不变时直接读取缓存.
+
+工作簿按各 sheet 的输入数据, 导出计划和样式函数计算指纹, 记录在输出目录的 `.cache`
+中; 再次导出时指纹不变且文件未被修改的工作簿不再重写. 工作簿先写入临时文件, 完成后
+改名.
+
+sheet 的 `output` 为 `"csv"` 或 `"parquet"` 时不写入工作簿, 而是分批流式写入单独的
+文件 `<工作簿文件名>.<sheet key>.csv|parquet`: 同样排序, 替换字典值和重命名列, 但不
+应用样式和格式, 不受 Excel 行数限制, 供下游系统读取.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import inspect
+import json
+import string
+from pathlib import Path
+from types import MappingProxyType
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Iterable,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+from typing import TypedDict
+
+import toolz.curried as tz
+from pyinpark.atomic import atomic_open, atomic_path
+from pyinpark.lazy import lazy_import
+from pyinpark.pyfp import loads_jsonc
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+else:
+    np = lazy_import("numpy")
+    pd = lazy_import("pandas")
+    pa = lazy_import("pyarrow")
+    pq = lazy_import("pyarrow.parquet")
+
+# %%
+# typing config (json)
+
+Column = TypedDict(
+    "Column",
+    {"name": str, "dict": Optional[Dict[str, str]], "formatter": Optional[str]},
+)
+Columns = Dict[str, Column]
+
+Sort = TypedDict("Sort", {"ascending": bool, "value": List[str]})
+
+Sheet = TypedDict(
+    "Sheet",
+    {
+        "sheetName": str,
+        "columns": Optional[Columns],
+        "export": List[str],
+        "sort": Sort,
+        "output": Optional[str],
+    },
+)
+Sheets = Dict[str, Sheet]
+
+ExcelFile = TypedDict("ExcelFile", {"name": str, "sheets": Dict[str, Sheet]})
+
+Config = TypedDict("Config", {"columns": Columns, "ExcelFiles": Dict[str, ExcelFile]})
+
+# %%
+# help function for config (json)
+
+
+# getExcelFile :: Config -> str -> ExcelFile
+def getExcelFile(excelFileKey):
+    return tz.get_in(["ExcelFiles", excelFileKey])
+
+
+# getSheet :: ExcelFile -> str -> Sheet
+def getSheet(sheetKey):
+    return tz.get_in(["sheets", sheetKey])
+
+
+# getColumns :: Sheet | Config -> Columns
+def getColumns(d):
+    v = tz.get_in(["columns"], d)
+    return v if v else {}
+
+
+# getColumn :: Columns -> str -> Column
+def getColumn(columnKey):
+    return tz.get_in([columnKey], default={})
+
+
+@tz.curry
+def getRealColumn(columnKey, sheetKey, excelFileKey, cfg):
+    return tz.pipe(
+        cfg,
+        tz.juxt(
+            tz.compose(getColumn(columnKey), getColumns),
+            tz.compose(
+                getColumn(columnKey),
+                getColumns,
+                getSheet(sheetKey),
+                getExcelFile(excelFileKey),
+            ),
+        ),
+        tz.merge,
+    )
+
+
+# Testing
+# =======
+
+# Be lazy and test with actual data
+
+
+def checkConfig(config: Config) -> None:
+    assert getRealColumn("branch", "irrAll", "issue", config) == {
+        "name": "分公司",
+        "dict": None,
+        "formatter": None,
+    }
+
+    assert getRealColumn("irr_p", "rptBranch", "issue", config) == {
+        "name": "事业部不合规范合同数量",
+        "dict": None,
+        "formatter": None,
+    }
+
+    assert getRealColumn("over_type", "rptBranch", "issue", config) == {
+        "name": "合同终止类型",
+        "dict": {
+            "1": "正常终止",
+            "2": "提前终止",
+            "3": "续签终止",
+            "4": "延后终止",
+            "5": "变更终止",
+            "6": "更名终止",
+            "7": "合同解约",
+        },
+        "formatter": None,
+    }
+
+    assert getRealColumn("rate", "anlOrg", "analysis", config) == {
+        "name": "不合规范合同比率",
+        "dict": None,
+        "formatter": "{:.2%}",
+    }
+
+
+# %%
+# helper function for style
+# =========================
+
+
+@tz.curry
+def highlightRow(
+    predicate: Callable[[pd.Series, pd.DataFrame], bool],
+    props: str,
+    df: pd.DataFrame,
+) -> pd.DataFrame:
+    return df.apply(
+        lambda currentRow: np.where(predicate(currentRow, df), props, None),
+        # axis=1: apply function to row
+        axis=1,
+        # result_type="broadcast": return DataFrame
+        result_type="broadcast",
+    )
+
+
+# AR: Account Receivable
+# columnName -> (pd.Serial, pd.DataFrame) -> bool
+@tz.curry
+def containsSeries(contained, columnName):
+    return lambda currentRow, _: contained in currentRow[columnName]
+
+
+# children -> parent -> (pd.Serial, pd.DataFrame) -> bool
+@tz.curry
+def greaterThan(leftColumnName, rightColumnName):
+    return (
+        lambda currentRow, _: currentRow[leftColumnName] > currentRow[rightColumnName]
+    )
+
+
+# columnName -> (pd.Serial, pd.DataFrame) -> bool
+@tz.curry
+def eqMax(columnName):
+    return lambda currentRow, df: currentRow[columnName] == df[columnName].max()
+
+
+@tz.curry
+def containStyler(contained, columnName, renameColumns):
+    return highlightRow(
+        containsSeries(contained, renameColumns[columnName]),
+        "background-color: lightpink",
+    )
+
+
+@tz.curry
+def greaterThanStyler(leftColumnName, rightColumnName, renameColumns):
+    return highlightRow(
+        greaterThan(renameColumns[leftColumnName], renameColumns[rightColumnName]),
+        "background-color: lightpink",
+    )
+
+
+@tz.curry
+def eqMaxStyler(columnName, renameColumns):
+    return highlightRow(
+        eqMax(renameColumns[columnName]),
+        "background-color: lightpink",
+    )
+
+
+# %%
+# export plan
+# ===========
+
+# 编译结果的格式版本, 修改 `SheetPlan` 等结构时递增, 使旧的磁盘缓存失效
+PLAN_VERSION = 2
+
+# Excel 不允许出现在 sheet 名称中的字符
+INVALID_SHEET_CHARS = set("[]:*?/\\")
+
+# sheet 的输出方式, 默认写入工作簿
+OUTPUTS = ("excel", "csv", "parquet")
+
+# 流式输出时每批的行数
+BATCH_ROWS = 50_000
+
+
+class ConfigError(ValueError):
+    """配置文件有误, 包含全部错误信息"""
+
+
+class SheetPlan(NamedTuple):
+    sheetName: str
+    export: Tuple[str, ...]
+    sortBy: Tuple[str, ...]
+    ascending: bool
+    # 列名 -> 值映射
+    remapColumns: Mapping[str, Mapping[str, str]]
+    # 列名 -> 导出列名
+    renameColumns: Mapping[str, str]
+    # 导出列名 -> 格式
+    formatters: Mapping[str, str]
+    # OUTPUTS 之一
+    output: str
+
+
+class ExcelPlan(NamedTuple):
+    name: str
+    sheets: Mapping[str, SheetPlan]
+
+
+class ExportPlans(NamedTuple):
+    # 配置文件内容的 sha256
+    digest: str
+    files: Mapping[str, ExcelPlan]
+
+
+def _frozen(d: Mapping) -> Mapping:
+    return MappingProxyType(dict(d))
+
+
+def _validateColumns(path: str, columns: Any, errors: List[str]) -> Columns:
+    if columns is None:
+        return {}
+    if not isinstance(columns, dict):
+        errors.append(f"{path}: must be an object")
+        return {}
+    for key, column in columns.items():
+        where = f"{path}.{key}"
+        if not isinstance(column, dict):
+            errors.append(f"{where}: must be an object")
+            continue
+        if "name" in column and not isinstance(column["name"], str):
+            errors.append(f"{where}.name: must be a string")
+        d = column.get("dict")
+        if d is not None and not (
+            isinstance(d, dict) and all(isinstance(v, str) for v in d.values())
+        ):
+            errors.append(f"{where}.dict: must be null or an object of strings")
+        fmt = column.get("formatter")
+        if fmt is not None:
+            try:
+                if not isinstance(fmt, str):
+                    raise ValueError("must be a string")
+                list(string.Formatter().parse(fmt))
+            except ValueError as e:
+                errors.append(f"{where}.formatter: {e}")
+    return {k: v for k, v in columns.items() if isinstance(v, dict)}
+
+
+def _compileSheet(
+    path: str, sheet: Any, globalColumns: Columns, errors: List[str]
+) -> Optional[SheetPlan]:
+    if not isinstance(sheet, dict):
+        errors.append(f"{path}: must be an object")
+        return None
+
+    sheetName = sheet.get("sheetName")
+    if not isinstance(sheetName, str) or not 0 < len(sheetName) <= 31:
+        errors.append(f"{path}.sheetName: must be a string of 1 to 31 characters")
+    elif INVALID_SHEET_CHARS & set(sheetName):
+        errors.append(f"{path}.sheetName: must not contain any of []:*?/\\")
+
+    export = sheet.get("export")
+    if not (
+        isinstance(export, list) and export and all(isinstance(k, str) for k in export)
+    ):
+        errors.append(f"{path}.export: must be a non-empty list of strings")
+        export = []
+    elif len(set(export)) != len(export):
+        errors.append(f"{path}.export: contains duplicate columns")
+
+    sort = sheet.get("sort")
+    if not (
+        isinstance(sort, dict)
+        and isinstance(sort.get("ascending"), bool)
+        and isinstance(sort.get("value"), list)
+        and all(isinstance(k, str) for k in sort["value"])
+    ):
+        errors.append(f"{path}.sort: must be {{ascending: bool, value: [str]}}")
+        sort = {"ascending": True, "value": []}
+    for k in sort["value"]:
+        if k not in export:
+            errors.append(f"{path}.sort.value: {k!r} is not exported")
+
+    output = sheet.get("output", "excel")
+    if output not in OUTPUTS:
+        errors.append(f"{path}.output: must be one of {', '.join(OUTPUTS)}")
+
+    # sheet 中的列定义整体覆盖全局的同名列定义
+    columns = tz.merge(
+        globalColumns,
+        _validateColumns(f"{path}.columns", sheet.get("columns"), errors),
+    )
+    exported = {k: columns[k] for k in export if k in columns}
+    for k, column in exported.items():
+        if "name" not in column:
+            errors.append(f"{path}: exported column {k!r} has no name")
+    renameColumns = {k: c["name"] for k, c in exported.items() if "name" in c}
+    names = [renameColumns.get(k, k) for k in export]
+    if len(set(names)) != len(names):
+        errors.append(f"{path}: exported column names are not unique")
+
+    return SheetPlan(
+        sheetName=sheetName,
+        export=tuple(export),
+        sortBy=tuple(sort["value"]),
+        ascending=sort["ascending"],
+        remapColumns=_frozen(
+            {k: _frozen(c["dict"]) for k, c in exported.items() if c.get("dict")}
+        ),
+        renameColumns=_frozen(renameColumns),
+        formatters=_frozen(
+            {
+                c["name"]: c["formatter"]
+                for c in exported.values()
+                if c.get("formatter") and "name" in c
+            }
+        ),
+        output=output,
+    )
+
+
+def compileConfig(config: Config, digest: str = "") -> ExportPlans:
+    """校验配置并编译为导出计划, 配置有误时抛出包含全部错误的 `ConfigError`"""
+    errors: List[str] = []
+    if not isinstance(config, dict):
+        raise ConfigError("config: must be an object")
+    globalColumns = _validateColumns("columns", config.get("columns"), errors)
+
+    excelFiles = config.get("ExcelFiles")
+    if not isinstance(excelFiles, dict) or not excelFiles:
+        errors.append("ExcelFiles: must be a non-empty object")
+        excelFiles = {}
+
+    files = {}
+    for fileKey, excelFile in excelFiles.items():
+        path = f"ExcelFiles.{fileKey}"
+        if not isinstance(excelFile, dict):
+            errors.append(f"{path}: must be an object")
+            continue
+        name = excelFile.get("name")
+        if not isinstance(name, str) or not name:
+            errors.append(f"{path}.name: must be a non-empty string")
+        sheets = excelFile.get("sheets")
+        if not isinstance(sheets, dict) or not sheets:
+            errors.append(f"{path}.sheets: must be a non-empty object")
+            sheets = {}
+        plans = {
+            sheetKey: _compileSheet(
+                f"{path}.sheets.{sheetKey}", sheet, globalColumns, errors
+            )
+            for sheetKey, sheet in sheets.items()
+        }
+        sheetNames = [
+            p.sheetName.lower()
+            for p in plans.values()
+            if p is not None and isinstance(p.sheetName, str)
+        ]
+        if len(set(sheetNames)) != len(sheetNames):
+            errors.append(f"{path}.sheets: sheet names are not unique")
+        files[fileKey] = ExcelPlan(name=name, sheets=_frozen(plans))
+
+    if errors:
+        raise ConfigError("invalid config:\n" + "\n".join(errors))
+    return ExportPlans(digest=digest, files=_frozen(files))
+
+
+def _plansToJson(plans: ExportPlans) -> dict:
+    return {
+        "digest": plans.digest,
+        "files": {
+            fileKey: {
+                "name": excelPlan.name,
+                "sheets": {
+                    sheetKey: {
+                        **sheet._asdict(),
+                        "remapColumns": {
+                            k: dict(v) for k, v in sheet.remapColumns.items()
+                        },
+                        "renameColumns": dict(sheet.renameColumns),
+                        "formatters": dict(sheet.formatters),
+                    }
+                    for sheetKey, sheet in excelPlan.sheets.items()
+                },
+            }
+            for fileKey, excelPlan in plans.files.items()
+        },
+    }
+
+
+def _plansFromJson(data: dict) -> ExportPlans:
+    return ExportPlans(
+        digest=data["digest"],
+        files=_frozen(
+            {
+                fileKey: ExcelPlan(
+                    name=excelPlan["name"],
+                    sheets=_frozen(
+                        {
+                            sheetKey: SheetPlan(
+                                sheetName=sheet["sheetName"],
+                                export=tuple(sheet["export"]),
+                                sortBy=tuple(sheet["sortBy"]),
+                                ascending=sheet["ascending"],
+                                remapColumns=_frozen(
+                                    tz.valmap(_frozen, sheet["remapColumns"])
+                                ),
+                                renameColumns=_frozen(sheet["renameColumns"]),
+                                formatters=_frozen(sheet["formatters"]),
+                                output=sheet["output"],
+                            )
+                            for sheetKey, sheet in excelPlan["sheets"].items()
+                        }
+                    ),
+                )
+                for fileKey, excelPlan in data["files"].items()
+            }
+        ),
+    )
+
+
+def loadPlans(
+    configPath: Path,
+    cacheDir: Optional[Path] = None,
+    check: Optional[Callable[[Config], None]] = None,
+) -> ExportPlans:
+    """读取 JSONC 配置文件并编译为导出计划
+
+    编译结果以 `<cacheDir>/<配置文件名>.<sha256>.plan.json` 缓存, `cacheDir` 默认为
+    配置文件所在目录下的 `.cache`. `check` 为编译前对原始配置的附加检查, 配置内容
+    不变时不再重复执行.
+    """
+    configPath = Path(configPath)
+    raw = configPath.read_bytes()
+    digest = hashlib.sha256(f"{PLAN_VERSION}:".encode() + raw).hexdigest()
+    cacheDir = Path(cacheDir) if cacheDir is not None else configPath.parent / ".cache"
+    cachePath = cacheDir / f"{configPath.name}.{digest[:16]}.plan.json"
+
+    if cachePath.exists():
+        try:
+            with cachePath.open(encoding="utf8") as f:
+                data = json.load(f)
+            if data.get("digest") == digest:
+                return _plansFromJson(data)
+        except (ValueError, KeyError, TypeError):
+            # 缓存损坏时重新编译
+            pass
+
+    try:
+        config = loads_jsonc(raw.decode("utf8"))
+    except ValueError as e:
+        raise ConfigError(f"{configPath}: {e}") from e
+    if check is not None:
+        check(config)
+    plans = compileConfig(config, digest)
+
+    cacheDir.mkdir(parents=True, exist_ok=True)
+    with atomic_open(cachePath, "w", encoding="utf8") as f:
+        json.dump(_plansToJson(plans), f, ensure_ascii=False, indent=2)
+    return plans
+
+
+# %%
+# help function for export Excel file
+# ###################################
+
+
+def prepareSheet(plan: SheetPlan, df: pd.DataFrame) -> pd.DataFrame:
+    return (
+        df[list(plan.export)]
+        .replace({k: dict(v) for k, v in plan.remapColumns.items()})
+        .sort_values(by=list(plan.sortBy), ascending=plan.ascending)
+        .rename(columns=dict(plan.renameColumns))
+        .pipe(lambda df: df.set_index(np.arange(1, len(df) + 1)))
+    )
+
+
+def styleSheet(plan: SheetPlan, prepared: pd.DataFrame, styler):
+    """应用样式和格式, 返回 `pandas.io.formats.style.Styler`"""
+    return prepared.style.apply(styler(dict(plan.renameColumns)), axis=None).format(
+        formatter=dict(plan.formatters)
+    )
+
+
+def stylerSource(func) -> Optional[str]:
+    """`func` 及其 (递归) 引用的同一模块中的函数的源码, 修改任何一个都会改变结果
+
+    `highlightRow`, `greaterThan` 等柯里化的辅助函数按原函数取源码. 无法取得源码时
+    返回 None.
+    """
+    sources = {}
+    pending = [func]
+    while pending:
+        f = pending.pop()
+        f = f.func if isinstance(f, tz.curry) else f
+        if not inspect.isfunction(f) or f.__qualname__ in sources:
+            continue
+        try:
+            sources[f.__qualname__] = inspect.getsource(f)
+        except (OSError, TypeError):
+            return None
+        for name in f.__code__.co_names:
+            ref = f.__globals__.get(name)
+            ref = ref.func if isinstance(ref, tz.curry) else ref
+            if inspect.isfunction(ref) and ref.__module__ == func.__module__:
+                pending.append(ref)
+    return "\0".join(sources[k] for k in sorted(sources))
+
+
+def stylerKey(styler) -> Optional[str]:
+    """样式函数的稳定标识, 包括参数和源码; 无法确定时 (闭包, lambda 等) 返回 None,
+    不缓存"""
+    if isinstance(styler, tz.curry):
+        func, args, kwargs = styler.func, styler.args, styler.keywords
+    else:
+        func, args, kwargs = styler, (), {}
+    qualname = getattr(func, "__qualname__", "<unknown>")
+    key = repr((func.__module__, qualname, args, sorted(kwargs.items())))
+    if "<" in qualname or getattr(func, "__closure__", None) or " at 0x" in key:
+        return None
+    source = stylerSource(func)
+    if source is None:
+        return None
+    return f"{key}\0{source}"
+
+
+def sheetFingerprint(plan: SheetPlan, prepared: pd.DataFrame, styler) -> Optional[str]:
+    key = stylerKey(styler)
+    if key is None:
+        return None
+    h = hashlib.sha256()
+    for part in [
+        str(PLAN_VERSION),
+        pd.__version__,
+        key,
+        json.dumps(_plansToJson(ExportPlans("", {"": ExcelPlan("", {"": plan})}))),
+        repr(list(prepared.columns)),
+        repr(list(prepared.dtypes.astype(str))),
+    ]:
+        h.update(part.encode("utf8") + b"\0")
+    h.update(pd.util.hash_pandas_object(prepared, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def workbookFingerprint(
+    sheets: List[Tuple[SheetPlan, pd.DataFrame, Any]],
+) -> Optional[str]:
+    """`sheets` 为 (计划, `prepareSheet` 的结果, 样式函数); 任一 sheet 无法计算指纹时
+    返回 None"""
+    h = hashlib.sha256()
+    for plan, prepared, styler in sheets:
+        fingerprint = sheetFingerprint(plan, prepared, styler)
+        if fingerprint is None:
+            return None
+        h.update(fingerprint.encode("utf8"))
+    return h.hexdigest()
+
+
+def _fileStamp(path: Path) -> str:
+    st = path.stat()
+    return f"{st.st_mtime_ns} {st.st_size}"
+
+
+def unchanged(path: Path, stampPath: Path, fingerprint: Optional[str]) -> bool:
+    """`path` 是否由指纹相同的内容生成且之后未被修改"""
+    if fingerprint is None:
+        return False
+    try:
+        return stampPath.read_text(encoding="utf8") == (
+            f"{fingerprint} {_fileStamp(path)}"
+        )
+    except OSError:
+        return False
+
+
+def saveStamp(path: Path, stampPath: Path, fingerprint: Optional[str]) -> None:
+    if fingerprint is None:
+        stampPath.unlink(missing_ok=True)
+        return
+    stampPath.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_open(stampPath, "w", encoding="utf8") as f:
+        f.write(f"{fingerprint} {_fileStamp(path)}")
+
+
+def writeSheet(
+    writer: pd.ExcelWriter, plan: SheetPlan, prepared: pd.DataFrame, styler
+) -> None:
+    """写入一个 sheet, `prepared` 为 `prepareSheet` 的结果"""
+    styleSheet(plan, prepared, styler).to_excel(writer, sheet_name=plan.sheetName)
+
+
+# %%
+# streaming output
+# ================
+
+
+def iterBatches(
+    plan: SheetPlan, df: pd.DataFrame, batchRows: int = BATCH_ROWS
+) -> Iterator[pd.DataFrame]:
+    """按计划排序, 替换字典值并重命名列, 每次生成至多 `batchRows` 行
+
+    只对排序列整体排序, 导出列按批取出, 额外占用的内存与批大小成正比. 空表生成一个
+    只有列名的批次.
+    """
+    positions = df.columns.get_indexer(list(plan.export))
+    if (positions < 0).any():
+        missing = [k for k, i in zip(plan.export, positions) if i < 0]
+        raise KeyError(f"{missing} not in columns")
+    order = (
+        df[list(plan.sortBy)]
+        .reset_index(drop=True)
+        .sort_values(by=list(plan.sortBy), ascending=plan.ascending)
+        .index.to_numpy()
+        if plan.sortBy
+        else np.arange(len(df))
+    )
+    remapColumns = {k: dict(v) for k, v in plan.remapColumns.items()}
+    renameColumns = dict(plan.renameColumns)
+    for start in range(0, max(len(df), 1), batchRows):
+        yield (
+            df.iloc[order[start : start + batchRows], positions]
+            .replace(remapColumns)
+            .rename(columns=renameColumns)
+        )
+
+
+def _writeCsv(path: Path, batches: Iterable[pd.DataFrame]) -> None:
+    with path.open("w", encoding="utf8", newline="") as f:
+        for i, batch in enumerate(batches):
+            batch.to_csv(f, header=i == 0, index=False)
+
+
+def _arrowSchema(batch: pd.DataFrame) -> Tuple[pa.Schema, List[str]]:
+    """首批的 schema 及其中全为空的列
+
+    全为空的列无法推断类型, 按字符串处理; 后续批次中这些列的值都要转为字符串.
+    """
+    schema = pa.Schema.from_pandas(batch, preserve_index=False)
+    nulls = [f.name for f in schema if pa.types.is_null(f.type)]
+    return (
+        pa.schema([f.with_type(pa.string()) if f.name in nulls else f for f in schema]),
+        nulls,
+    )
+
+
+def _writeParquet(path: Path, batches: Iterable[pd.DataFrame]) -> None:
+    writer = None
+    try:
+        for batch in batches:
+            if writer is None:
+                schema, nulls = _arrowSchema(batch)
+                writer = pq.ParquetWriter(str(path), schema)
+            if nulls:
+                batch = batch.astype(dict.fromkeys(nulls, "string"))
+            writer.write_table(
+                pa.Table.from_pandas(batch, schema=schema, preserve_index=False)
+            )
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def streamPath(outDir: Path, excelPlan: ExcelPlan, sheetKey: str) -> Path:
+    plan = excelPlan.sheets[sheetKey]
+    return outDir / f"{Path(excelPlan.name).stem}.{sheetKey}.{plan.output}"
+
+
+def writeStream(
+    path: Path, plan: SheetPlan, df: pd.DataFrame, batchRows: int = BATCH_ROWS
+) -> Path:
+    """以 `plan.output` 指定的格式分批写入文件 (先写临时文件, 完成后改名)"""
+    write = {"csv": _writeCsv, "parquet": _writeParquet}[plan.output]
+    with atomic_path(path) as tmp:
+        write(tmp, iterBatches(plan, df, batchRows))
+    return path
+
+
+@tz.curry
+def toExcel(
+    outDir: Path,
+    excelFileKey: str,
+    cfg: Union[ExportPlans, Config],
+    iter_: Iterator[Tuple[str, pd.DataFrame]],
+):
+    plans = cfg if isinstance(cfg, ExportPlans) else compileConfig(cfg)
+    excelPlan = plans.files[excelFileKey]
+    sheets = []
+    for sheetKey, df, styler in iter_:
+        plan = excelPlan.sheets[sheetKey]
+        if plan.output == "excel":
+            sheets.append((plan, df, styler))
+        else:
+            writeStream(streamPath(outDir, excelPlan, sheetKey), plan, df)
+    # 全部 sheet 都单独输出时不生成工作簿
+    if not sheets:
+        return
+
+    prepared = [(plan, prepareSheet(plan, df), styler) for plan, df, styler in sheets]
+    path = outDir / excelPlan.name
+    stampPath = outDir / ".cache" / f"{excelPlan.name}.fingerprint"
+    fingerprint = workbookFingerprint(prepared)
+    if unchanged(path, stampPath, fingerprint):
+        return
+
+    with atomic_path(path) as tmp:
+        with pd.ExcelWriter(tmp) as writer:
+            for plan, sheet, styler in prepared:
+                writeSheet(writer, plan, sheet, styler)
+    saveStamp(path, stampPath, fingerprint)
@@ -0,0 +1,123 @@
+"""组织机构层级索引
+
+`ORGS` 的每一级前缀 (事业部, 事业部/分公司, ...) 是一个节点. 节点按层级排列,
+同一层级内按名称排序 (空值在后), 行号即节点的整数编号, 因此按编号排序与按组织
+名称排序的结果相同.
+
+- `nodes`: 节点表, 列为 `level` 和 `ORGS`, 下级的列为空
+- `ancestors[code, depth]`: 节点在第 `depth` 级的上级的编号, 比节点更深的层级为 -1
+- `closure`: 闭包表, 每个节点与其自身及全部上级节点的对应关系
+
+任意 (下级, 上级) 层级组合的汇总只需要对整数编号做一次分组聚合:
+
+>>> index = OrgIndex.build(organization, dfTp)
+>>> codes = index.encode(dfTp, "project")
+>>> index.rollup(leafCounts, "branch")     # 项目级计数汇总到分公司
+>>> index.ancestorOf(codes, "branch")      # 每个项目所属分公司的编号
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, List
+
+from pyinpark.lazy import lazy_import
+
+from irrcontract.constants import ORGS
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+else:
+    np = lazy_import("numpy")
+    pd = lazy_import("pandas")
+
+
+def orgPath(level: str) -> List[str]:
+    if level not in ORGS:
+        raise ValueError(f"level must be one of {ORGS}, got {level!r}")
+    return ORGS[: ORGS.index(level) + 1]
+
+
+class OrgIndex:
+    def __init__(self, nodes: pd.DataFrame, ancestors: np.ndarray) -> None:
+        self.nodes = nodes
+        self.ancestors = ancestors
+        self._levels = {
+            level: pd.MultiIndex.from_frame(
+                nodes.loc[nodes["level"] == level, orgPath(level)]
+            )
+            for level in ORGS
+        }
+        # 各层级第一个节点的编号
+        levels = nodes["level"].to_numpy()
+        self._offsets = {level: int(np.argmax(levels == level)) for level in ORGS}
+
+    @classmethod
+    def build(cls, *frames: pd.DataFrame) -> "OrgIndex":
+        """由包含 `ORGS` 各列的表 (组织机构表, 合同表等) 中出现的全部组织建立索引"""
+        paths = pd.concat([df[ORGS] for df in frames], ignore_index=True)
+        paths = paths.drop_duplicates(ignore_index=True)
+
+        parts, columns, offset = [], [], 0
+        for level in ORGS:
+            path = orgPath(level)
+            local = paths.groupby(path, sort=True, dropna=False).ngroup().to_numpy()
+            first = np.unique(local, return_index=True)[1]
+            parts.append(paths.loc[first, path].assign(level=level))
+            columns.append(local + offset)
+            offset += len(first)
+        nodes = pd.concat(parts, ignore_index=True).reindex(columns=["level"] + ORGS)
+
+        # 每条最末级路径上各级节点的编号, 展开到全部节点
+        leafAncestors = np.column_stack(columns)
+        ancestors = np.full((len(nodes), len(ORGS)), -1, dtype=np.int64)
+        for depth in range(len(ORGS)):
+            path = leafAncestors[:, : depth + 1]
+            ancestors[path[:, -1], : depth + 1] = path
+        return cls(nodes, ancestors)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def closure(self) -> pd.DataFrame:
+        """(descendant, ancestor, distance), distance 为 0 的行是节点自身"""
+        depth = self.nodes["level"].map(ORGS.index).to_numpy()
+        descendant, ancestorDepth = np.nonzero(self.ancestors >= 0)
+        return pd.DataFrame(
+            {
+                "descendant": descendant,
+                "ancestor": self.ancestors[descendant, ancestorDepth],
+                "distance": depth[descendant] - ancestorDepth,
+            }
+        )
+
+    def encode(self, df: pd.DataFrame, level: str) -> np.ndarray:
+        """`df` 每行在 `level` 级的节点编号, 不在索引中的为 -1"""
+        codes = self._levels[level].get_indexer(
+            pd.MultiIndex.from_frame(df[orgPath(level)])
+        )
+        return np.where(codes >= 0, codes + self._offsets[level], -1)
+
+    def ancestorOf(self, codes: np.ndarray, level: str) -> np.ndarray:
+        """节点在 `level` 级的上级的编号. 无效编号和更深的层级为 -1"""
+        codes = np.asarray(codes)
+        out = self.ancestors[np.maximum(codes, 0), ORGS.index(level)]
+        return np.where(codes >= 0, out, -1)
+
+    def names(self, codes: np.ndarray, level: str) -> List[pd.Index]:
+        """节点编号对应的 `level` 级组织名称, 每列一个数组, 类型与源数据的列相同"""
+        return [pd.Index(self.nodes[col].array.take(codes)) for col in orgPath(level)]
+
+    def rollup(self, obj: pd.Series | pd.DataFrame, level: str):
+        """汇总到 `level` 级
+
+        `obj` 索引的第 0 级为 (同级或下级) 节点编号, 其余各级 (如合同类型) 保留.
+        结果的索引与按组织名称 `groupby(..., dropna=False)` 的结果相同.
+        """
+        codes = self.ancestorOf(obj.index.get_level_values(0), level)
+        others = [obj.index.get_level_values(i) for i in range(1, obj.index.nlevels)]
+        return (
+            obj.groupby(self.names(codes, level) + others, sort=True, dropna=False)
+            .sum()
+            .rename_axis(orgPath(level) + obj.index.names[1:])
+        )
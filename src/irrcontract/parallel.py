@@ -0,0 +1,150 @@
+"""多进程分区执行
+
+分类, 全量不规范合同筛选和组织机构计数对每个分公司相互独立. `execute` 按组织机构
+(默认为分公司) 的哈希值把合同表分区, 在进程池中并行处理, 再合并各分区的结果:
+
+- 分区和查找表以 Arrow 格式发布到共享内存 (`pyinpark.shared`) 一次, 工作进程
+  按句柄挂载, 不随任务或进程初始化序列化
+- 各分区先推断数据类型, 统一为整表的类型后再分类 (同 `irrcontract.chunked`)
+- 各分区的计数合并后再计算合计和比率, 输出与单进程执行完全相同
+"""
+
+from __future__ import annotations
+
+import importlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from pyinpark import shared
+from pyinpark.lazy import lazy_import
+
+from irrcontract import chunked, pipeline
+from irrcontract.chunked import Chunked, Dtypes
+from irrcontract.pipeline import Counts
+
+if TYPE_CHECKING:
+    import arrow
+    import numpy as np
+    import pandas as pd
+else:
+    np = lazy_import("numpy")
+    pd = lazy_import("pandas")
+
+# 工作进程中共用的查找表和执行引擎, 由 `_init` 设置
+_shared = {}
+
+
+def _init(
+    engineName: str,
+    resPurpose: shared.SharedRef,
+    unsettlement: shared.SharedRef,
+    whiteList: shared.SharedRef,
+    statDate: arrow.Arrow,
+) -> None:
+    _shared.update(
+        engine=importlib.import_module(engineName),
+        resPurpose=shared.attach(resPurpose),
+        unsettlement=shared.attach(unsettlement),
+        whiteList=shared.attach(whiteList),
+        statDate=statDate,
+    )
+
+
+def _scan(ref: shared.SharedRef) -> Tuple[pd.Series, pd.Series]:
+    return chunked.chunkDtypes(shared.attach(ref))
+
+
+def _execute(
+    ref: shared.SharedRef, dtypes: Dtypes
+) -> Tuple[pd.DataFrame, pd.DataFrame, Counts]:
+    engine = _shared["engine"]
+    dfTp = engine.applyRules(
+        pipeline.prepareContract(shared.attach(ref)).astype(dtypes),
+        _shared["resPurpose"],
+        _shared["unsettlement"],
+        _shared["whiteList"],
+    )
+    return (
+        dfTp,
+        engine.irregular(dfTp, _shared["unsettlement"], _shared["statDate"]),
+        chunked.partialCounts(dfTp),
+    )
+
+
+# %%
+# 分区
+# ====
+
+
+def partition(contract: pd.DataFrame, by: str, n: int) -> List[np.ndarray]:
+    """按 `by` 列的哈希值分为至多 `n` 个分区, 返回各分区的行号"""
+    codes = (
+        pd.util.hash_pandas_object(contract[by], index=False).to_numpy() % n
+        if n > 1
+        else np.zeros(len(contract), dtype="uint64")
+    )
+    parts = [np.flatnonzero(codes == i) for i in range(n)]
+    return [p for p in parts if len(p)] or [parts[0]]
+
+
+def _restore(parts: List[pd.DataFrame], index: pd.Index) -> pd.DataFrame:
+    """按原始行序合并各分区的结果, 并恢复原始索引"""
+    return (
+        pd.concat(parts)
+        .sort_index(kind="stable")
+        .pipe(lambda df: df.set_axis(index.take(df.index.to_numpy())))
+    )
+
+
+def execute(
+    contract: pd.DataFrame,
+    resPurpose: pd.DataFrame,
+    unsettlement: pd.DataFrame,
+    whiteList: pd.DataFrame,
+    statDate: arrow.Arrow,
+    workers: Optional[int] = None,
+    by: str = "branch",
+    engine=pipeline,
+) -> Chunked:
+    """多进程完成分类, 全量不规范合同筛选和组织机构汇总
+
+    - `workers`: 工作进程数, 默认为 CPU 核心数
+    - `by`: 分区所依据的组织机构层级
+    """
+    workers = workers if workers is not None else os.cpu_count() or 1
+    # 以行号作为索引, 合并时据此恢复原始行序
+    positioned = contract.set_axis(pd.RangeIndex(len(contract)))
+
+    with shared.SharedFrames() as frames:
+        refs = [
+            frames.publish(f"part-{i}", positioned.iloc[rows])
+            for i, rows in enumerate(partition(positioned, by, workers))
+        ]
+        lookups = frames.publish_all(
+            {
+                "resPurpose": resPurpose,
+                "unsettlement": unsettlement,
+                "whiteList": whiteList,
+            }
+        )
+
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(refs)),
+            initializer=_init,
+            initargs=(
+                engine.__name__,
+                lookups["resPurpose"],
+                lookups["unsettlement"],
+                lookups["whiteList"],
+                statDate,
+            ),
+        ) as pool:
+            dtypes = chunked.resolveDtypes(pool.map(_scan, refs))
+            tps, irrs, partials = zip(*pool.map(_execute, refs, [dtypes] * len(refs)))
+
+    return Chunked(
+        dfTp=_restore(tps, contract.index),
+        dfIrr=_restore(irrs, contract.index),
+        counts=chunked.mergeCounts(partials),
+    )
@@ -0,0 +1,425 @@
+"""不规范合同识别与统计
+
+prog.py 取数之后的全部处理步骤. 每个步骤都是纯函数, 输入输出均为 DataFrame.
+"""
+from __future__ import annotations
+
+from collections import namedtuple
+from functools import partial
+from operator import contains, eq
+from typing import TYPE_CHECKING, List
+
+import toolz.curried as tz
+from pyinpark.lazy import lazy_import
+from pyinpark.pdfp import get_values_by_keys
+
+from irrcontract.constants import (
+    CATEGORIES,
+    CATEGORY,
+    DPT_ID,
+    IRR_CATEGORY,
+    ORGS,
+    PRJ_IDS,
+)
+from irrcontract.orgindex import OrgIndex, orgPath
+
+if TYPE_CHECKING:
+    import arrow
+    import numpy as np
+    import pandas as pd
+else:
+    np = lazy_import("numpy")
+    pd = lazy_import("pandas")
+
+
+# %%
+# 取数需求
+# =======
+
+Need = namedtuple("Need", ["columns", "where"])
+
+# 各查询结果中处理步骤实际用到的列, 以及可以在数据库中提前执行的过滤条件.
+# `prog` 据此改写查询, 只取用到的数据
+NEEDS = {
+    "contract": Need(
+        columns=ORGS
+        + CATEGORIES
+        + [
+            "contract_id",
+            "contract_no",
+            "project_id",
+            "dept_id",
+            "condition_date",
+            "compute_date",
+            "apply_approve_date",
+        ],
+        # 无锡太湖新城, 见 `prepareContract`. 空值仍由 `prepareContract` 排除
+        where=f"(dept_id IS NULL OR dept_id <> {DPT_ID})",
+    ),
+    "resPurpose": Need(columns=["contract_id"], where=None),
+    "unsettlement": Need(columns=["obj_id", "contract_no", "owe_fee"], where=None),
+    "organization": Need(columns=ORGS, where=None),
+}
+
+# 处理步骤在合同数据上增加的列
+DERIVED_COLUMNS = ["statistic_date", "reason"]
+
+
+# %%
+# 处理当期数据
+# ===========
+
+
+def prepareContract(contract: pd.DataFrame) -> pd.DataFrame:
+    return (
+        # auto convert data type
+        contract.convert_dtypes()
+        # convert to date type
+        .assign(
+            **{
+                k: pd.to_datetime(contract[k], errors="ignore")
+                for k in contract.columns
+                if ("_date" in k) | ("_time" in k)
+            }
+        )
+        # 无锡太湖新城
+        .pipe(lambda df: df[df["dept_id"] != DPT_ID])
+    )
+
+
+def classify(
+    contract: pd.DataFrame,
+    resPurpose: pd.DataFrame,
+    unsettlement: pd.DataFrame,
+    whiteList: pd.DataFrame,
+) -> pd.DataFrame:
+    return applyRules(prepareContract(contract), resPurpose, unsettlement, whiteList)
+
+
+def applyRules(
+    df: pd.DataFrame,
+    resPurpose: pd.DataFrame,
+    unsettlement: pd.DataFrame,
+    whiteList: pd.DataFrame,
+) -> pd.DataFrame:
+    """对 `prepareContract` 处理后的合同逐行应用识别规则和白名单"""
+    return (
+        df
+        # 合同倒签
+        .assign(
+            # 武汉东湖公寓(壹间.东湖网谷) 重庆九龙公寓 +5 days
+            # 工位, 场地类型的合同 + 5 days
+            compute_date=lambda df: np.where(
+                (df["category"] == "RD")
+                & (
+                    (df["project_id"].isin(PRJ_IDS))
+                    | (df["contract_id"].isin(resPurpose["contract_id"]))
+                ),
+                df["condition_date"] + pd.DateOffset(5),
+                df["compute_date"],
+            ),
+            irr_category=lambda df: np.where(
+                (df["category"] == "RD")
+                & (df["apply_approve_date"] > df["compute_date"]),
+                "RN",
+                df[IRR_CATEGORY],
+            ),
+        )
+        # 应结未结
+        .assign(
+            # 武汉东湖公寓(壹间.东湖网谷) 重庆九龙公寓 +5 days
+            compute_date=lambda df: np.where(
+                (df[CATEGORY] == "TD") & (df["project_id"].isin(PRJ_IDS)),
+                df["condition_date"] + pd.DateOffset(5),
+                df["compute_date"],
+            ),
+            irr_category=lambda df: np.where(
+                (df[CATEGORY] == "TD")
+                & (df["apply_approve_date"] > df["compute_date"]),
+                "TN",
+                df[IRR_CATEGORY],
+            ),
+        )
+        # 应算未算
+        .assign(
+            irr_category=lambda df: np.where(
+                (df[CATEGORY] == "SD")
+                & (df["apply_approve_date"] > df["compute_date"])
+                & (df["contract_id"].isin(unsettlement["obj_id"])),
+                "SN",
+                df[IRR_CATEGORY],
+            ),
+        )
+        # 应用白名单
+        .assign(
+            irr_category=lambda df: np.where(
+                df.set_index(["contract_no", IRR_CATEGORY]).index.isin(
+                    whiteList.set_index(["contract_no", IRR_CATEGORY]).index
+                ),
+                None,
+                df[IRR_CATEGORY],
+            )
+        )
+    )
+
+
+# %%
+# 当期数据落盘
+# ===========
+
+
+def updateHistory(
+    allContracts: pd.DataFrame, dfTp: pd.DataFrame, statDate: arrow.Arrow
+) -> pd.DataFrame:
+    return pd.concat(
+        [
+            allContracts[allContracts["statistic_date"].dt.date != statDate.date()],
+            dfTp.assign(statistic_date=pd.to_datetime(statDate.date())),
+        ]
+    )
+
+
+# %%
+# 全量不合规范合同
+# ===============
+
+
+def irregular(
+    dfTp: pd.DataFrame, unsettlement: pd.DataFrame, statDate: arrow.Arrow
+) -> pd.DataFrame:
+    return dfTp[dfTp[IRR_CATEGORY].notna()].assign(
+        statistic_date=pd.to_datetime(statDate.date()),
+        reason=lambda df: np.where(
+            df[IRR_CATEGORY] == "SN",
+            get_values_by_keys(
+                0, unsettlement["contract_no"], unsettlement["owe_fee"], df["contract_no"]
+            ).map(
+                lambda v: f"应收: {v / 100:,.2f}" if v > 0 else f"应退: {-v / 100:,.2f}"
+            ),
+            df[IRR_CATEGORY].map(
+                lambda v: "合同开始日期: " if v == "RN" else "合同终止日期: "
+            )
+            + df["condition_date"].dt.strftime("%Y-%m-%d")
+            + df[IRR_CATEGORY].map(lambda _: "\n流程审定日期: ")
+            + df["apply_approve_date"].dt.strftime("%Y-%m-%d"),
+        ),
+    )
+
+
+# %%
+# 本期新增不规范合同
+# =================
+
+
+def increase(
+    dfIrr: pd.DataFrame, allContracts: pd.DataFrame, lastStatDate: arrow.Arrow
+) -> pd.DataFrame:
+    return dfIrr[
+        ~(
+            dfIrr.set_index(["contract_no", IRR_CATEGORY]).index.isin(
+                allContracts[
+                    allContracts["statistic_date"].dt.date == lastStatDate.date()
+                ]
+                .set_index((["contract_no", IRR_CATEGORY]))
+                .index
+            )
+        )
+    ]
+
+
+# %%
+# 组织机构与不合规范合同类型全连接
+# ==============================
+
+
+def crossOrgCategories(organization: pd.DataFrame, dfIrr: pd.DataFrame) -> pd.DataFrame:
+    return pd.merge(
+        organization,
+        dfIrr.drop_duplicates(subset=CATEGORIES)[CATEGORIES],
+        how="cross",
+    )
+
+
+# %%
+# 按组织机构统计合同数据
+# ====================
+
+
+@tz.curry
+def countIrr(
+    orgPath: List[str], cate: List[str], fieldName: str, dfIn: pd.DataFrame
+) -> pd.DataFrame:
+    return (
+        dfIn.groupby(by=(orgPath + cate), dropna=False)[[fieldName]]
+        .count()
+        .rename(columns={fieldName: "irr"})
+    )
+
+
+@tz.curry
+def countContractByOrg(
+    orgPath: List[str], cate: List[str], fieldName: str, dfIn: pd.DataFrame
+) -> pd.DataFrame:
+    return countIrr(orgPath, cate, fieldName, dfIn).pipe(withRate)
+
+
+def withRate(dfIrr: pd.DataFrame) -> pd.DataFrame:
+    """由各分组的 `irr` 计数计算同级合计 `total` 和比率 `rate`"""
+    return dfIrr.assign(
+        total=lambda df: df.groupby(level=df.index.names[:-1])["irr"].transform("sum"),
+        rate=lambda df: round(df["irr"] / df["total"], 4),
+    )
+
+
+Counts = namedtuple("Counts", ORGS)
+
+
+def countAll(dfTp: pd.DataFrame) -> Counts:
+    """按最末级组织计数一次, 再由组织层级索引汇总到各级"""
+    index = OrgIndex.build(dfTp)
+    leaf = (
+        dfTp.groupby(
+            [index.encode(dfTp, ORGS[-1])] + [dfTp[c] for c in CATEGORIES],
+            dropna=False,
+        )[["contract_id"]]
+        .count()
+        .rename(columns={"contract_id": "irr"})
+    )
+    return Counts._make([index.rollup(leaf, level).pipe(withRate) for level in ORGS])
+
+
+# %%
+"""生成报表分析数据
+
+根据违规类型按给定的组织机构进行统计分析. 分析结果:
+
+组织机构 -> 违规类型 -> 违规合同数据量 -> 合同总量 -> 违规率 ->
+                      上级机构的违规合同数据 -> 上级机构合同总量 -> 上级机构违规率
+
+`REPORTS` 中的每个 (下级, 上级) 层级组合生成一份报表, 增加报表维度只需增加一项.
+下级与上级的统计数据按组织层级索引的整数编号对应, 不需要按组织名称合并.
+"""
+
+# 报表名 -> (下级, 上级)
+REPORTS = {
+    # 事业部-分公司维度
+    "branch": ("branch", "division"),
+    # 分公司-项目部维度
+    "dept": ("dept", "branch"),
+    # 项目部-项目维度
+    "project": ("project", "dept"),
+    # 分公司-项目维度
+    "prj": ("project", "branch"),
+}
+
+Reports = namedtuple("Reports", list(REPORTS))
+
+METRICS = ["irr", "total", "rate"]
+
+
+def _positions(
+    index: OrgIndex, codes: np.ndarray, cats: pd.DataFrame, df: pd.DataFrame, level: str
+) -> np.ndarray:
+    """(节点编号, 合同类型) 在 `df` (`Counts` 的某一级) 中的行号, 没有为 -1"""
+    dfCats = df.index.droplevel(orgPath(level))
+    allCats = dfCats.unique()
+    width = len(allCats) + 1
+
+    def keys(orgCodes, catCodes):
+        # 任一部分不存在时为 -1
+        return np.where(
+            (orgCodes >= 0) & (catCodes >= 0), orgCodes * width + catCodes, -1
+        )
+
+    dfKeys = keys(
+        index.encode(df.index.to_frame(index=False), level),
+        allCats.get_indexer(dfCats),
+    )
+    found = pd.Index(dfKeys).get_indexer(
+        keys(codes, allCats.get_indexer(pd.MultiIndex.from_frame(cats)))
+    )
+    return np.where(codes >= 0, found, -1)
+
+
+@tz.curry
+def genReport(
+    index: OrgIndex, dfCross: pd.DataFrame, counts: Counts, child: str, ancestor: str
+) -> pd.DataFrame:
+    report = (
+        dfCross[orgPath(child) + CATEGORIES].drop_duplicates().reset_index(drop=True)
+    )
+    childCodes = index.encode(report, child)
+    for level, codes, suffix in [
+        (child, childCodes, ""),
+        (ancestor, index.ancestorOf(childCodes, ancestor), "_p"),
+    ]:
+        df = getattr(counts, level)
+        rows = _positions(index, codes, report[CATEGORIES], df, level)
+        for col in METRICS:
+            # -1 不在索引中, 对应的值为空
+            report[col + suffix] = df[col].reset_index(drop=True).reindex(rows).values
+    return report[report["irr_category"].notna()]
+
+
+def genReports(dfCross: pd.DataFrame, counts: Counts) -> Reports:
+    index = OrgIndex.build(dfCross, getattr(counts, ORGS[-1]).index.to_frame())
+    return Reports._make(
+        [
+            genReport(index, dfCross, counts, child, ancestor).fillna(0)
+            for child, ancestor in REPORTS.values()
+        ]
+    )
+
+
+# %%
+"""本期新增不规范合同报表
+"""
+
+
+def reportIncrease(dfIncrease: pd.DataFrame) -> pd.DataFrame:
+    return (
+        dfIncrease.groupby(by=["branch", "irr_category"])[["contract_id"]]
+        .count()
+        .unstack()
+        .droplevel(0, axis=1)
+        .fillna(0)
+        .assign(
+            RN=lambda df: df["RN"] if contains(df.columns, "RN") else 0,
+            TN=lambda df: df["TN"] if contains(df.columns, "TN") else 0,
+            SN=lambda df: df["SN"] if contains(df.columns, "SN") else 0,
+            total=lambda df: df.sum(axis=1),
+            grand_total=lambda df: df["total"].sum(),
+            proportion=lambda df: round(df["total"] / df["grand_total"], 4),
+        )
+        .rename_axis(None, axis=1)
+        .reset_index()
+    )
+
+
+# %%
+"""事业部各分公司各种不符合规范操作合同的情况以及和事业部平均数据的对比情况
+"""
+
+
+def analyzeOrg(reports: Reports) -> pd.DataFrame:
+    return reports.branch[
+        tz.pipe(reports.branch.columns, tz.remove(partial(eq, "division")), list)
+    ].sort_values(by=["branch", "irr_category"])
+
+
+# %%
+"""事业部各分公司综合情况分析
+"""
+
+
+def analyzeBranch(reports: Reports) -> pd.DataFrame:
+    return (
+        reports.branch[["branch", "irr_category", "rate"]]
+        .fillna(0)
+        .pivot(index="branch", columns="irr_category")
+        .droplevel(0, axis=1)
+        .assign(sum_up=lambda df: df.mean(axis=1))
+        .sort_values(by="sum_up", ascending=False)
+        .rename_axis(None, axis=1)
+        .reset_index()
+    )
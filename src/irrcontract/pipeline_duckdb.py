@@ -0,0 +1,310 @@
+"""DuckDB 执行引擎
+
+与 `irrcontract.pipeline` 接口一致的可选实现: 合同分类, 白名单排除, 本期新增和四级
+组织机构汇总以 SQL 在进程内的 DuckDB 中执行, 输出与 pandas 实现完全相同的 DataFrame.
+
+DuckDB 默认使用全部 CPU 核心; 内存不足时溢写到 `temp_directory`. 查找表
+(`resPurpose`, `unsettlement`, `whiteList`, `allContracts`) 既可以是 DataFrame,
+也可以是 Parquet 缓存文件的路径.
+
+行级的类型转换, `reason` 文本和报表的列整理与 pandas 实现共用, 只有关系运算交给 DuckDB.
+"""
+
+from __future__ import annotations
+
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Union
+
+from pyinpark.lazy import lazy_import
+from pyinpark.pyfp import over_all
+
+from irrcontract import pipeline
+from irrcontract.constants import CATEGORIES, CATEGORY, IRR_CATEGORY, ORGS, PRJ_IDS
+from irrcontract.pipeline import (  # noqa: F401 - 与 pipeline 接口一致
+    Counts,
+    Reports,
+    analyzeBranch,
+    analyzeOrg,
+    crossOrgCategories,
+    genReports,
+    irregular,
+    reportIncrease,
+    updateHistory,
+    withRate,
+)
+
+if TYPE_CHECKING:
+    import arrow
+    import duckdb
+    import numpy as np
+    import pandas as pd
+else:
+    duckdb = lazy_import("duckdb")
+    np = lazy_import("numpy")
+    pd = lazy_import("pandas")
+
+Source = Union["pd.DataFrame", Path, str]
+
+ROW = "__row"
+
+_con: Optional[duckdb.DuckDBPyConnection] = None
+
+
+def connect(
+    threads: Optional[int] = None,
+    memory_limit: Optional[str] = None,
+    temp_directory: Optional[str] = None,
+) -> duckdb.DuckDBPyConnection:
+    """创建进程内 DuckDB 连接
+
+    - `threads`: 默认使用全部 CPU 核心
+    - `memory_limit`: 比如 "4GB", 默认为物理内存的 80%
+    - `temp_directory`: 超出内存限制时的溢写目录
+    """
+    config = {
+        "temp_directory": (
+            temp_directory
+            if temp_directory is not None
+            else str(Path(tempfile.gettempdir()) / "irrcontract.duckdb.tmp")
+        )
+    }
+    if threads is not None:
+        config["threads"] = str(threads)
+    if memory_limit is not None:
+        config["memory_limit"] = memory_limit
+    return duckdb.connect(database=":memory:", config=config)
+
+
+def getConnection() -> duckdb.DuckDBPyConnection:
+    global _con
+    if _con is None:
+        _con = connect()
+    return _con
+
+
+def _register(con: duckdb.DuckDBPyConnection, name: str, src: Source) -> None:
+    if isinstance(src, (str, Path)):
+        con.execute(
+            f"CREATE OR REPLACE TEMP VIEW {name} AS SELECT * FROM read_parquet(?)",
+            [str(src)],
+        )
+    else:
+        con.register(name, src)
+
+
+def _withRow(df: pd.DataFrame, columns) -> pd.DataFrame:
+    return df[columns].assign(**{ROW: np.arange(len(df))})
+
+
+# %%
+# 处理当期数据
+# ===========
+
+CLASSIFY_SQL = f"""
+WITH s1 AS (
+    SELECT
+        *,
+        CASE
+            WHEN category = 'RD'
+                AND (
+                    project_id IN ({", ".join(map(str, PRJ_IDS))})
+                    OR EXISTS (
+                        SELECT 1 FROM resPurpose r
+                        WHERE r.contract_id IS NOT DISTINCT FROM c.contract_id
+                    )
+                )
+            THEN condition_date + INTERVAL 5 DAY
+            ELSE compute_date
+        END AS cd1
+    FROM contract c
+), s2 AS (
+    SELECT
+        *,
+        CASE
+            WHEN category = 'RD' AND apply_approve_date > cd1 THEN 'RN'
+        END AS rn,
+        CASE
+            WHEN category = 'TD' AND project_id IN ({", ".join(map(str, PRJ_IDS))})
+            THEN condition_date + INTERVAL 5 DAY
+            ELSE cd1
+        END AS cd2
+    FROM s1
+), s3 AS (
+    SELECT
+        *,
+        coalesce(
+            rn,
+            CASE
+                WHEN category = 'TD' AND apply_approve_date > cd2 THEN 'TN'
+                WHEN category = 'SD'
+                    AND apply_approve_date > cd2
+                    AND EXISTS (
+                        SELECT 1 FROM unsettlement u
+                        WHERE u.obj_id IS NOT DISTINCT FROM s2.contract_id
+                    )
+                THEN 'SN'
+            END
+        ) AS label
+    FROM s2
+)
+SELECT
+    {ROW},
+    cd2 AS compute_date,
+    label,
+    EXISTS (
+        SELECT 1 FROM whiteList w
+        WHERE w.contract_no IS NOT DISTINCT FROM s3.contract_no
+            AND w.irr_category IS NOT DISTINCT FROM coalesce(label, s3.irr_category)
+    ) AS whitelisted
+FROM s3
+ORDER BY {ROW}
+"""
+
+
+def classify(
+    contract: pd.DataFrame,
+    resPurpose: Source,
+    unsettlement: Source,
+    whiteList: Source,
+    con: Optional[duckdb.DuckDBPyConnection] = None,
+) -> pd.DataFrame:
+    return applyRules(
+        pipeline.prepareContract(contract), resPurpose, unsettlement, whiteList, con
+    )
+
+
+def applyRules(
+    df: pd.DataFrame,
+    resPurpose: Source,
+    unsettlement: Source,
+    whiteList: Source,
+    con: Optional[duckdb.DuckDBPyConnection] = None,
+) -> pd.DataFrame:
+    con = con if con is not None else getConnection()
+    _register(
+        con,
+        "contract",
+        _withRow(
+            df,
+            [
+                "contract_id",
+                "contract_no",
+                "category",
+                "project_id",
+                "condition_date",
+                "compute_date",
+                "apply_approve_date",
+            ],
+        ).assign(irr_category=df[IRR_CATEGORY].astype("string")),
+    )
+    _register(con, "resPurpose", resPurpose)
+    _register(con, "unsettlement", unsettlement)
+    _register(con, "whiteList", whiteList)
+
+    res = con.execute(CLASSIFY_SQL).df()
+
+    # 未命中规则的合同保留原值, 命中白名单的合同置空
+    return df.assign(
+        compute_date=res["compute_date"].to_numpy("datetime64[ns]"),
+        irr_category=np.where(
+            res["whitelisted"].to_numpy(dtype=bool),
+            None,
+            np.where(res["label"].notna(), res["label"], df[IRR_CATEGORY]),
+        ),
+    )
+
+
+# %%
+# 本期新增不规范合同
+# =================
+
+INCREASE_SQL = f"""
+SELECT i.{ROW}
+FROM irr i
+WHERE NOT EXISTS (
+    SELECT 1 FROM history h
+    WHERE CAST(h.statistic_date AS DATE) = CAST(? AS DATE)
+        AND h.contract_no IS NOT DISTINCT FROM i.contract_no
+        AND h.irr_category IS NOT DISTINCT FROM i.irr_category
+)
+ORDER BY i.{ROW}
+"""
+
+
+def increase(
+    dfIrr: pd.DataFrame,
+    allContracts: Source,
+    lastStatDate: arrow.Arrow,
+    con: Optional[duckdb.DuckDBPyConnection] = None,
+) -> pd.DataFrame:
+    con = con if con is not None else getConnection()
+    _register(
+        con,
+        "irr",
+        _withRow(dfIrr, ["contract_no"]).assign(
+            irr_category=dfIrr[IRR_CATEGORY].astype("string")
+        ),
+    )
+    _register(con, "history", allContracts)
+    rows = con.execute(INCREASE_SQL, [lastStatDate.date()]).df()[ROW]
+    return dfIrr.iloc[rows.to_numpy()]
+
+
+# %%
+# 按组织机构统计合同数据
+# ====================
+
+# 一次扫描完成四级汇总: 每个 GROUPING SET 对应一级组织机构
+COUNT_SQL = """
+SELECT
+    {keys},
+    grouping({keys}) AS level,
+    count(contract_id) AS irr
+FROM counted
+GROUP BY GROUPING SETS ({sets})
+"""
+
+
+def countAll(
+    dfTp: pd.DataFrame, con: Optional[duckdb.DuckDBPyConnection] = None
+) -> Counts:
+    con = con if con is not None else getConnection()
+    keys = ORGS + CATEGORIES
+    _register(
+        con,
+        "counted",
+        dfTp[ORGS + [CATEGORY, "contract_id"]].assign(
+            irr_category=dfTp[IRR_CATEGORY].astype("string")
+        ),
+    )
+    paths = [orgs + CATEGORIES for orgs in over_all(ORGS)]
+    # pandas 对可空整型计数得到 Int64, 需保持一致
+    irrDtype = (
+        dfTp.iloc[:0]
+        .groupby(by=CATEGORIES, dropna=False)[["contract_id"]]
+        .count()["contract_id"]
+        .dtype
+    )
+    res = con.execute(
+        COUNT_SQL.format(
+            keys=", ".join(keys),
+            sets=", ".join(f"({', '.join(path)})" for path in paths),
+        )
+    ).df()
+
+    def level(path):
+        # grouping() 按 keys 顺序编码, 未参与分组的列对应位为 1
+        bits = sum(
+            1 << (len(keys) - 1 - i) for i, k in enumerate(keys) if k not in path
+        )
+        return (
+            res[res["level"] == bits][path + ["irr"]]
+            .astype({**{k: dfTp[k].dtype for k in path}, "irr": irrDtype})
+            # 已预聚合, 此处只为得到与 pandas 实现一致的分组索引
+            .groupby(by=path, dropna=False)[["irr"]]
+            .sum()
+            .pipe(withRate)
+        )
+
+    return Counts._make([level(path) for path in paths])
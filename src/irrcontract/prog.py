@@ -1,710 +1,648 @@
-# %%
+"""不规范合同统计
+
+按统计日从远端取数, 识别不规范合同并导出下发数据和分析文件:
+
+    python -m irrcontract.prog -s THU
+
+导入本模块没有任何副作用, 取数, 计算和导出都在 `run` 中完成.
+"""
+from __future__ import annotations
+
 import argparse
+import hashlib
+import json
 from collections import namedtuple
 from functools import partial
-from operator import attrgetter, itemgetter, methodcaller, truth, not_, contains, eq
+from operator import attrgetter, methodcaller
 from pathlib import Path
-import json
-from typing import List, Optional, TypedDict, Dict, Callable, Iterator, Tuple
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Collection,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-import arrow
 import toolz.curried as tz
-import pandas as pd
-import numpy as np
-from dotenv import load_dotenv, find_dotenv
-from pyinpark.cmcloud2 import auth, login, query
-from pyinpark.utils import Weekday, getLastDateByWeekday
-from pyinpark.pdfp import (
-    create_df_from_json,
-    get_value_by_booleans,
-    eq_series,
-)
-from pyinpark.pyfp import over_all
+from pyinpark.lazy import lazy_import
+from pyinpark.utils import Weekday
 
-# %%
-# load environment variables
+from irrcontract._inter_utils_ import getDate
+from irrcontract.constants import DATE_FORMAT
 
-load_dotenv()
-find_dotenv()
+if TYPE_CHECKING:
+    import arrow
+    import pandas as pd
+    import requests
 
-# %%
-# 常量
-# ====
+    from irrcontract.export import ExportPlans
+    from irrcontract.pipeline import Need
+else:
+    pd = lazy_import("pandas")
 
-DATE_FORMAT = "YYYYMMDD"
+root = Path(__file__).parent
 
-ORGS = ["division", "branch", "dept", "project"]
-DIVISION = ORGS[:1]
-BRANCH = ORGS[:2]
-DEPT = ORGS[:3]
-PROJECT = ORGS[:4]
+Paths = namedtuple("Paths", ["data", "out"])
 
-CATEGORY = "category"
-IRR_CATEGORY = "irr_category"
-CATEGORIES = [CATEGORY, IRR_CATEGORY]
+configPath = root / "config/config.fp3.json"
+whiteListPath = root / "config/whitelist.xlsx"
+allContractsPath = root / "config/allContracts.xlsx"
+trendsPath = root / "config/trends.sqlite3"
+snapshotPath = root / "config/classified.pkl"
 
 
 # %%
-parser = argparse.ArgumentParser()
-
 # set command line arguments
 # ==================
 
-# statistics day
 arg_stat_name = "statistics_day"
-parser.add_argument(
-    "-s",
-    f"--{arg_stat_name}",
-    default=Weekday.THU.name,
-    choices=[name for name in Weekday.__members__],
-    help="统计日. 比如: 选择周四作为统计日",
-)
-
-# data directory
 arg_data_name = "data_dir"
-parser.add_argument(
-    "-d", f"--{arg_data_name}", default="data", help="数据存放路径. 基于当前执行路径."
-)
-
-# out directory
 arg_out_name = "out_dir"
-parser.add_argument(
-    "-o", f"--{arg_out_name}", default="out", help="输出文件存放路径. 基于当前执行路径."
-)
-
-
-# %%
-# get command line arguments
-# ==================
+arg_engine_name = "engine"
+arg_chunksize_name = "chunksize"
+arg_jobs_name = "jobs"
+arg_sample_name = "sample"
+arg_full_name = "full"
 
-args = parser.parse_args([])
 
-statistics_day = tz.pipe(args, attrgetter(arg_stat_name))
-data_dir = tz.pipe(args, attrgetter(arg_data_name))
-out_dir = tz.pipe(args, attrgetter(arg_out_name))
+def fraction(value: str) -> float:
+    from irrcontract.sample import checkFraction
 
+    try:
+        return checkFraction(float(value))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
 
-# %%
-# set statistics date
-# ===================
-
-statDate, lastStatDate = tz.pipe(
-    tz.iterate(getLastDateByWeekday(Weekday[statistics_day]), arrow.now().floor("day")),
-    tz.take(3),
-    list,
-    tz.get([1, 2]),
-)
-
-# %%
-# set directories
-# ===================
-
-root = Path(__file__).parent
-Paths = namedtuple("Paths", [data_dir, out_dir])
-paths = Paths._make(
-    [
-        tz.pipe(
-            root / name / statDate.format(DATE_FORMAT),
-            tz.do(lambda p: p.mkdir(parents=True, exist_ok=True)),
-        )
-        for name in Paths._fields
-    ]
-)
 
-# %%
-# query data from remote
-# ======================
+def buildParser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
 
-sql_files = tz.pipe(root / "sql", methodcaller("glob", "*.sql"), list)
-sql_keys = tz.pipe(
-    sql_files,
-    tz.map(tz.compose(tz.last, methodcaller("split", "."), attrgetter("stem"))),
-    list,
-)
-sql_executes = tz.pipe(
-    sql_files,
-    tz.map(
-        tz.compose(
-            methodcaller("replace", "__END_DATE__", statDate.format(DATE_FORMAT)),
-            methodcaller("read_text"),
-        )
-    ),
-    list,
-)
-
-
-# %%
-auth_res = tz.pipe(login(), auth)
-exec_query = partial(query, auth_res)
-
-# %%
-Dfs = namedtuple("Dfs", tz.pipe(sql_keys, sorted))
-dfs = (
-    Dfs._make(
-        [
-            tz.pipe(
-                sql,
-                exec_query,
-                methodcaller("json"),
-                # 服务器响应的数据落盘便于问题排查
-                tz.do(
-                    partial(
-                        json.dump,
-                        fp=(paths.data / f"{key}.response.json").open(mode="w"),
-                        ensure_ascii=False,
-                    )
-                ),
-                itemgetter("data"),
-                create_df_from_json("rows", "column_list"),
-                # # 转存`df`到磁盘
-                tz.do(methodcaller("to_csv", paths.data / f"{key}.csv", index=False)),
-            )
-            for key, sql in tz.pipe(
-                zip(sql_keys, sql_executes), partial(sorted, key=tz.first)
-            )
-        ]
+    # statistics day
+    parser.add_argument(
+        "-s",
+        f"--{arg_stat_name}",
+        default=Weekday.THU.name,
+        choices=[name for name in Weekday.__members__],
+        help="统计日. 比如: 选择周四作为统计日",
     )
-    if tz.pipe(paths.data.glob("*.csv"), list, truth, not_)
-    else Dfs._make([pd.read_csv(csv) for csv in sorted(paths.data.glob("*.csv"))])
-)
 
-# %%
-# 读取配置文件, 白名单和历史所有不规范合同清单
-# =========================================
-
-config = json.load((root / "config/config.fp3.json").open())
-whiteList = pd.read_excel(root / "config/whitelist.xlsx")
-allContractsPath = root / "config/allContracts.xlsx"
-allContracts = pd.read_excel(allContractsPath)
+    # data directory
+    parser.add_argument(
+        "-d", f"--{arg_data_name}", default="data", help="数据存放路径. 基于当前执行路径."
+    )
 
+    # out directory
+    parser.add_argument(
+        "-o", f"--{arg_out_name}", default="out", help="输出文件存放路径. 基于当前执行路径."
+    )
 
-# %%
-# 处理当期数据
-# ===========
-
-# 项目部: 无锡太湖新城
-DPT_ID = 1437241
-# 公寓项目: 武汉东湖公寓(壹间.东湖网谷), 重庆九龙公寓
-PRJ_IDS = [1437202, 1436221]
-
-dfTp = (
-    # auto convert data type
-    dfs.contract.convert_dtypes()
-    # convert to date type
-    .assign(
-        **{
-            k: pd.to_datetime(dfs.contract[k], errors="ignore")
-            for k in dfs.contract.columns
-            if ("_date" in k) | ("_time" in k)
-        }
+    # execution engine
+    parser.add_argument(
+        "-e",
+        f"--{arg_engine_name}",
+        default="pandas",
+        choices=["pandas", "duckdb"],
+        help="执行引擎. duckdb 适用于大数据量, 输出与 pandas 完全相同.",
     )
-    # 无锡太湖新城
-    .pipe(lambda df: df[df["dept_id"] != DPT_ID])
-    # 合同倒签
-    .assign(
-        # 武汉东湖公寓(壹间.东湖网谷) 重庆九龙公寓 +5 days
-        # 工位, 场地类型的合同 + 5 days
-        compute_date=lambda df: np.where(
-            (df["category"] == "RD")
-            & (
-                (df["project_id"].isin(PRJ_IDS))
-                | (df["contract_id"].isin(dfs.resPurpose["contract_id"]))
-            ),
-            df["condition_date"] + pd.DateOffset(5),
-            df["compute_date"],
-        ),
-        irr_category=lambda df: np.where(
-            (df["category"] == "RD") & (df["apply_approve_date"] > df["compute_date"]),
-            "RN",
-            df[IRR_CATEGORY],
+
+    # chunk size
+    parser.add_argument(
+        "-c",
+        f"--{arg_chunksize_name}",
+        type=int,
+        default=None,
+        help=(
+            "分块处理合同表, 每块的行数. 合同表过大无法整体载入内存时使用."
+            " 只限制识别过程的内存, 更新历史清单时仍需全部合同 (-p 抽样预览除外)."
         ),
     )
-    # 应结未结
-    .assign(
-        # 武汉东湖公寓(壹间.东湖网谷) 重庆九龙公寓 +5 days
-        compute_date=lambda df: np.where(
-            (df[CATEGORY] == "TD") & (df["project_id"].isin(PRJ_IDS)),
-            df["condition_date"] + pd.DateOffset(5),
-            df["compute_date"],
-        ),
-        irr_category=lambda df: np.where(
-            (df[CATEGORY] == "TD") & (df["apply_approve_date"] > df["compute_date"]),
-            "TN",
-            df[IRR_CATEGORY],
-        ),
+
+    # worker processes
+    parser.add_argument(
+        "-j",
+        f"--{arg_jobs_name}",
+        type=int,
+        default=None,
+        help="按分公司分区, 使用多个进程并行处理. 与 -c 同时指定时分块处理优先.",
     )
-    # 应算未算
-    .assign(
-        irr_category=lambda df: np.where(
-            (df[CATEGORY] == "SD")
-            & (df["apply_approve_date"] > df["compute_date"])
-            & (df["contract_id"].isin(dfs.unsettlement["obj_id"])),
-            "SN",
-            df[IRR_CATEGORY],
-        ),
+
+    # sample
+    parser.add_argument(
+        "-p",
+        f"--{arg_sample_name}",
+        type=fraction,
+        default=None,
+        help="抽样预览, 按合同 ID 抽取的比例 (0, 1]. 输出另存并标记为样本, 不更新历史.",
     )
-    # 应用白名单
-    .assign(
-        irr_category=lambda df: np.where(
-            df.set_index(["contract_no", IRR_CATEGORY]).index.isin(
-                whiteList.set_index(["contract_no", IRR_CATEGORY]).index
-            ),
-            None,
-            df[IRR_CATEGORY],
-        )
+
+    # full classification
+    parser.add_argument(
+        "-f",
+        f"--{arg_full_name}",
+        action="store_true",
+        help="全部合同重新识别, 不沿用上期未变化合同的识别结果. 不影响输出.",
     )
-)
 
-# %%
-# 当期数据落盘
-# ===========
+    return parser
 
-pd.concat(
-    [
-        allContracts[allContracts["statistic_date"].dt.date != statDate.date()],
-        dfTp.assign(statistic_date=pd.to_datetime(statDate.date())),
-    ]
-).to_excel(allContractsPath, index=False)
 
 # %%
-# 全量不合规范合同
-# ===============
-
-dfIrr = dfTp[dfTp[IRR_CATEGORY].notna()].assign(
-    statistic_date=pd.to_datetime(statDate.date()),
-    reason=lambda df: np.where(
-        df[IRR_CATEGORY] == "SN",
-        df["contract_no"].map(
-            tz.compose(
-                lambda v: f"应收: {v / 100:,.2f}" if v > 0 else f"应退: {-v / 100:,.2f}",
-                get_value_by_booleans(0, dfs.unsettlement["owe_fee"]),
-                eq_series(dfs.unsettlement["contract_no"]),
-            )
-        ),
-        df[IRR_CATEGORY].map(lambda v: "合同开始日期: " if v == "RN" else "合同终止日期: ")
-        + df["condition_date"].dt.strftime("%Y-%m-%d")
-        + df[IRR_CATEGORY].map(lambda _: "\n流程审定日期: ")
-        + df["apply_approve_date"].dt.strftime("%Y-%m-%d"),
-    ),
-)
+# set statistics date & directories
+# =================================
 
 
-# %%
-# 本期新增不规范合同
-# =================
-
-dfIncrease = dfIrr[
-    ~(
-        dfIrr.set_index(["contract_no", IRR_CATEGORY]).index.isin(
-            allContracts[allContracts["statistic_date"].dt.date == lastStatDate.date()]
-            .set_index((["contract_no", IRR_CATEGORY]))
-            .index
-        )
-    )
-]
+def getStatDates(statistics_day: str) -> Tuple[arrow.Arrow, arrow.Arrow]:
+    """return (statDate, lastStatDate)"""
+    return tz.pipe(getDate(Weekday[statistics_day]), list, tz.get([1, 2]))
 
 
-# %%
-# 组织机构与不合规范合同类型全连接
-# ==============================
-
-dfIrrTypeWithPrj = pd.merge(
-    dfs.organization, dfIrr.drop_duplicates(subset=CATEGORIES)[CATEGORIES], how="cross",
-)
-
-
-# %%
-# 按组织机构统计合同数据
-# ====================
-
-
-@tz.curry
-def countContractByOrg(
-    orgPath: List[str], cate: List[str], fieldName: str, dfIn: pd.DataFrame
-) -> pd.DataFrame:
-    return (
-        dfIn.groupby(by=(orgPath + cate), dropna=False)[[fieldName]]
-        .count()
-        .rename(columns={fieldName: "irr"})
-        .assign(
-            total=lambda df: df.groupby(level=df.index.names[:-1])["irr"].transform(
-                "sum"
-            ),
-            rate=lambda df: round(df["irr"] / df["total"], 4),
-        )
+def makePaths(dataDir: str, outDir: str, statDate: arrow.Arrow) -> Paths:
+    return Paths._make(
+        [
+            tz.pipe(
+                root / name / statDate.format(DATE_FORMAT),
+                tz.do(lambda p: p.mkdir(parents=True, exist_ok=True)),
+            )
+            for name in [dataDir, outDir]
+        ]
     )
 
 
-Counts = namedtuple("Counts", ORGS)
-counts = Counts._make(
-    [
-        countContractByOrg(orgs, CATEGORIES, "contract_id", dfTp)
-        for orgs in over_all(ORGS)
-    ]
-)
+# %%
+# query data from remote
+# ======================
 
 
-# %%
-"""生成报表分析数据
+def loadSql(sqlDir: Path, statDate: arrow.Arrow) -> Tuple[List[str], List[str]]:
+    sql_files = tz.pipe(sqlDir, methodcaller("glob", "*.sql"), list)
+    sql_keys = tz.pipe(
+        sql_files,
+        tz.map(tz.compose(tz.last, methodcaller("split", "."), attrgetter("stem"))),
+        list,
+    )
+    sql_executes = tz.pipe(
+        sql_files,
+        tz.map(
+            tz.compose(
+                methodcaller("replace", "__END_DATE__", statDate.format(DATE_FORMAT)),
+                methodcaller("read_text"),
+            )
+        ),
+        list,
+    )
+    return sql_keys, sql_executes
 
-根据违规类型按给定的组织机构进行统计分析. 分析结果:
 
-组织机构 -> 违规类型 -> 违规合同数据量 -> 合同总量 -> 违规率 ->
-                      上级机构的违规合同数据 -> 上级机构合同总量 -> 上级机构违规率
+# 以合同明细为数据的工作表
+CONTRACT_SHEETS = ["irrAll", "irrIncrease"]
 
-生成四份报表:
 
-- 事业部-分公司维度
-- 分公司-项目部维度
-- 项目部-项目维度
-- 分公司-项目维度
-"""
+def fetchNeeds(plans: ExportPlans, allContracts: pd.DataFrame) -> Dict[str, Need]:
+    """`pipeline.NEEDS`, 合同查询另外加上明细工作表导出的列和历史清单中保存的列
 
+    历史清单保存全部合同列, 按其列顺序排在前面, 保持清单的列不变.
+    """
+    from irrcontract.pipeline import DERIVED_COLUMNS, NEEDS
 
-@tz.curry
-def genReport(
-    dfCross: pd.DataFrame, childDf: pd.DataFrame, parentDf: pd.DataFrame
-) -> pd.DataFrame:
-    return (
-        pd.merge(
-            dfCross[childDf.index.names].drop_duplicates(),
-            childDf.reset_index(),
-            how="left",
-            on=childDf.index.names,
-        )
-        .merge(parentDf, how="left", on=parentDf.index.names, suffixes=("", "_p"))
-        .pipe(lambda df: df[df["irr_category"].notna()])
+    exported = [
+        column
+        for excelPlan in plans.files.values()
+        for key, sheetPlan in excelPlan.sheets.items()
+        if key in CONTRACT_SHEETS
+        for column in sheetPlan.export
+    ]
+    columns = tz.pipe(
+        list(allContracts.columns) + NEEDS["contract"].columns + exported,
+        tz.remove(lambda c: c in DERIVED_COLUMNS),
+        tz.unique,
+        list,
     )
+    return tz.assoc(NEEDS, "contract", NEEDS["contract"]._replace(columns=columns))
+
+
+def statementBody(sql: str) -> str:
+    """去掉单条 SQL 末尾的注释, 空白和分号, 以便作为子查询
+
+    字符串, 引号标识符和注释中的内容不受影响. 包含多条语句 (末尾以外还有分号) 时
+    抛出 `ValueError`.
+    """
+    i, end, n = 0, 0, len(sql)
+    semicolons = []
+    while i < n:
+        c = sql[i]
+        if c in "'\"`":
+            # 引号内的内容, 转义和连写两次的引号都不结束
+            i += 1
+            while i < n:
+                if (sql[i] == "\\" and c != "`") or sql.startswith(c * 2, i):
+                    i += 2
+                elif sql[i] == c:
+                    break
+                else:
+                    i += 1
+            i = end = min(i + 1, n)
+        elif sql.startswith("--", i) or c == "#":
+            newline = sql.find("\n", i)
+            i = n if newline < 0 else newline
+        elif sql.startswith("/*", i):
+            close = sql.find("*/", i + 2)
+            i = n if close < 0 else close + 2
+        else:
+            if c == ";":
+                semicolons.append(i)
+            elif not c.isspace():
+                end = i + 1
+            i += 1
+    if any(pos < end for pos in semicolons):
+        raise ValueError("SQL template must contain a single statement")
+    return sql[:end]
+
+
+def pushdown(sql: str, need: Optional[Need]) -> str:
+    """把查询包装为子查询, 只取需要的列并在数据库中先过滤"""
+    if need is None:
+        return sql
+    # 模板末尾可能有分号和注释
+    body = statementBody(sql)
+    sql = f"SELECT {', '.join(f'`{c}`' for c in need.columns)} FROM (\n{body}\n) t"
+    return sql if need.where is None else f"{sql} WHERE {need.where}"
+
+
+class FetchError(RuntimeError):
+    """部分查询失败. 成功的查询已经保存, 再次运行时只重新执行失败的查询"""
+
+    def __init__(self, errors: Dict[str, BaseException]) -> None:
+        self.errors = errors
+        super().__init__(
+            "fetch failed for "
+            + ", ".join(f"{k} ({type(e).__name__}: {e})" for k, e in errors.items())
+        )
 
 
-# - branch: 事业部-分公司维度
-# - dept: 分公司-项目部维度
-# - project: 项目部-项目维度
-# - prj: 分公司-项目维度
-Reports = namedtuple("Reports", ["branch", "dept", "project", "prj"])
-reports = Reports(
-    branch=genReport(dfIrrTypeWithPrj, counts.branch, counts.division).fillna(0),
-    dept=genReport(dfIrrTypeWithPrj, counts.dept, counts.branch).fillna(0),
-    project=genReport(dfIrrTypeWithPrj, counts.project, counts.dept).fillna(0),
-    prj=genReport(dfIrrTypeWithPrj, counts.project, counts.branch).fillna(0),
-)
+def checkpointPaths(dataDir: Path, key: str) -> Tuple[Path, Path]:
+    """return (csv, 完成标记)"""
+    return dataDir / f"{key}.csv", dataDir / f"{key}.done"
+
+
+def sqlDigest(sql: str) -> str:
+    return hashlib.sha256(sql.encode("utf8")).hexdigest()
+
+
+def isComplete(dataDir: Path, key: str, sql: str) -> bool:
+    """csv 有完成标记, 且标记记录的 SQL 和文件大小与当前一致"""
+    csv, done = checkpointPaths(dataDir, key)
+    try:
+        marker = json.loads(done.read_text(encoding="utf8"))
+        return marker["sql"] == sqlDigest(sql) and csv.stat().st_size == marker["bytes"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+
+
+def saveCheckpoint(
+    dataDir: Path,
+    key: str,
+    sql: str,
+    frames: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+) -> Path:
+    """先写临时文件再改名, 最后写完成标记; 中途失败不会留下被当作完整结果的 csv
+
+    `frames` 为 DataFrame 或依次追加的多批 DataFrame (第一批写表头).
+    调用方持有 csv 的 `FileLock`.
+    """
+    from pyinpark.atomic import atomic_path
+
+    csv, done = checkpointPaths(dataDir, key)
+    done.unlink(missing_ok=True)
+    rows = 0
+
+    def writeCsv(tmp):
+        nonlocal rows
+        with tmp.open("w", encoding="utf8", newline="") as f:
+            for i, df in enumerate(
+                [frames] if isinstance(frames, pd.DataFrame) else frames
+            ):
+                df.to_csv(f, header=i == 0, index=False)
+                rows += len(df)
+
+    for path, write in [
+        (csv, writeCsv),
+        (
+            done,
+            lambda tmp: tmp.write_text(
+                json.dumps(
+                    {
+                        "key": key,
+                        "sql": sqlDigest(sql),
+                        "rows": rows,
+                        "bytes": csv.stat().st_size,
+                    }
+                ),
+                encoding="utf8",
+            ),
+        ),
+    ]:
+        with atomic_path(path) as tmp:
+            write(tmp)
+    return csv
+
+
+def fetch(
+    dataDir: Path,
+    sql_keys: List[str],
+    sql_executes: List[str],
+    onDisk: Collection[str] = (),
+    signIn: Optional[Callable[[], requests.Response]] = None,
+):
+    """取数并缓存为 csv. `onDisk` 中的表只落盘, 返回 csv 文件路径而不是 DataFrame
+
+    每个查询的结果单独保存并写完成标记 (`<key>.done`), 只执行没有完整结果的查询.
+    单个查询失败不影响其余查询, 全部执行后抛出 `FetchError`. `signIn` 返回认证后的
+    响应, 默认每次重新登录, 全部结果都已保存时不登录.
+
+    响应边接收边解析, 按批追加到 csv, 取数时的内存占用取决于批大小而不是结果集大小;
+    返回的 DataFrame 从 csv 读回.
+
+    同一数据目录可以被多个进程同时使用: 每个查询在 csv 的独占锁内执行, 等到锁的进程
+    发现结果已完整时直接使用; 读取结果时持有共享锁.
+    """
+    from pyinpark.archive import ResponseArchiver
+    from pyinpark.atomic import FileLock
+    from pyinpark.cmcloud2 import query_frames
+
+    Dfs = namedtuple("Dfs", tz.pipe(sql_keys, sorted))
+    queries = tz.pipe(zip(sql_keys, sql_executes), partial(sorted, key=tz.first))
+    pending = [(key, sql) for key, sql in queries if not isComplete(dataDir, key, sql)]
+
+    if pending:
+        authRes = (signIn or Inputs.signIn)()
+        errors = {}
+
+        # 服务器响应的数据落盘便于问题排查 (后台线程压缩归档)
+        with ResponseArchiver(dataDir) as archiver:
+            for key, sql in pending:
+                try:
+                    with FileLock(checkpointPaths(dataDir, key)[0]):
+                        # 其他进程可能已经在等锁期间取完
+                        if isComplete(dataDir, key, sql):
+                            continue
+                        with archiver.stream(key) as sink:
+                            # 转存到磁盘
+                            saveCheckpoint(
+                                dataDir, key, sql, query_frames(authRes, sql, sink=sink)
+                            )
+                except Exception as e:
+                    errors[key] = e
+        if errors:
+            raise FetchError(errors)
+
+    results, missing = {}, {}
+    for key, sql in queries:
+        csv = checkpointPaths(dataDir, key)[0]
+        with FileLock(csv, shared=True):
+            if not isComplete(dataDir, key, sql):
+                missing[key] = FileNotFoundError("no complete result")
+            else:
+                results[key] = csv if key in onDisk else pd.read_csv(csv)
+    if missing:
+        raise FetchError(missing)
+
+    return Dfs._make([results[key] for key, _ in queries])
 
 
 # %%
-"""本期新增不规范合同报表
-"""
+# 运行
+# ====
 
-rptIncrease = (
-    dfIncrease.groupby(by=["branch", "irr_category"])[["contract_id"]]
-    .count()
-    .unstack()
-    .droplevel(0, axis=1)
-    .fillna(0)
-    .assign(
-        RN=lambda df: df["RN"] if contains(df.columns, "RN") else 0,
-        TN=lambda df: df["TN"] if contains(df.columns, "TN") else 0,
-        SN=lambda df: df["SN"] if contains(df.columns, "SN") else 0,
-        total=lambda df: df.sum(axis=1),
-        grand_total=lambda df: df["total"].sum(),
-        proportion=lambda df: round(df["total"] / df["grand_total"], 4),
-    )
-    .rename_axis(None, axis=1)
-    .reset_index()
-)
 
-# %%
-"""事业部各分公司各种不符合规范操作合同的情况以及和事业部平均数据的对比情况
-"""
+class Inputs:
+    """`run` 的输入: 导出配置, 白名单, 历史不规范合同清单和网关登录
 
-anlOrg = reports.branch[
-    tz.pipe(reports.branch.columns, tz.remove(partial(eq, "division")), list)
-].sort_values(by=["branch", "irr_category"])
+    每次调用都重新读取. 常驻进程 (`irrcontract.daemon`) 以缓存的实现代替.
+    """
 
-# %%
-"""事业部各分公司综合情况分析
-"""
+    def plans(self) -> ExportPlans:
+        from irrcontract import export
 
-anlBranch = (
-    reports.branch[["branch", "irr_category", "rate"]]
-    .fillna(0)
-    .pivot(index="branch", columns="irr_category")
-    .droplevel(0, axis=1)
-    .assign(sum_up=lambda df: df.mean(axis=1))
-    .sort_values(by="sum_up", ascending=False)
-    .rename_axis(None, axis=1)
-    .reset_index()
-)
+        # 配置文件有误时在取数之前即报错
+        return export.loadPlans(configPath, check=export.checkConfig)
 
-# %%
-# typing config (json)
+    def whiteList(self) -> pd.DataFrame:
+        return pd.read_excel(whiteListPath)
 
-Column = TypedDict(
-    "Column",
-    {"name": str, "dict": Optional[Dict[str, str]], "formatter": Optional[str]},
-)
-Columns = Dict[str, Column]
-
-Sort = TypedDict("Sort", {"ascending": bool, "value": List[str]})
-
-Sheet = TypedDict(
-    "Sheet",
-    {
-        "sheetName": str,
-        "columns": Optional[Columns],
-        "export": List[str],
-        "sort": Sort,
-    },
-)
-Sheets = Dict[str, Sheet]
+    def allContracts(self) -> pd.DataFrame:
+        return pd.read_excel(allContractsPath)
 
-ExcelFile = TypedDict("ExcelFile", {"name": str, "sheets": Dict[str, Sheet]})
+    def updateAllContracts(
+        self, update: Callable[[pd.DataFrame], pd.DataFrame]
+    ) -> pd.DataFrame:
+        """在独占锁内重新读取历史清单, 写入 `update` 的结果并返回
 
-Config = TypedDict("Config", {"columns": Columns, "ExcelFiles": Dict[str, ExcelFile]})
+        并行运行的进程各自更新不同的统计日, 互不覆盖.
+        """
+        from pyinpark.atomic import FileLock, atomic_path
 
-# %%
-# help function for config (json)
+        with FileLock(allContractsPath):
+            df = update(pd.read_excel(allContractsPath))
+            with atomic_path(allContractsPath) as tmp:
+                df.to_excel(tmp, index=False)
+        return df
 
-# getExcelFile :: Config -> str -> ExcelFile
-def getExcelFile(excelFileKey):
-    return tz.get_in(["ExcelFiles", excelFileKey])
+    @staticmethod
+    def signIn() -> requests.Response:
+        from pyinpark.cmcloud2 import auth, login
 
+        return tz.pipe(login(), auth)
 
-# getSheet :: ExcelFile -> str -> Sheet
-def getSheet(sheetKey):
-    return tz.get_in(["sheets", sheetKey])
 
+def getEngine(name: str):
+    """返回与 `irrcontract.pipeline` 接口一致的执行引擎模块"""
+    if name == "duckdb":
+        from irrcontract import pipeline_duckdb
 
-# getColumns :: Sheet | Config -> Columns
-def getColumns(d):
-    v = tz.get_in(["columns"], d)
-    return v if v else {}
+        return pipeline_duckdb
 
+    from irrcontract import pipeline
 
-# getColumn :: Columns -> str -> Column
-def getColumn(columnKey):
-    return tz.get_in([columnKey], default={})
+    return pipeline
 
 
-@tz.curry
-def getRealColumn(columnKey, sheetKey, excelFileKey, cfg):
-    return tz.pipe(
-        cfg,
-        tz.juxt(
-            tz.compose(getColumn(columnKey), getColumns),
-            tz.compose(
-                getColumn(columnKey),
-                getColumns,
-                getSheet(sheetKey),
-                getExcelFile(excelFileKey),
-            ),
-        ),
-        tz.merge,
-    )
+def run(args: argparse.Namespace, inputs: Optional[Inputs] = None) -> None:
+    from pyinpark.metrics import get_metrics
 
+    from irrcontract import export
+    from irrcontract.trends import TrendStore
 
-# Testing
-# =======
-
-# Be lazy and test with actual data
-
-assert getRealColumn("branch", "irrAll", "issue", config) == {
-    "name": "分公司",
-    "dict": None,
-    "formatter": None,
-}
-
-assert getRealColumn("irr_p", "rptBranch", "issue", config) == {
-    "name": "事业部不合规范合同数量",
-    "dict": None,
-    "formatter": None,
-}
-
-
-assert getRealColumn("over_type", "rptBranch", "issue", config) == {
-    "name": "合同终止类型",
-    "dict": {
-        "1": "正常终止",
-        "2": "提前终止",
-        "3": "续签终止",
-        "4": "延后终止",
-        "5": "变更终止",
-        "6": "更名终止",
-        "7": "合同解约",
-    },
-    "formatter": None,
-}
-
-assert getRealColumn("rate", "anlOrg", "analysis", config) == {
-    "name": "不合规范合同比率",
-    "dict": None,
-    "formatter": "{:.2%}",
-}
+    inputs = inputs if inputs is not None else Inputs()
+    pipeline = getEngine(getattr(args, arg_engine_name))
 
-# %%
-# helper function for style
-# =========================
-
-
-@tz.curry
-def highlightRow(
-    predicate: Callable[[pd.Series, pd.DataFrame], bool], props: str, df: pd.DataFrame,
-) -> pd.DataFrame:
-    return df.apply(
-        lambda currentRow: np.where(predicate(currentRow, df), props, None),
-        # axis=1: apply function to row
-        axis=1,
-        # result_type="broadcast": return DataFrame
-        result_type="broadcast",
+    statDate, lastStatDate = getStatDates(getattr(args, arg_stat_name))
+    paths = makePaths(
+        getattr(args, arg_data_name), getattr(args, arg_out_name), statDate
     )
 
-
-# AR: Account Receivable
-# columnName -> (pd.Serial, pd.DataFrame) -> bool
-@tz.curry
-def containsSeries(contained, columnName):
-    return lambda currentRow, _: contained in currentRow[columnName]
-
-
-# children -> parent -> (pd.Serial, pd.DataFrame) -> bool
-@tz.curry
-def greaterThan(leftColumnName, rightColumnName):
-    return (
-        lambda currentRow, _: currentRow[leftColumnName] > currentRow[rightColumnName]
+    plans = inputs.plans()
+
+    # 读取白名单和历史所有不规范合同清单
+    whiteList = inputs.whiteList()
+    allContracts = inputs.allContracts()
+
+    # 只取处理步骤用到的列和行
+    sqlKeys, sqlExecutes = loadSql(root / "sql", statDate)
+    needs = fetchNeeds(plans, allContracts)
+    chunksize = getattr(args, arg_chunksize_name)
+    dfs = fetch(
+        paths.data,
+        sqlKeys,
+        [pushdown(sql, needs.get(key)) for key, sql in zip(sqlKeys, sqlExecutes)],
+        onDisk=["contract"] if chunksize else [],
+        signIn=inputs.signIn,
     )
 
+    sampleFraction = getattr(args, arg_sample_name)
+    if sampleFraction:
+        from irrcontract import sample
 
-# columnName -> (pd.Serial, pd.DataFrame) -> bool
-@tz.curry
-def eqMax(columnName):
-    return lambda currentRow, df: currentRow[columnName] == df[columnName].max()
-
-
-@tz.curry
-def containStyler(contained, columnName, renameColumns):
-    return highlightRow(
-        containsSeries(contained, renameColumns[columnName]),
-        "background-color: lightpink",
-    )
-
+        dfs, whiteList, allContracts = sample.sampleInputs(
+            dfs, whiteList, allContracts, sampleFraction, chunksize
+        )
+        paths = paths._replace(out=sample.outDir(paths.out))
+        plans = sample.markPlans(plans)
+
+    if chunksize:
+        from irrcontract import chunked
+
+        dfTp, dfIrr, counts = chunked.execute(
+            dfs.contract,
+            dfs.resPurpose,
+            dfs.unsettlement,
+            whiteList,
+            statDate,
+            chunksize=chunksize,
+            engine=pipeline,
+            # 只有更新历史清单需要全部合同
+            keep=not sampleFraction,
+        )
+    elif getattr(args, arg_jobs_name):
+        from irrcontract import parallel
+
+        dfTp, dfIrr, counts = parallel.execute(
+            dfs.contract,
+            dfs.resPurpose,
+            dfs.unsettlement,
+            whiteList,
+            statDate,
+            workers=getattr(args, arg_jobs_name),
+            engine=pipeline,
+        )
+    else:
+        from irrcontract import changes
+
+        # 只识别新增或变化的合同, 其余沿用上期的结果
+        snapshot = (
+            changes.Snapshot.empty(pipeline)
+            if getattr(args, arg_full_name)
+            else changes.Snapshot.load(snapshotPath, pipeline)
+        )
+        classified = changes.classify(
+            dfs.contract,
+            dfs.resPurpose,
+            dfs.unsettlement,
+            whiteList,
+            statDate,
+            snapshot,
+            engine=pipeline,
+        )
+        dfTp, dfIrr = classified.dfTp, classified.dfIrr
+        counts = pipeline.countAll(dfTp)
+        if not sampleFraction:
+            changes.snapshotOf(classified, pipeline).save(snapshotPath)
+
+    # 当期数据落盘 (抽样预览不落盘)
+    if not sampleFraction:
+        inputs.updateAllContracts(
+            lambda current: pipeline.updateHistory(current, dfTp, statDate)
+        )
+        with TrendStore(trendsPath) as store:
+            store.update(statDate, counts)
 
-@tz.curry
-def greaterThanStyler(leftColumnName, rightColumnName, renameColumns):
-    return highlightRow(
-        greaterThan(renameColumns[leftColumnName], renameColumns[rightColumnName]),
-        "background-color: lightpink",
+    dfIncrease = pipeline.increase(dfIrr, allContracts, lastStatDate)
+    reports = pipeline.genReports(
+        pipeline.crossOrgCategories(dfs.organization, dfIrr), counts
     )
-
-
-@tz.curry
-def eqMaxStyler(columnName, renameColumns):
-    return highlightRow(
-        eqMax(renameColumns[columnName]), "background-color: lightpink",
+    rptIncrease = pipeline.reportIncrease(dfIncrease)
+
+    # 导出下发数据
+    #
+    # 包括:
+    #
+    # - 全量不合规合同清单
+    # - 增量不合规合同清单
+    # - 分公司维度统计报表
+    # - 项目部维度统计报表
+    # - 项目维度统计报表
+    # - 分公司+项目维度统计报表
+    # =======================
+
+    issueTuple = zip(
+        [
+            "irrAll",
+            "irrIncrease",
+            "rptBranch",
+            "rptDept",
+            "rptProject",
+            "rptPrj",
+            "rptIncrease",
+        ],
+        [
+            dfIrr,
+            dfIncrease,
+            reports.branch,
+            reports.dept,
+            reports.project,
+            reports.prj,
+            rptIncrease,
+        ],
+        [
+            export.containStyler("应收", "reason"),
+            export.containStyler("应收", "reason"),
+            export.greaterThanStyler("rate", "rate_p"),
+            export.greaterThanStyler("rate", "rate_p"),
+            export.greaterThanStyler("rate", "rate_p"),
+            export.greaterThanStyler("rate", "rate_p"),
+            export.eqMaxStyler("proportion"),
+        ],
     )
 
+    export.toExcel(paths.out, "issue", plans, issueTuple)
 
-# %%
-# help function for export Excel file
-# ###################################
+    # 导出分析文件
+    # ===========
 
+    analysisTuple = zip(
+        ["anlOrg", "anlBranch"],
+        [pipeline.analyzeOrg(reports), pipeline.analyzeBranch(reports)],
+        [export.greaterThanStyler("rate", "rate_p"), export.eqMaxStyler("sum_up")],
+    )
 
-@tz.curry
-def toExcel(
-    outDir: Path,
-    excelFileKey: str,
-    cfg: Config,
-    iter_: Iterator[Tuple[str, pd.DataFrame]],
-):
-    excelFile: ExcelFile = getExcelFile(excelFileKey)(cfg)
-    with pd.ExcelWriter(outDir / excelFile["name"]) as writer:
-        for sheetKey, df, styler in iter_:
-            sheet: Sheet = getSheet(sheetKey)(excelFile)
-            export = sheet["export"]
-            sort = sheet["sort"]
-            columns = tz.merge(getColumns(cfg), getColumns(sheet))
-            remapColumns = tz.pipe(
-                columns,
-                tz.keyfilter(partial(contains, export)),
-                tz.valfilter(tz.get("dict")),
-                tz.valmap(tz.get("dict")),
-            )
-            renameColumns = tz.pipe(
-                columns,
-                tz.keyfilter(partial(contains, export)),
-                tz.valmap(tz.get("name")),
-            )
-            formatters = tz.pipe(
-                columns,
-                tz.keyfilter(partial(contains, export)),
-                tz.valfilter(tz.get("formatter")),
-                methodcaller("values"),
-                tz.map(lambda d: (d["name"], d["formatter"])),
-                dict,
-            )
+    export.toExcel(paths.out, "analysis", plans, analysisTuple)
 
-            (
-                df[export]
-                .replace(remapColumns)
-                .sort_values(by=sort["value"], ascending=sort["ascending"])
-                .rename(columns=renameColumns)
-                .pipe(lambda df: df.set_index(np.arange(1, len(df) + 1)))
-                .style.apply(styler(renameColumns), axis=None)
-                .format(formatter=formatters)
-                .to_excel(writer, sheet_name=sheet["sheetName"],)
-            )
+    # 网关请求的统计指标 (Prometheus 文本格式), 常驻进程中为累计值
+    get_metrics().write_prometheus(paths.out / "gateway.prom")
 
 
-# %%
-# 导出下发数据
-#
-# 包括:
-#
-# - 全量不合规合同清单
-# - 增量不合规合同清单
-# - 分公司维度统计报表
-# - 项目部维度统计报表
-# - 项目维度统计报表
-# - 分公司+项目维度统计报表
-# =======================
-
-issueTuple = zip(
-    [
-        "irrAll",
-        "irrIncrease",
-        "rptBranch",
-        "rptDept",
-        "rptProject",
-        "rptPrj",
-        "rptIncrease",
-    ],
-    [
-        dfIrr,
-        dfIncrease,
-        reports.branch,
-        reports.dept,
-        reports.project,
-        reports.prj,
-        rptIncrease,
-    ],
-    [
-        containStyler("应收", "reason"),
-        containStyler("应收", "reason"),
-        greaterThanStyler("rate", "rate_p"),
-        greaterThanStyler("rate", "rate_p"),
-        greaterThanStyler("rate", "rate_p"),
-        greaterThanStyler("rate", "rate_p"),
-        eqMaxStyler("proportion"),
-    ],
-)
+def main(argv: Optional[List[str]] = None) -> None:
+    from dotenv import find_dotenv, load_dotenv
 
-toExcel(paths.out, "issue", config, issueTuple)
+    # load environment variables
+    load_dotenv()
+    find_dotenv()
 
-# 导出分析文件
-# ===========
+    run(buildParser().parse_args(argv))
 
-analysisTuple = zip(
-    ["anlOrg", "anlBranch"],
-    [anlOrg, anlBranch],
-    [greaterThanStyler("rate", "rate_p"), eqMaxStyler("sum_up")],
-)
 
-toExcel(paths.out, "analysis", config, analysisTuple)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""确定性的抽样预览
+
+修改识别规则或报表格式后, 不必每次都用全量数据运行:
+
+    python -m irrcontract.prog -p 0.05
+
+按 `contract_id` 的哈希值抽取约 5% 的合同, 同一份数据每次抽到的合同相同. 按组织
+机构分层: 每个项目至少保留哈希值最小的一份合同, 报表中的组织机构不会缺失.
+`unsettlement`, `resPurpose`, 白名单和历史清单只保留与样本合同相关的行.
+
+样本的输出写入 `<统计日>-sample` 目录, 文件名以 `SAMPLE-` 开头, 不更新历史清单和
+趋势数据.
+"""
+from __future__ import annotations
+
+from collections import namedtuple
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from pyinpark.lazy import lazy_import
+
+from irrcontract.constants import ORGS
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+    from irrcontract.export import ExportPlans
+else:
+    np = lazy_import("numpy")
+    pd = lazy_import("pandas")
+
+FILE_PREFIX = "SAMPLE-"
+DIR_SUFFIX = "-sample"
+
+Sampled = namedtuple("Sampled", ["dfs", "whiteList", "allContracts"])
+
+
+def checkFraction(fraction: float) -> float:
+    """抽样比例须在 (0, 1] 中, 否则抛出 `ValueError`"""
+    if not 0 < fraction <= 1:
+        raise ValueError(f"sample fraction must be in (0, 1], got {fraction}")
+    return fraction
+
+
+def outDir(out: Path) -> Path:
+    """样本的输出目录, 与全量输出分开"""
+    path = out.with_name(out.name + DIR_SUFFIX)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def markPlans(plans: ExportPlans) -> ExportPlans:
+    """导出文件名加上 `FILE_PREFIX`"""
+    from irrcontract.export import _frozen
+
+    return plans._replace(
+        files=_frozen(
+            {
+                key: excelPlan._replace(name=FILE_PREFIX + excelPlan.name)
+                for key, excelPlan in plans.files.items()
+            }
+        )
+    )
+
+
+def sampleMask(contract: pd.DataFrame, fraction: float) -> pd.Series:
+    """哈希值落在前 `fraction` 的合同, 以及每个项目中哈希值最小的合同"""
+    checkFraction(fraction)
+    h = pd.util.hash_pandas_object(contract["contract_id"].astype(str), index=False)
+    # uint64 -> [0, 1)
+    u = h.to_numpy() / np.float64(2**64)
+    first = (
+        pd.Series(h.to_numpy(), index=contract.index)
+        .groupby([contract[k] for k in ORGS], dropna=False)
+        .transform("min")
+        .to_numpy()
+        == h.to_numpy()
+    )
+    return pd.Series((u < fraction) | first, index=contract.index)
+
+
+def sampleChunks(
+    contract: Path, fraction: float, chunksize: Optional[int] = None
+) -> pd.DataFrame:
+    """分块读取合同表 csv 抽样, 结果与整表读入后按 `sampleMask` 抽样相同
+
+    每块只保留候选行: 哈希值落在前 `fraction` 的合同, 以及该块中每个项目哈希值最小的
+    合同. 每个项目哈希值最小的合同必然是所在块的候选, 因此对候选行再执行一次
+    `sampleMask` 即得到整表的样本. 内存占用取决于块大小和样本大小.
+    """
+    from irrcontract.chunked import DEFAULT_CHUNKSIZE, rawDtypes, readChunks
+
+    checkFraction(fraction)
+    chunksize = chunksize or DEFAULT_CHUNKSIZE
+    dtype = rawDtypes(contract, chunksize)
+    candidates = [
+        chunk[sampleMask(chunk, fraction)]
+        for chunk in readChunks(contract, chunksize, dtype)
+    ]
+    sampled = pd.concat(candidates) if len(candidates) > 1 else candidates[0]
+    return sampled[sampleMask(sampled, fraction)]
+
+
+def sampleInputs(
+    dfs: Tuple,
+    whiteList: pd.DataFrame,
+    allContracts: pd.DataFrame,
+    fraction: float,
+    chunksize: Optional[int] = None,
+) -> Sampled:
+    """`dfs` 为 `prog.fetch` 的结果. 组织机构表保留全部, 其余表按样本合同过滤
+
+    分块处理时合同表为 csv 路径, 按 `chunksize` (默认为 `chunked.DEFAULT_CHUNKSIZE`)
+    行分块抽样; 样本本身不大, 之后整体处理.
+    """
+    contract = dfs.contract
+    if isinstance(contract, pd.DataFrame):
+        contract = contract[sampleMask(contract, fraction)]
+    else:
+        contract = sampleChunks(contract, fraction, chunksize)
+
+    ids, nos = contract["contract_id"], contract["contract_no"]
+    return Sampled(
+        dfs=dfs._replace(
+            contract=contract,
+            resPurpose=dfs.resPurpose[dfs.resPurpose["contract_id"].isin(ids)],
+            unsettlement=dfs.unsettlement[
+                dfs.unsettlement["obj_id"].isin(ids)
+                | dfs.unsettlement["contract_no"].isin(nos)
+            ],
+        ),
+        whiteList=whiteList[whiteList["contract_no"].isin(nos)],
+        allContracts=allContracts[allContracts["contract_no"].isin(nos)],
+    )
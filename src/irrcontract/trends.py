@@ -0,0 +1,219 @@
+"""不规范合同统计的历史趋势
+
+每期 `countAll` 的结果 (各组织层级 x category x irr_category 的 irr/total/rate)
+按统计日保存在 SQLite 文件中, 每次运行只写入当期. 趋势查询直接读取这些汇总数据,
+不需要重新识别和统计历史合同:
+
+>>> store = TrendStore(root / "config/trends.sqlite3")
+>>> store.update(statDate, counts)
+>>> store.rates("branch", window=4)      # 近 4 期滚动违规率
+>>> store.changes("dept", irrCategory="SN")  # 环比变化
+"""
+from __future__ import annotations
+
+import sqlite3
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional, Union
+
+from pyinpark.lazy import lazy_import
+
+from irrcontract.constants import CATEGORIES, CATEGORY, DATE_FORMAT, IRR_CATEGORY, ORGS
+from irrcontract.orgindex import orgPath
+
+if TYPE_CHECKING:
+    import arrow
+    import pandas as pd
+
+    from irrcontract.pipeline import Counts
+else:
+    pd = lazy_import("pandas")
+
+Period = Union[str, "arrow.Arrow"]
+
+COLUMNS = ["period", "level"] + ORGS + CATEGORIES + ["irr", "total", "rate"]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS counts (
+    period TEXT NOT NULL,
+    level TEXT NOT NULL,
+    {", ".join(ORGS + CATEGORIES)},
+    irr INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    rate REAL
+);
+CREATE INDEX IF NOT EXISTS counts_by_level ON counts (level, period);
+"""
+
+# 其他进程正在写入时等待的秒数
+BUSY_TIMEOUT = 30
+
+
+def toPeriod(period: Period) -> str:
+    return period if isinstance(period, str) else period.format(DATE_FORMAT)
+
+
+def flatten(period: str, counts: Counts) -> pd.DataFrame:
+    """把 `Counts` 展开为一张长表, 上级层级中不存在的组织列为空"""
+    return pd.concat(
+        [
+            getattr(counts, level)
+            .reset_index()
+            .assign(period=period, level=level)
+            .reindex(columns=COLUMNS)
+            for level in ORGS
+        ],
+        ignore_index=True,
+    )
+
+
+# %%
+# 汇总数据存储
+# ===========
+
+
+class TrendStore:
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(
+            str(self.path), timeout=BUSY_TIMEOUT, isolation_level=None
+        )
+        # 写入时不阻塞其他进程的趋势查询
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.con.close()
+
+    def __enter__(self) -> "TrendStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def update(self, period: Period, counts: Counts) -> int:
+        """写入 (或替换) 一期的统计结果, 返回写入的行数"""
+        period = toPeriod(period)
+        rows = (
+            flatten(period, counts)
+            .astype(object)
+            .pipe(lambda df: df.where(df.notna(), None))
+            .itertuples(index=False, name=None)
+        )
+        # 开始时即取得写锁, 并行运行的两次更新依次执行
+        self.con.execute("BEGIN IMMEDIATE")
+        try:
+            self.con.execute("DELETE FROM counts WHERE period = ?", (period,))
+            cur = self.con.executemany(
+                f"INSERT INTO counts ({', '.join(COLUMNS)})"
+                f" VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows,
+            )
+            self.con.execute("COMMIT")
+        except BaseException:
+            self.con.execute("ROLLBACK")
+            raise
+        return cur.rowcount
+
+    def periods(self) -> List[str]:
+        return [
+            r[0]
+            for r in self.con.execute(
+                "SELECT DISTINCT period FROM counts ORDER BY period"
+            )
+        ]
+
+    def frame(
+        self,
+        level: str,
+        start: Optional[Period] = None,
+        end: Optional[Period] = None,
+    ) -> pd.DataFrame:
+        """某一层级的原始汇总数据, 可按统计日 [start, end] 筛选"""
+        path = orgPath(level)
+        sql = f"SELECT {', '.join(['period'] + path + CATEGORIES)}, irr, total, rate"
+        sql += " FROM counts WHERE level = ?"
+        params = [level]
+        if start is not None:
+            sql += " AND period >= ?"
+            params.append(toPeriod(start))
+        if end is not None:
+            sql += " AND period <= ?"
+            params.append(toPeriod(end))
+        return pd.read_sql_query(sql + " ORDER BY period", self.con, params=params)
+
+    # %%
+    # 趋势查询
+    # =======
+
+    def rates(
+        self,
+        level: str,
+        irrCategory: Optional[str] = None,
+        category: Optional[str] = None,
+        window: int = 1,
+        start: Optional[Period] = None,
+        end: Optional[Period] = None,
+    ) -> pd.DataFrame:
+        """各组织每期的违规数 irr, 合同总数 total 和违规率 rate
+
+        - `irrCategory`: 只统计该违规类型, 默认为全部违规类型
+        - `category`: 只统计该合同类型, 默认为全部合同
+        - `window`: 大于 1 时为该组织近 `window` 个有数据的统计期的滚动值
+          (irr 与 total 分别累加后相除)
+        """
+        path = orgPath(level)
+        df = self.frame(level, start, end)
+        if category is not None:
+            df = df[df[CATEGORY] == category]
+        isIrr = (
+            df[IRR_CATEGORY].notna()
+            if irrCategory is None
+            else df[IRR_CATEGORY] == irrCategory
+        )
+        out = (
+            df.assign(irr=df["irr"].where(isIrr, 0), total=df["irr"])
+            .groupby(path + ["period"], dropna=False)[["irr", "total"]]
+            .sum()
+            .reset_index()
+            .sort_values(path + ["period"])
+        )
+        if window > 1:
+            out[["irr", "total"]] = (
+                out.groupby(path, dropna=False)[["irr", "total"]]
+                .rolling(window, min_periods=1)
+                .sum()
+                .reset_index(level=list(range(len(path))), drop=True)
+                .astype("int64")
+            )
+        return out.assign(
+            rate=lambda df: round(df["irr"] / df["total"], 4)
+        ).reset_index(drop=True)
+
+    def changes(self, level: str, periods: int = 1, **kwargs) -> pd.DataFrame:
+        """`rates` 的结果附加与前 `periods` 期相比的变化
+
+        - `period_p`: 前期的统计日
+        - `irr_p`, `total_p`, `rate_p`: 前期的值, 组织在前期没有数据时为空
+        - `irr_chg`, `rate_chg`: 本期减前期
+        """
+        path = orgPath(level)
+        df = self.rates(level, **kwargs)
+        allPeriods = sorted(df["period"].unique())
+        prevPeriod = dict(zip(allPeriods[periods:], allPeriods))
+        prev = df[path + ["period", "irr", "total", "rate"]].rename(
+            columns={
+                "period": "period_p",
+                "irr": "irr_p",
+                "total": "total_p",
+                "rate": "rate_p",
+            }
+        )
+        return (
+            df.assign(period_p=df["period"].map(prevPeriod).astype(object))
+            .merge(prev, how="left", on=path + ["period_p"])
+            .assign(
+                irr_chg=lambda df: df["irr"] - df["irr_p"],
+                rate_chg=lambda df: round(df["rate"] - df["rate_p"], 4),
+            )
+        )
@@ -0,0 +1,254 @@
+"""服务器原始响应的压缩归档
+
+原始响应落盘只用于问题排查, 不应拖慢取数主流程. `ResponseArchiver` 在后台线程
+中把响应流式压缩写入 `<key>.response.json.zst` (未安装 `zstandard` 时退化为
+`.gz`), 主线程只负责把字节放入有界队列. 每个文件写完即关闭, 并在
+`manifest.json` 中记录原始/压缩后大小和 sha256 校验值. 流式读取的响应用
+`stream` 逐块提交, 不需要先拼成完整的字节串.
+
+归档失败 (磁盘已满, 没有权限等) 不影响取数: 后台线程记录日志后停止归档, 之后提交的
+响应直接丢弃.
+
+多个进程可以同时归档到同一目录: 归档文件先写临时文件再改名, `manifest.json` 在
+文件锁内重新读取后合并写入.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterator, NamedTuple, Optional, Tuple
+
+from pyinpark.atomic import FileLock, atomic_open, temp_path
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+log = logging.getLogger("pyinpark.archive")
+
+MANIFEST_NAME = "manifest.json"
+
+# 每次写入压缩流的块大小
+CHUNK_SIZE = 1 << 20
+
+# codec -> 文件扩展名
+SUFFIXES = {"zstd": ".zst", "gzip": ".gz"}
+
+
+class ArchiveEntry(NamedTuple):
+    key: str
+    file: str
+    codec: str
+    raw_bytes: int
+    compressed_bytes: int
+    sha256: str
+    archived_at: str
+
+
+def default_codec() -> str:
+    return "zstd" if zstandard is not None else "gzip"
+
+
+def archive_path(directory: Path, key: str, codec: str) -> Path:
+    return directory / f"{key}.response.json{SUFFIXES[codec]}"
+
+
+def _open_compressed(path: Path, codec: str, level: Optional[int]):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("codec 'zstd' requires the zstandard package")
+        cctx = zstandard.ZstdCompressor(level=3 if level is None else level)
+        return cctx.stream_writer(path.open("wb"), closefd=True)
+    return gzip.open(path, "wb", compresslevel=6 if level is None else level)
+
+
+class ResponseArchiver:
+    """后台压缩归档原始响应
+
+    >>> with ResponseArchiver(Path("data/20220901")) as archiver:
+    ...     archiver.submit("contract", response.content)
+    ...     with archiver.stream("rent") as write:
+    ...         for chunk in response.iter_content(CHUNK_SIZE):
+    ...             write(chunk)
+
+    - `max_queue`: 队列中等待压缩的响应 (或块) 数上限, 队列满时 `submit` 阻塞,
+      以此限制未落盘响应占用的内存
+    - 后台线程出错后停止归档, 异常记录在日志和 `error` 中, 不抛给调用方
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        codec: Optional[str] = None,
+        level: Optional[int] = None,
+        max_queue: int = 4,
+    ) -> None:
+        self.directory = Path(directory)
+        self.codec = codec if codec is not None else default_codec()
+        if self.codec not in SUFFIXES:
+            raise ValueError(f"unknown codec: {self.codec}")
+        self.level = level
+        self.manifest_path = self.directory / MANIFEST_NAME
+        self.entries: Dict[str, ArchiveEntry] = _read_manifest(self.manifest_path)
+
+        self._queue: "queue.Queue[Optional[Tuple[str, str, bytes]]]" = queue.Queue(
+            maxsize=max_queue
+        )
+        # 后台线程中正在写入的文件: key -> (临时文件, 压缩流, sha256, 原始大小)
+        self._writing: Dict[str, list] = {}
+        self.error: Optional[BaseException] = None
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="ResponseArchiver", daemon=True
+        )
+        self._thread.start()
+
+    def _put(self, op: str, key: str, payload: bytes = b"") -> None:
+        if self._closed:
+            raise RuntimeError("archiver is closed")
+        if self.error is not None:
+            return
+        self._queue.put((op, key, payload))
+
+    def submit(self, key: str, payload: bytes) -> None:
+        self._put("begin", key)
+        self._put("chunk", key, payload)
+        self._put("end", key)
+
+    @contextmanager
+    def stream(self, key: str) -> Iterator[Callable[[bytes], None]]:
+        """逐块提交同一个响应. 代码块中抛出异常时丢弃未写完的归档"""
+        self._put("begin", key)
+        ok = False
+        try:
+            yield lambda chunk: self._put("chunk", key, bytes(chunk))
+            ok = True
+        finally:
+            self._put("end" if ok else "abort", key)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self) -> "ResponseArchiver":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # 出错后仍需消费队列, 避免 `submit` 永久阻塞
+                continue
+            try:
+                getattr(self, f"_{item[0]}")(*item[1:])
+            except BaseException as e:
+                log.exception("archiving %s failed, archiving disabled", item[1])
+                self.error = e
+                for tmp, f, *_ in self._writing.values():
+                    f.close()
+                    tmp.unlink(missing_ok=True)
+                self._writing.clear()
+
+    def _begin(self, key: str, _: bytes) -> None:
+        path = archive_path(self.directory, key, self.codec)
+        tmp = temp_path(path)
+        f: BinaryIO = _open_compressed(tmp, self.codec, self.level)
+        self._writing[key] = [tmp, f, hashlib.sha256(), 0]
+
+    def _chunk(self, key: str, payload: bytes) -> None:
+        state = self._writing[key]
+        _, f, digest, _ = state
+        view = memoryview(payload)
+        for start in range(0, len(view), CHUNK_SIZE):
+            chunk = view[start : start + CHUNK_SIZE]
+            digest.update(chunk)
+            f.write(chunk)
+        state[3] += len(payload)
+
+    def _abort(self, key: str, _: bytes) -> None:
+        tmp, f, *_ = self._writing.pop(key)
+        f.close()
+        tmp.unlink(missing_ok=True)
+
+    def _end(self, key: str, _: bytes) -> None:
+        tmp, f, digest, raw_bytes = self._writing.pop(key)
+        f.close()
+        path = archive_path(self.directory, key, self.codec)
+        os.replace(tmp, path)
+
+        entry = ArchiveEntry(
+            key=key,
+            file=path.name,
+            codec=self.codec,
+            raw_bytes=raw_bytes,
+            compressed_bytes=path.stat().st_size,
+            sha256=digest.hexdigest(),
+            archived_at=datetime.now().isoformat(timespec="seconds"),
+        )
+        self.entries = _update_manifest(self.manifest_path, {key: entry})
+
+
+def _read_manifest(path: Path) -> Dict[str, ArchiveEntry]:
+    if not path.exists():
+        return {}
+    with path.open(encoding="utf8") as f:
+        return {k: ArchiveEntry(**v) for k, v in json.load(f).items()}
+
+
+def _update_manifest(
+    path: Path, updates: Dict[str, ArchiveEntry]
+) -> Dict[str, ArchiveEntry]:
+    """合并其他进程写入的记录, 返回合并后的全部记录"""
+    with FileLock(path):
+        entries = {**_read_manifest(path), **updates}
+        with atomic_open(path, "w", encoding="utf8") as f:
+            json.dump(
+                {k: v._asdict() for k, v in sorted(entries.items())},
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+    return entries
+
+
+def read_archive(path: Path) -> bytes:
+    """读取归档文件, 返回解压后的原始响应"""
+    path = Path(path)
+    if path.suffix == SUFFIXES["zstd"]:
+        if zstandard is None:
+            raise RuntimeError("reading .zst archives requires the zstandard package")
+        with path.open("rb") as f:
+            return zstandard.ZstdDecompressor().stream_reader(f).read()
+    with gzip.open(path, "rb") as f:
+        return f.read()
+
+
+def load_archive(path: Path) -> Any:
+    """读取归档文件并解析为 JSON"""
+    return json.loads(read_archive(path))
+
+
+def verify_archive(directory: Path) -> Dict[str, bool]:
+    """按 manifest 校验目录下每个归档文件的 sha256"""
+    directory = Path(directory)
+    return {
+        key: hashlib.sha256(read_archive(directory / entry.file)).hexdigest()
+        == entry.sha256
+        for key, entry in _read_manifest(directory / MANIFEST_NAME).items()
+    }
@@ -0,0 +1,149 @@
+"""原子写入与进程间文件锁
+
+同一台机器上并行运行的多个进程 (例如补数与每周的定时任务) 共用数据目录, 输出目录
+和历史清单. 约定:
+
+- 写文件: 先写同目录下的临时文件再 `os.replace`, 读取方只会看到旧文件或完整的新文件
+- 读-改-写共用的文件 (历史清单, 归档清单): 持有 `FileLock` 独占锁, 在锁内重新读取
+- 成组的文件 (查询结果与完成标记): 写入方持有独占锁, 读取方持有共享锁
+
+>>> with atomic_path(path) as tmp:
+...     df.to_excel(tmp, index=False)
+>>> with atomic_open(path, "w", encoding="utf8") as f:
+...     f.write(text)
+>>> with FileLock(path):
+...     ...
+
+`FileLock` 使用 `fcntl.flock`, 是建议锁, 只约束同样加锁的进程. 锁文件为同目录下的
+`.<name>.lock`, 不删除 (删除锁文件会使两个进程各自锁住不同的文件). 没有 `fcntl`
+的平台上只在进程内互斥.
+"""
+
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Any, Dict, Iterator, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+PathLike = Union[str, Path]
+
+_counter = itertools.count()
+
+
+def temp_path(path: PathLike) -> Path:
+    """与 `path` 同目录的临时文件, 保留扩展名 (pandas 按扩展名选择写入引擎)"""
+    path = Path(path)
+    return path.with_name(
+        f".{path.stem}.{os.getpid()}.{next(_counter)}.tmp{path.suffix}"
+    )
+
+
+@contextmanager
+def atomic_path(path: PathLike) -> Iterator[Path]:
+    """返回临时文件路径, 代码块正常结束后改名为 `path`, 出错时删除临时文件"""
+    path = Path(path)
+    tmp = temp_path(path)
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+@contextmanager
+def atomic_open(path: PathLike, mode: str = "w", **kwargs: Any) -> Iterator[IO]:
+    """`open` 临时文件, 关闭后改名为 `path`"""
+    with atomic_path(path) as tmp:
+        with open(tmp, mode, **kwargs) as f:
+            yield f
+
+
+def lock_path(path: PathLike) -> Path:
+    path = Path(path)
+    return path.with_name(f".{path.name}.lock")
+
+
+# 没有 fcntl 时的进程内锁
+_local_locks: Dict[Path, threading.Lock] = {}
+_local_locks_guard = threading.Lock()
+
+
+class FileLock:
+    """`path` 的进程间建议锁
+
+    - `shared`: 共享锁 (读取方), 否则为独占锁
+    - `timeout`: 等待的秒数, `None` 为一直等待, 0 为不等待; 超时抛出 `TimeoutError`
+    """
+
+    def __init__(
+        self,
+        path: PathLike,
+        shared: bool = False,
+        timeout: Optional[float] = None,
+        poll: float = 0.05,
+    ) -> None:
+        self.path = lock_path(path)
+        self.shared = shared and fcntl is not None
+        self.timeout = timeout
+        self.poll = poll
+        self._fd: Optional[int] = None
+        self._local: Optional[threading.Lock] = None
+
+    def acquire(self) -> "FileLock":
+        if self._fd is not None or self._local is not None:
+            raise RuntimeError(f"{self.path} is already held by this FileLock")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+
+        if fcntl is None:
+            with _local_locks_guard:
+                lock = _local_locks.setdefault(self.path.resolve(), threading.Lock())
+            if not lock.acquire(timeout=-1 if self.timeout is None else self.timeout):
+                raise TimeoutError(f"timed out waiting for lock {self.path}")
+            self._local = lock
+            return self
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        op = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, op if deadline is None else op | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise TimeoutError(
+                            f"timed out waiting for lock {self.path}"
+                        ) from None
+                    time.sleep(self.poll)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        return self
+
+    def release(self) -> None:
+        if self._local is not None:
+            self._local.release()
+            self._local = None
+        if self._fd is not None:
+            # 关闭即释放 flock
+            os.close(self._fd)
+            self._fd = None
+
+    @property
+    def locked(self) -> bool:
+        return self._fd is not None or self._local is not None
+
+    def __enter__(self) -> "FileLock":
+        return self.acquire()
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
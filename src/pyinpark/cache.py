@@ -0,0 +1,230 @@
+"""进程内的请求合并与结果缓存
+
+- `SingleFlight`: 相同 key 的并发调用只执行一次, 其余调用等待并共享结果 (或异常)
+- `ByteLRU`: 按字节数 (而非条目数) 限制容量的 LRU, 可选过期时间
+- `ResultCache`: 两者的组合, 先查 LRU, 未命中时合并并发的加载, 并统计命中情况
+
+缓存的对象在调用方之间共享, 调用方不应修改.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional, Tuple
+
+# 默认缓存容量: 256 MiB
+DEFAULT_MAX_BYTES = 256 << 20
+
+
+class CacheStats(NamedTuple):
+    hits: int
+    misses: int
+    # 未命中但与进行中的相同请求合并, 没有再次发送
+    coalesced: int
+    evictions: int
+    entries: int
+    bytes: int
+    max_bytes: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses + self.coalesced
+        return (self.hits + self.coalesced) / total if total else 0.0
+
+
+class _Call:
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """执行 `fn` 或等待进行中的相同调用, 返回 (结果, 是否为共享的结果)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.value, False
+
+
+class ByteLRU:
+    """按字节数限制容量的 LRU
+
+    - `max_bytes`: 容量上限, 超过上限的单个条目不缓存
+    - `ttl`: 条目的有效秒数, None 表示不过期
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, ttl: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (value, nbytes, expires_at)
+        self._items: "OrderedDict[Hashable, Tuple[Any, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """返回 (是否命中, 值)"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return False, None
+            value, nbytes, expires_at = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                self._bytes -= nbytes
+                return False, None
+            self._items.move_to_end(key)
+            return True, value
+
+    def put(self, key: Hashable, value: Any, nbytes: int) -> None:
+        if nbytes > self.max_bytes:
+            return
+        expires_at = (
+            time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        )
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (value, nbytes, expires_at)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, evicted, _) = self._items.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+
+class ResultCache:
+    """合并并发的相同请求, 并把结果缓存在 `ByteLRU` 中
+
+    >>> cache = ResultCache(max_bytes=64 << 20)
+    >>> cache.get_or_load(("query", sql), lambda: (data, len(content)))
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, ttl: Optional[float] = None):
+        self.lru = ByteLRU(max_bytes=max_bytes, ttl=ttl)
+        self.flight = SingleFlight()
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._coalesced = 0
+
+    def get_or_load(
+        self,
+        key: Hashable,
+        load: Callable[[], Tuple[Any, int]],
+        refresh: bool = False,
+    ) -> Any:
+        """`load` 返回 (值, 字节数). `refresh=True` 时忽略已缓存的值重新加载"""
+        return self.lookup(key, load, refresh)[0]
+
+    def lookup(
+        self,
+        key: Hashable,
+        load: Callable[[], Tuple[Any, int]],
+        refresh: bool = False,
+    ) -> Tuple[Any, str]:
+        """同 `get_or_load`, 另外返回本次的结果 ("hit", "miss" 或 "coalesced")"""
+        if not refresh:
+            hit, value = self.lru.get(key)
+            if hit:
+                self._count(hits=1)
+                return value, "hit"
+
+        def leader():
+            if not refresh:
+                # 等锁期间其他调用可能已经完成加载
+                hit, value = self.lru.get(key)
+                if hit:
+                    return value, True
+            value, nbytes = load()
+            self.lru.put(key, value, nbytes)
+            return value, False
+
+        (value, cached), shared = self.flight.do(key, leader)
+        if shared:
+            self._count(coalesced=1)
+            return value, "coalesced"
+        if cached:
+            self._count(hits=1)
+            return value, "hit"
+        self._count(misses=1)
+        return value, "miss"
+
+    def _count(self, hits: int = 0, misses: int = 0, coalesced: int = 0) -> None:
+        with self._lock:
+            self._hits += hits
+            self._misses += misses
+            self._coalesced += coalesced
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                coalesced=self._coalesced,
+                evictions=self.lru.evictions,
+                entries=len(self.lru),
+                bytes=self.lru.nbytes,
+                max_bytes=self.lru.max_bytes,
+            )
+
+    def clear(self) -> None:
+        self.lru.clear()
+
+
+_default: Optional[ResultCache] = None
+_default_lock = threading.Lock()
+
+
+def get_cache() -> ResultCache:
+    """进程内共用的 `ResultCache`"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = ResultCache()
+        return _default
+
+
+def configure_cache(**kwargs) -> ResultCache:
+    """以新的参数替换进程内共用的 `ResultCache`"""
+    global _default
+    with _default_lock:
+        _default = ResultCache(**kwargs)
+        return _default
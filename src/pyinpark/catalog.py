@@ -0,0 +1,395 @@
+"""本地元数据目录
+
+`DBClient.describe_table` / `data_dictionary` 每次都要请求网关. `MetadataCatalog`
+把表结构和数据字典保存在本地 SQLite 文件中, 查找时直接读取本地数据:
+
+- `crawl` 并行抓取一个 db_name 下的全部表 (或指定的表), 已抓取且未过期的表跳过
+- 查找时数据缺失或超过 `ttl` 才请求网关; `offline=True` 时只读本地数据
+- 进程内再缓存一层解析后的结果, 重复查找为微秒级
+- 命令行刷新:
+
+    python -m pyinpark.catalog refresh db_name [tb_name ...]
+    python -m pyinpark.catalog show db_name tb_name
+
+命令行使用与 `cmcloud4.DBArgs` 同名的环境变量 (可写在 .env 中) 创建 `DBClient`,
+目录文件默认为 `~/.cache/pyinpark/catalog.sqlite3`, 可用环境变量
+`PYINPARK_CATALOG` 指定.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from pyinpark.lazy import lazy_import
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from pyinpark.cmcloud4 import DBClient, RemoteData
+else:
+    pd = lazy_import("pandas")
+
+# 默认有效期: 7 天
+DEFAULT_TTL = 7 * 24 * 3600
+
+# 其他进程正在写入时等待的秒数
+BUSY_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tables (
+    db_name TEXT NOT NULL,
+    tb_name TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    dictionary TEXT NOT NULL,
+    description TEXT NOT NULL,
+    PRIMARY KEY (db_name, tb_name)
+);
+CREATE TABLE IF NOT EXISTS columns (
+    db_name TEXT NOT NULL,
+    tb_name TEXT NOT NULL,
+    ordinal INTEGER NOT NULL,
+    column_name TEXT,
+    column_type TEXT,
+    column_comment TEXT,
+    PRIMARY KEY (db_name, tb_name, ordinal)
+);
+CREATE INDEX IF NOT EXISTS columns_by_name ON columns (column_name);
+"""
+
+
+class Entry(NamedTuple):
+    fetched_at: float
+    # `DBClient.data_dictionary` 的结果
+    dictionary: RemoteData
+    # `DBClient.describe_table` 响应中的 data
+    description: RemoteData
+
+
+class CrawlResult(NamedTuple):
+    fetched: List[str]
+    skipped: List[str]
+    # tb_name -> 错误信息
+    failed: Dict[str, str]
+
+
+def default_path() -> Path:
+    env = os.environ.get("PYINPARK_CATALOG")
+    if env:
+        return Path(env)
+    return Path.home() / ".cache" / "pyinpark" / "catalog.sqlite3"
+
+
+def _column_rows(dictionary: RemoteData) -> List[Tuple[Any, Any, Any]]:
+    """从数据字典中取出 (列名, 类型, 注释)"""
+    index = {str(c).upper(): i for i, c in enumerate(dictionary["column_list"])}
+
+    def pick(row, name):
+        i = index.get(name)
+        return row[i] if i is not None and i < len(row) else None
+
+    return [
+        (pick(r, "COLUMN_NAME"), pick(r, "COLUMN_TYPE"), pick(r, "COLUMN_COMMENT"))
+        for r in dictionary["rows"]
+    ]
+
+
+class MetadataCatalog:
+    """
+    - `path`: SQLite 文件, 默认为 `default_path()`
+    - `client`: 用于抓取的 `DBClient`; 为 None 时只能读取本地数据
+    - `ttl`: 本地数据的有效秒数
+    - `workers`: 抓取的线程数, 默认为 `client.limiter` 的上界; 同时进行的请求数
+      由 `client.limiter` 调整
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        client: Optional[DBClient] = None,
+        ttl: float = DEFAULT_TTL,
+        workers: Optional[int] = None,
+    ) -> None:
+        self.path = Path(path) if path is not None else default_path()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.client = client
+        self.ttl = ttl
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._memo: Dict[Tuple[str, str], Entry] = {}
+        self._con = sqlite3.connect(
+            str(self.path),
+            timeout=BUSY_TIMEOUT,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._con.close()
+
+    def __enter__(self) -> "MetadataCatalog":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    # %%
+    # 本地读写
+
+    def _fresh(self, entry: Optional[Entry]) -> bool:
+        return entry is not None and time.time() - entry.fetched_at < self.ttl
+
+    def entry(self, db_name: str, tb_name: str) -> Optional[Entry]:
+        """本地保存的条目, 不检查是否过期"""
+        key = (db_name, tb_name)
+        entry = self._memo.get(key)
+        if entry is not None:
+            return entry
+        with self._lock:
+            row = self._con.execute(
+                "SELECT fetched_at, dictionary, description FROM tables"
+                " WHERE db_name = ? AND tb_name = ?",
+                key,
+            ).fetchone()
+        if row is None:
+            return None
+        entry = Entry(row[0], json.loads(row[1]), json.loads(row[2]))
+        self._memo[key] = entry
+        return entry
+
+    def _store(self, db_name: str, items: Iterable[Tuple[str, Entry]]) -> None:
+        with self._lock:
+            self._con.execute("BEGIN IMMEDIATE")
+            try:
+                for tb_name, entry in items:
+                    self._con.execute(
+                        "INSERT OR REPLACE INTO tables VALUES (?, ?, ?, ?, ?)",
+                        (
+                            db_name,
+                            tb_name,
+                            entry.fetched_at,
+                            json.dumps(entry.dictionary, ensure_ascii=False),
+                            json.dumps(entry.description, ensure_ascii=False),
+                        ),
+                    )
+                    self._con.execute(
+                        "DELETE FROM columns WHERE db_name = ? AND tb_name = ?",
+                        (db_name, tb_name),
+                    )
+                    self._con.executemany(
+                        "INSERT INTO columns VALUES (?, ?, ?, ?, ?, ?)",
+                        [
+                            (db_name, tb_name, i, *row)
+                            for i, row in enumerate(_column_rows(entry.dictionary))
+                        ],
+                    )
+                    self._memo[(db_name, tb_name)] = entry
+                self._con.execute("COMMIT")
+            except BaseException:
+                self._con.execute("ROLLBACK")
+                raise
+
+    def tables(self, db_name: str) -> List[str]:
+        """本地已保存的表"""
+        with self._lock:
+            return [
+                r[0]
+                for r in self._con.execute(
+                    "SELECT tb_name FROM tables WHERE db_name = ? ORDER BY tb_name",
+                    (db_name,),
+                )
+            ]
+
+    def find_columns(self, pattern: str, db_name: Optional[str] = None) -> pd.DataFrame:
+        """按列名或注释模糊查找 (SQL LIKE, 比如 '%contract%')"""
+        sql = (
+            "SELECT db_name, tb_name, column_name, column_type, column_comment"
+            " FROM columns WHERE (column_name LIKE ? OR column_comment LIKE ?)"
+        )
+        params: List[Any] = [pattern, pattern]
+        if db_name is not None:
+            sql += " AND db_name = ?"
+            params.append(db_name)
+        with self._lock:
+            cur = self._con.execute(sql + " ORDER BY db_name, tb_name, ordinal", params)
+            return pd.DataFrame(cur.fetchall(), columns=[d[0] for d in cur.description])
+
+    # %%
+    # 抓取
+
+    def _require_client(self) -> DBClient:
+        if self.client is None:
+            raise RuntimeError("MetadataCatalog has no DBClient to fetch with")
+        return self.client
+
+    def _fetch(self, db_name: str, tb_name: str) -> Entry:
+        client = self._require_client()
+        return Entry(
+            fetched_at=time.time(),
+            dictionary=client.data_dictionary(db_name, tb_name, refresh=True),
+            description=client.describe_table(db_name, tb_name, refresh=True).json()[
+                "data"
+            ],
+        )
+
+    def list_remote_tables(self, db_name: str) -> List[str]:
+        data = self._require_client().query(
+            f"SHOW TABLES FROM `{db_name}`", refresh=True
+        )
+        return [row[0] for row in data["rows"]]
+
+    def crawl(
+        self,
+        db_name: str,
+        tables: Optional[Iterable[str]] = None,
+        refresh: bool = False,
+    ) -> CrawlResult:
+        """并行抓取 `db_name` 下的表, 默认为网关上的全部表
+
+        `refresh=False` 时跳过本地未过期的表. 单个表失败不影响其他表, 错误记录在
+        `CrawlResult.failed` 中.
+        """
+        names = list(tables) if tables is not None else self.list_remote_tables(db_name)
+        skipped = (
+            [] if refresh else [t for t in names if self._fresh(self.entry(db_name, t))]
+        )
+        todo = [t for t in names if t not in set(skipped)]
+
+        fetched: List[Tuple[str, Entry]] = []
+        failed: Dict[str, str] = {}
+        workers = self.workers
+        if workers is None:
+            workers = self.client.limiter.max_limit if self.client is not None else 1
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {pool.submit(self._fetch, db_name, t): t for t in todo}
+            for future in as_completed(futures):
+                tb_name = futures[future]
+                try:
+                    fetched.append((tb_name, future.result()))
+                except Exception as e:
+                    failed[tb_name] = f"{type(e).__name__}: {e}"
+        # 一次事务写入, 读者看不到抓取了一半的目录
+        self._store(db_name, fetched)
+
+        return CrawlResult(
+            fetched=sorted(t for t, _ in fetched), skipped=skipped, failed=failed
+        )
+
+    def refresh(
+        self, db_name: str, tables: Optional[Iterable[str]] = None
+    ) -> CrawlResult:
+        """重新抓取, 忽略有效期. 不指定 `tables` 时为网关上的全部表"""
+        return self.crawl(db_name, tables, refresh=True)
+
+    # %%
+    # 查找
+
+    def lookup(self, db_name: str, tb_name: str, offline: bool = False) -> Entry:
+        entry = self.entry(db_name, tb_name)
+        if self._fresh(entry) or (offline and entry is not None):
+            return entry
+        if offline:
+            raise KeyError(f"{db_name}.{tb_name} is not in the catalog")
+        entry = self._fetch(db_name, tb_name)
+        self._store(db_name, [(tb_name, entry)])
+        return entry
+
+    def data_dictionary(
+        self, db_name: str, tb_name: str, offline: bool = False
+    ) -> RemoteData:
+        """同 `DBClient.data_dictionary`"""
+        return self.lookup(db_name, tb_name, offline).dictionary
+
+    def describe(self, db_name: str, tb_name: str, offline: bool = False) -> RemoteData:
+        """`DBClient.describe_table` 响应中的 data"""
+        return self.lookup(db_name, tb_name, offline).description
+
+    def get_table_structs(
+        self, db_name: str, tb_name: str, offline: bool = False
+    ) -> pd.DataFrame:
+        """同 `DBClient.get_table_structs`"""
+        data = self.data_dictionary(db_name, tb_name, offline)
+        return pd.DataFrame(data["rows"], columns=data["column_list"])
+
+
+# %%
+# command line
+# ============
+
+
+def _client_from_env() -> DBClient:
+    from dotenv import load_dotenv
+
+    from pyinpark.cmcloud4 import DBArgs, DBClient
+
+    load_dotenv()
+    return DBClient(DBArgs(**{k: os.environ[k] for k in DBArgs._fields}))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m pyinpark.catalog")
+    parser.add_argument("--path", type=Path, default=None, help="目录文件")
+    parser.add_argument(
+        "--workers", type=int, default=None, help="抓取的线程数, 默认为并发上限"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help_ in [
+        ("crawl", "抓取缺失或过期的表"),
+        ("refresh", "重新抓取, 忽略有效期"),
+    ]:
+        sub = commands.add_parser(name, help=help_)
+        sub.add_argument("db_name")
+        sub.add_argument("tables", nargs="*", help="默认为全部表")
+    show = commands.add_parser("show", help="显示本地保存的表结构")
+    show.add_argument("db_name")
+    show.add_argument("tb_name", nargs="?")
+    args = parser.parse_args(argv)
+
+    if args.command == "show":
+        with MetadataCatalog(args.path) as catalog:
+            if args.tb_name is None:
+                print("\n".join(catalog.tables(args.db_name)))
+            else:
+                print(
+                    catalog.get_table_structs(
+                        args.db_name, args.tb_name, offline=True
+                    ).to_string()
+                )
+        return
+
+    with MetadataCatalog(
+        args.path, client=_client_from_env(), workers=args.workers
+    ) as catalog:
+        result = catalog.crawl(
+            args.db_name, args.tables or None, refresh=args.command == "refresh"
+        )
+    print(
+        f"fetched {len(result.fetched)}, skipped {len(result.skipped)},"
+        f" failed {len(result.failed)}"
+    )
+    for tb_name, error in sorted(result.failed.items()):
+        print(f"  {tb_name}: {error}")
+    if result.failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
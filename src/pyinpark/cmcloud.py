@@ -1,16 +1,16 @@
-import urllib3
 import toolz.curried as tz
 import json
 import os
-from dotenv import load_dotenv, find_dotenv
 from http import cookies
+from functools import lru_cache
 from operator import methodcaller, attrgetter
 from collections import namedtuple
 from typing import Any, Callable, cast
 from pyinpark.pyfp import zip_, unpack_kwargs  # cspell: disable-line
+from pyinpark.lazy import lazy_import
 
-load_dotenv()
-env_path = find_dotenv()
+metrics = lazy_import("pyinpark.metrics")
+transport = lazy_import("pyinpark.transport")
 
 # output_cookies :: SimpleCookie -> str
 output_cookies = tz.compose(
@@ -33,75 +33,125 @@ get_csrfToken = tz.compose(attrgetter("value"), tz.get("csrftoken"), simpleCooki
 
 # set_headers :: HTTPResponse -> dict
 get_headers = tz.compose(
+    lambda headers: tz.merge(transport.ACCEPT_ENCODING, headers),
     dict,
     zip_([["Cookie", "X-CSRFToken"]]),
     tz.juxt([get_cookies_output, get_csrfToken]),
 )
 
-HOST = os.getenv("DOMAIN")
 Endpoints = namedtuple("Endpoints", "login authenticate query")
-urls = Endpoints(*[f"https://{HOST}/{endpoint}/" for endpoint in Endpoints._fields])
 
-timeout = urllib3.util.Timeout(connect=2.0, read=30.0)
 
-http = urllib3.PoolManager(timeout=timeout)
+@lru_cache(maxsize=None)
+def _settings() -> dict:
+    """读取环境变量并生成请求参数
+
+    首次调用时才加载 `.env`, 导入本模块不产生任何 I/O.
+    """
+    from dotenv import find_dotenv, load_dotenv
+    import urllib3
+
+    load_dotenv()
+    env_path = find_dotenv()
+
+    HOST = os.getenv("DOMAIN")
+    urls = Endpoints(*[f"https://{HOST}/{endpoint}/" for endpoint in Endpoints._fields])
+
+    auth_fields = {
+        "username": os.getenv("USR"),  # cspell: disable-line
+        "password": os.getenv("PWD"),  # cspell: disable-line
+    }
+
+    query_fields = {
+        "db_name": os.getenv("DB_NAME"),
+        "instance_name": os.getenv("INSTANCE_NAME"),
+        "limit_num": 0,
+        "schema_name": "",
+        "sql_content": "select 1",
+        "tb_name": "",
+    }
+
+    return {
+        "env_path": env_path,
+        "HOST": HOST,
+        "urls": urls,
+        "timeout": urllib3.util.Timeout(connect=2.0, read=30.0),
+        "auth_fields": auth_fields,
+        "auth_request_args": {
+            "method": "POST",
+            "url": urls.authenticate,
+            "headers": "",
+            "fields": auth_fields,
+        },
+        "query_fields": query_fields,
+        "query_request_args": {
+            "method": "POST",
+            "url": urls.query,
+            "headers": "",
+            "fields": query_fields,
+        },
+    }
+
+
+def __getattr__(name: str) -> Any:
+    # 兼容原先的模块级变量: cmcloud.urls, cmcloud.query_request_args 等
+    settings = _settings()
+    if name in settings:
+        return settings[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# request :: (str, str, ...) -> HTTPResponse
+def request(method, url, **kwargs):
+    """经由共享传输层的连接池发送请求"""
+    kwargs.setdefault("timeout", _settings()["timeout"])
+    operation = {v: k for k, v in _settings()["urls"]._asdict().items()}.get(url, url)
+    fields = kwargs.get("fields") or {}
+    sql = fields.get("sql_content") if operation == "query" else None
+    with metrics.get_metrics().timed(operation, sql=sql) as rec:
+        return rec.response(
+            transport.get_transport().pool_manager.request(method, url, **kwargs)
+        )
+
 
 #
 # login
 #
 
+
 # login :: _ -> HTTPResponse
-login = lambda: http.request("GET", urls.login)
+def login():
+    return request("GET", _settings()["urls"].login, headers=transport.ACCEPT_ENCODING)
+
 
 #
 # authentication
 #
 
 
-auth_fields = {
-    "username": os.getenv("USR"),  # cspell: disable-line
-    "password": os.getenv("PWD"),  # cspell: disable-line
-}
-
-auth_request_args = {
-    "method": "POST",
-    "url": urls.authenticate,
-    "headers": "",
-    "fields": auth_fields,
-}
-
 # auth :: HTTPResponse -> HTTPResponse
-auth = tz.compose(
-    unpack_kwargs(http.request),
-    tz.assoc_in(auth_request_args, ["headers"]),
-    get_headers,
-)
+def auth(login_res):
+    return tz.pipe(
+        login_res,
+        get_headers,
+        tz.assoc_in(_settings()["auth_request_args"], ["headers"]),
+        unpack_kwargs(request),
+    )
+
 
 #
 # query
 #
 
 
-query_fields = {
-    "db_name": os.getenv("DB_NAME"),
-    "instance_name": os.getenv("INSTANCE_NAME"),
-    "limit_num": 0,
-    "schema_name": "",
-    "sql_content": "select 1",
-    "tb_name": "",
-}
-
-query_request_args = {
-    "method": "POST",
-    "url": urls.query,
-    "headers": "",
-    "fields": query_fields,
-}
-
 # get_query_headers :: HTTPResponse -> dict
-get_query_headers = tz.compose(
-    tz.assoc_in(query_request_args, ["headers"]), get_headers
-)
+def get_query_headers(auth_res):
+    return tz.pipe(
+        auth_res,
+        get_headers,
+        tz.assoc_in(_settings()["query_request_args"], ["headers"]),
+    )
+
 
 # get_headers_immediately :: _ -> dict
 get_headers_immediately = cast(
@@ -115,7 +165,6 @@ def query_request(headers):
     return tz.compose(
         json.loads,
         attrgetter("data"),
-        unpack_kwargs(http.request),
+        unpack_kwargs(request),
         tz.assoc_in(headers, ["fields", "sql_content"]),
     )
-
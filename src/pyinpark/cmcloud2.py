@@ -1,28 +1,42 @@
-import requests
 import os
-from dotenv import load_dotenv
+from contextlib import closing
+from functools import lru_cache
+from pyinpark.lazy import lazy_import
 
-load_dotenv()
+jsonstream = lazy_import("pyinpark.jsonstream")
+metrics = lazy_import("pyinpark.metrics")
+transport = lazy_import("pyinpark.transport")
+
+
+@lru_cache(maxsize=None)
+def _load_env() -> None:
+    """首次请求时才加载 `.env`"""
+    from dotenv import load_dotenv
+
+    load_dotenv()
 
 
 def login():
-    return requests.get(os.getenv("LOGIN_URL"))
+    _load_env()
+    return transport.get_transport().login(os.getenv("LOGIN_URL"))
 
 
 def auth(login_res):
-    return requests.post(
+    _load_env()
+    return transport.get_transport().authenticate(
         os.getenv("AUTH_URL"),
-        headers={"X-CSRFToken": login_res.cookies["csrftoken"],},
-        cookies=login_res.cookies,
         # cspell: disable-next-line
-        data={"username": os.getenv("USR"), "password": os.getenv("PWD2")},
+        os.getenv("USR"),
+        os.getenv("PWD2"),
+        login_res.cookies,
     )
 
 
-def query(auth_res, sql):
-    return requests.post(
+def _post_query(auth_res, sql, stream=False):
+    _load_env()
+    return transport.get_transport().session.post(
         os.getenv("QUERY_URL"),
-        headers={"X-CSRFToken": auth_res.cookies["csrftoken"],},
+        headers=transport.csrf_headers(auth_res.cookies),
         cookies=auth_res.cookies,
         data={
             "db_name": os.getenv("DB_NAME"),
@@ -33,5 +47,36 @@ def query(auth_res, sql):
             "sql_content": sql,
             "tb_name": "",
         },
+        stream=stream,
     )
 
+
+def query(auth_res, sql):
+    with metrics.get_metrics().timed("query", sql=sql) as rec:
+        return rec.response(_post_query(auth_res, sql))
+
+
+def _tee(chunks, sink):
+    for chunk in chunks:
+        sink(chunk)
+        yield chunk
+
+
+def query_frames(auth_res, sql, batch_rows=None, sink=None):
+    """`query` 的流式版本, 边接收边解析, 逐批产生 DataFrame
+
+    `sink` 依次接收原始响应的字节块 (例如 `ResponseArchiver.stream`).
+    """
+    rows = 0
+    with metrics.get_metrics().timed("query", sql=sql) as rec:
+        res = rec.response(_post_query(auth_res, sql, stream=True), stream=True)
+        with closing(res):
+            chunks = rec.chunks(res, jsonstream.CHUNK_SIZE)
+            if sink is not None:
+                chunks = _tee(chunks, sink)
+            for df in jsonstream.iter_frames(
+                chunks, batch_rows or jsonstream.BATCH_ROWS
+            ):
+                rows += len(df)
+                yield df
+    metrics.get_metrics().observe_rows("query", sql, rows)
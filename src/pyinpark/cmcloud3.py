@@ -1,46 +1,43 @@
 from operator import itemgetter, methodcaller
-import requests
 import toolz.curried as tz
 import os
-import pandas as pd
 from pathlib import Path
+from pyinpark.atomic import atomic_path
+from pyinpark.lazy import lazy_import
+
+pd = lazy_import("pandas")
+metrics = lazy_import("pyinpark.metrics")
+transport = lazy_import("pyinpark.transport")
 
 
 def login(login_url):
-    return requests.get(login_url)
+    return transport.get_transport().login(login_url)
 
 
 @tz.curry
 def auth(auth_url, usr, pwd, login_res):
-    return requests.post(
-        auth_url,
-        headers={
-            "X-CSRFToken": login_res.cookies["csrftoken"],
-        },
-        cookies=login_res.cookies,
-        # cspell: disable-next-line
-        data={"username": usr, "password": pwd},
-    )
+    return transport.get_transport().authenticate(auth_url, usr, pwd, login_res.cookies)
 
 
 @tz.curry
 def query(query_url, db_name, instance_name, auth_res, sql):
-    return requests.post(
-        query_url,
-        headers={
-            "X-CSRFToken": auth_res.cookies["csrftoken"],
-        },
-        cookies=auth_res.cookies,
-        data={
-            "db_name": db_name,
-            "instance_name": instance_name,
-            "limit_num": 0,
-            "schema_name": "",
-            # cspell: disable-next-line
-            "sql_content": sql,
-            "tb_name": "",
-        },
-    )
+    with metrics.get_metrics().timed("query", sql=sql) as rec:
+        return rec.response(
+            transport.get_transport().session.post(
+                query_url,
+                headers=transport.csrf_headers(auth_res.cookies),
+                cookies=auth_res.cookies,
+                data={
+                    "db_name": db_name,
+                    "instance_name": instance_name,
+                    "limit_num": 0,
+                    "schema_name": "",
+                    # cspell: disable-next-line
+                    "sql_content": sql,
+                    "tb_name": "",
+                },
+            )
+        )
 
 
 def create_sql_executor_for_leaseRent(load_env_function):
@@ -82,6 +79,7 @@ def create_df(data_file_path, sql_file, sql_executor, force_update=False):
 
     df = pd.DataFrame(data["rows"], columns=data["column_list"])  # type: ignore
 
-    df.to_csv(file_path)
+    with atomic_path(file_path) as tmp:
+        df.to_csv(tmp)
 
     return df
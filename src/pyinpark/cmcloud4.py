@@ -1,7 +1,47 @@
-import requests
-import pandas as pd
+from __future__ import annotations
+
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from pathlib import Path
-from typing import Dict, List, NamedTuple, Optional, TypedDict, Any, Union
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypedDict,
+    Any,
+    Union,
+)
+from pyinpark.atomic import atomic_path
+from pyinpark.lazy import lazy_import
+
+if TYPE_CHECKING:
+    import pandas as pd
+    import requests
+    from pyinpark import cache as _cache
+    from pyinpark import jsonstream as _jsonstream
+    from pyinpark import limiter as _limiter
+    from pyinpark import metrics as _metrics
+    from pyinpark import transport as _transport
+    from pyinpark.cache import CacheStats, ResultCache
+    from pyinpark.limiter import AdaptiveLimiter, LimiterStats
+    from pyinpark.metrics import SeriesStats
+    from pyinpark.transport import Transport
+else:
+    pd = lazy_import("pandas")
+    requests = lazy_import("requests")
+    _cache = lazy_import("pyinpark.cache")
+    _jsonstream = lazy_import("pyinpark.jsonstream")
+    _limiter = lazy_import("pyinpark.limiter")
+    _metrics = lazy_import("pyinpark.metrics")
+    _transport = lazy_import("pyinpark.transport")
 
 
 class RemoteDataMustContainFields(TypedDict):
@@ -25,49 +65,126 @@ class DBArgs(NamedTuple):
     INSTANCE_NAME: str
 
 
+class Target(NamedTuple):
+    """同一网关上的一个 (实例, 库)"""
+
+    instance_name: str
+    db_name: str
+
+    def __str__(self) -> str:
+        return f"{self.instance_name}/{self.db_name}"
+
+
+class FanOutResult(NamedTuple):
+    # 成功的目标的结果按 `targets` 的顺序合并, 来源列为 `str(target)`
+    df: pd.DataFrame
+    succeeded: List[Target]
+    # target -> 错误信息
+    failed: Dict[Target, str]
+
+
+def _replay(content: bytes) -> requests.Response:
+    """由缓存的响应体重建 `describe_table` 的响应"""
+    res = requests.Response()
+    res.status_code = 200
+    res.encoding = "utf-8"
+    res._content = content
+    return res
+
+
 class DBClient:
-    def __init__(self, db_args: DBArgs) -> None:
+    """数据库网关客户端
+
+    `query`, `describe_table` 和 `data_dictionary` 的响应体缓存在 `cache` 中 (默认为
+    进程内共用的 `pyinpark.cache.get_cache()`), 并发的相同请求只发送一次.
+    缓存的是响应的字节, 容量按实际占用计算, 命中时重新解析, 每次返回新的对象;
+    `refresh=True` 跳过缓存重新请求.
+
+    请求延迟, 响应大小, 行数和缓存命中情况按 SQL 指纹记录在
+    `pyinpark.metrics.get_metrics()` 中.
+
+    大结果集用 `query_frames` 边接收边解析, 不经过缓存. 分布在多个实例上的数据用
+    `query_targets` 并行查询后合并.
+
+    同时发往网关的请求数由 `limiter` (默认为进程内共用的
+    `pyinpark.limiter.get_limiter()`) 按延迟和错误自动调整, 多线程的批量任务可以
+    直接提交全部请求, 超出当前上限的请求排队等待.
+    """
+
+    def __init__(
+        self,
+        db_args: DBArgs,
+        transport: Optional[Transport] = None,
+        cache: Optional[ResultCache] = None,
+        limiter: Optional[AdaptiveLimiter] = None,
+    ) -> None:
         self.args = db_args
+        self.transport = (
+            transport if transport is not None else _transport.get_transport()
+        )
+        self.cache = cache if cache is not None else _cache.get_cache()
+        self.limiter = limiter if limiter is not None else _limiter.get_limiter()
         self._session: Optional[requests.Session] = None
+        self._session_lock = threading.Lock()
 
     def get_session(self) -> requests.Session:
-        if self._session is None:
-            session = requests.Session()
+        with self._session_lock:
+            if self._session is None:
+                session = self.transport.new_session()
 
-            # login
-            session.get(self.args.LOGIN_URL)
+                # login & auth
+                self.transport.sign_in(
+                    self.args.LOGIN_URL,
+                    self.args.AUTH_URL,
+                    self.args.USR,
+                    self.args.PWD2,
+                    session=session,
+                )
 
-            # auth
-            session.post(
-                self.args.AUTH_URL,
-                headers={"X-CSRFToken": session.cookies["csrftoken"]},
-                data={"username": self.args.USR, "password": self.args.PWD2},
-            )
-
-            self._session = session
+                self._session = session
 
         return self._session
 
-    def query_raw(self, sql: str) -> requests.Response:
-        session = self.get_session()
-        return session.post(
-            self.args.QUERY_URL,
-            headers={"X-CSRFToken": session.cookies["csrftoken"]},
-            data={
-                "db_name": self.args.DB_NAME,
-                "instance_name": self.args.INSTANCE_NAME,
-                "limit_num": 0,
-                "schema_name": "",
-                "sql_content": sql,
-                "tb_name": "",
-            },
+    def _cached(
+        self,
+        key: Tuple[Hashable, ...],
+        load: Callable[[], Tuple[bytes, Any]],
+        parse: Callable[[bytes], Any],
+        refresh: bool,
+        sql: Optional[str] = None,
+    ) -> Any:
+        """`load` 返回 (响应体, 解析结果), 缓存响应体; 命中时用 `parse` 解析响应体"""
+        loaded = []
+
+        def load_bytes() -> Tuple[bytes, int]:
+            content, value = load()
+            loaded.append(value)
+            return content, len(content)
+
+        # 结果与网关, 实例和账号有关
+        content, outcome = self.cache.lookup(
+            (self.args.DOMAIN, self.args.INSTANCE_NAME, self.args.USR) + key,
+            load_bytes,
+            refresh=refresh,
         )
+        _metrics.get_metrics().observe_cache(str(key[0]), sql, outcome)
+        # 本次调用执行了加载时直接使用解析结果, 不再解析一次
+        return loaded[0] if loaded else parse(content)
 
-    def query(self, sql: str) -> RemoteData:
+    def cache_stats(self) -> CacheStats:
+        return self.cache.stats()
+
+    def limiter_stats(self) -> LimiterStats:
+        return self.limiter.stats()
+
+    def metrics(self) -> List[SeriesStats]:
+        return _metrics.get_metrics().stats()
+
+    def _post_query(self, sql: str, stream: bool = False) -> requests.Response:
         session = self.get_session()
         return session.post(
             self.args.QUERY_URL,
-            headers={"X-CSRFToken": session.cookies["csrftoken"]},
+            headers=_transport.csrf_headers(session.cookies),
             data={
                 "db_name": self.args.DB_NAME,
                 "instance_name": self.args.INSTANCE_NAME,
@@ -76,32 +193,201 @@ class DBClient:
                 "sql_content": sql,
                 "tb_name": "",
             },
-        ).json()["data"]
+            stream=stream,
+        )
 
-    def describe_table(self, db_name: str, tb_name: str) -> requests.Response:
-        session = self.get_session()
-        return session.post(
-            self.args.DESC_URL,
-            headers={"X-CSRFToken": session.cookies["csrftoken"]},
-            data={
-                "db_name": db_name,
-                "instance_name": self.args.INSTANCE_NAME,
-                "schema_name": "",
-                "tb_name": tb_name,
-            },
+    def query_raw(self, sql: str) -> requests.Response:
+        with self.limiter.slot(
+            ("query", _metrics.fingerprint(sql))
+        ) as slot, _metrics.get_metrics().timed("query", sql=sql) as rec:
+            res = rec.response(self._post_query(sql))
+            return slot.response(res)
+
+    def query(self, sql: str, refresh: bool = False) -> RemoteData:
+        def load():
+            res = self.query_raw(sql)
+            data = res.json()["data"]
+            _metrics.get_metrics().observe_rows("query", sql, len(data["rows"]))
+            return res.content, data
+
+        return self._cached(
+            ("query", self.args.DB_NAME, sql),
+            load,
+            lambda content: json.loads(content)["data"],
+            refresh,
+            sql,
         )
 
-    def data_dictionary(self, db_name: str, tb_name: str) -> RemoteData:
-        session = self.get_session()
-        return session.get(
-            self.args.DICT_URL,
-            headers={"X-CSRFToken": session.cookies["csrftoken"]},
-            params={
-                "db_name": db_name,
-                "instance_name": self.args.INSTANCE_NAME,
-                "tb_name": tb_name,
-            },
-        ).json()["data"]["desc"]
+    def query_frames(
+        self, sql: str, batch_rows: Optional[int] = None
+    ) -> Iterator[pd.DataFrame]:
+        """逐批产生查询结果, 内存占用取决于 `batch_rows` 而不是结果集大小
+
+        收到响应头后即释放并发名额并结束计时, 读取响应体和调用方处理每批的时间不计入
+        网关延迟.
+        """
+        rows = 0
+        with self.limiter.slot(
+            ("query", _metrics.fingerprint(sql))
+        ) as slot, _metrics.get_metrics().timed("query", sql=sql) as rec:
+            res = rec.response(self._post_query(sql, stream=True), stream=True)
+            slot.response(res)
+        with closing(res):
+            for df in _jsonstream.iter_frames(
+                rec.chunks(res, _jsonstream.CHUNK_SIZE),
+                batch_rows or _jsonstream.BATCH_ROWS,
+            ):
+                rows += len(df)
+                yield df
+        _metrics.get_metrics().observe_bytes("query", sql, rec.nbytes)
+        _metrics.get_metrics().observe_rows("query", sql, rows)
+
+    def for_target(self, target: Target) -> "DBClient":
+        """同一网关和账号下另一个 (实例, 库) 的客户端, 共用登录状态, 缓存和并发限制"""
+        client = DBClient(
+            self.args._replace(
+                INSTANCE_NAME=target.instance_name, DB_NAME=target.db_name
+            ),
+            transport=self.transport,
+            cache=self.cache,
+            limiter=self.limiter,
+        )
+        client._session = self.get_session()
+        return client
+
+    def query_targets(
+        self,
+        sql: str,
+        targets: List[Target],
+        source_column: str = "source",
+        refresh: bool = False,
+    ) -> FanOutResult:
+        """在多个 (实例, 库) 上并行执行同一查询, 合并结果并加上来源列
+
+        `sql` 中的 `__INSTANCE_NAME__` 和 `__DB_NAME__` 替换为各目标的实例名和库名.
+        单个目标失败不影响其他目标, 错误记录在 `FanOutResult.failed` 中. 同时发往
+        网关的请求数仍由 `limiter` 控制.
+
+        先依次执行到第一个成功的目标, 结果中已有 `source_column` 列时抛出
+        `ValueError`, 不再执行其余目标; 之后其余目标并行执行.
+        """
+        targets = list(dict.fromkeys(targets))
+
+        def run(target: Target) -> pd.DataFrame:
+            data = self.for_target(target).query(
+                sql.replace("__INSTANCE_NAME__", target.instance_name).replace(
+                    "__DB_NAME__", target.db_name
+                ),
+                refresh=refresh,
+            )
+            return pd.DataFrame(data["rows"], columns=data["column_list"])
+
+        frames: Dict[Target, pd.DataFrame] = {}
+        failed: Dict[Target, str] = {}
+        pending = iter(targets)
+        # 先登录, 各目标共用登录状态
+        if targets:
+            self.get_session()
+        for target in pending:
+            try:
+                frames[target] = run(target)
+            except Exception as e:
+                failed[target] = f"{type(e).__name__}: {e}"
+                continue
+            if source_column in frames[target].columns:
+                raise ValueError(
+                    f"source_column {source_column!r} is already a column of the "
+                    "query result, choose another name"
+                )
+            break
+
+        rest = list(pending)
+        if rest:
+            workers = min(len(rest), self.limiter.max_limit)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {target: pool.submit(run, target) for target in rest}
+                for target, future in futures.items():
+                    try:
+                        frames[target] = future.result()
+                    except Exception as e:
+                        failed[target] = f"{type(e).__name__}: {e}"
+
+        for target, df in list(frames.items()):
+            # 各目标的表结构不同时, 之后的目标仍可能有同名列
+            if source_column in df.columns:
+                del frames[target]
+                failed[target] = f"ValueError: {source_column!r} is already a column"
+            else:
+                df.insert(0, source_column, str(target))
+        succeeded = [t for t in targets if t in frames]
+        df = (
+            pd.concat([frames[t] for t in succeeded], ignore_index=True)
+            if succeeded
+            else pd.DataFrame(columns=[source_column])
+        )
+        return FanOutResult(df=df, succeeded=succeeded, failed=failed)
+
+    def describe_table(
+        self, db_name: str, tb_name: str, refresh: bool = False
+    ) -> requests.Response:
+        def load():
+            session = self.get_session()
+            with self.limiter.slot(
+                "describe_table"
+            ) as slot, _metrics.get_metrics().timed("describe_table") as rec:
+                res = rec.response(
+                    session.post(
+                        self.args.DESC_URL,
+                        headers=_transport.csrf_headers(session.cookies),
+                        data={
+                            "db_name": db_name,
+                            "instance_name": self.args.INSTANCE_NAME,
+                            "schema_name": "",
+                            "tb_name": tb_name,
+                        },
+                    )
+                )
+                slot.response(res)
+            # 错误响应和登录失效时的登录页不缓存
+            res.raise_for_status()
+            if not isinstance(res.json().get("data"), dict):
+                raise ValueError(
+                    f"describe_table {db_name}.{tb_name}: response has no data object"
+                )
+            return res.content, res
+
+        return self._cached(
+            ("describe_table", db_name, tb_name), load, _replay, refresh
+        )
+
+    def data_dictionary(
+        self, db_name: str, tb_name: str, refresh: bool = False
+    ) -> RemoteData:
+        def load():
+            session = self.get_session()
+            with self.limiter.slot(
+                "data_dictionary"
+            ) as slot, _metrics.get_metrics().timed("data_dictionary") as rec:
+                res = rec.response(
+                    session.get(
+                        self.args.DICT_URL,
+                        headers=_transport.csrf_headers(session.cookies),
+                        params={
+                            "db_name": db_name,
+                            "instance_name": self.args.INSTANCE_NAME,
+                            "tb_name": tb_name,
+                        },
+                    )
+                )
+                slot.response(res)
+            return res.content, res.json()["data"]["desc"]
+
+        return self._cached(
+            ("data_dictionary", db_name, tb_name),
+            load,
+            lambda content: json.loads(content)["data"]["desc"],
+            refresh,
+        )
 
     def get_table_structs(self, db_name: str, tb_name: str) -> pd.DataFrame:
         data = self.data_dictionary(db_name=db_name, tb_name=tb_name)
@@ -133,6 +419,7 @@ class DBClient:
         df = pd.DataFrame(data["rows"], columns=data["column_list"])
 
         if cache_file_path is not None:
-            df.to_csv(cache_file_path, escapechar="\\")
+            with atomic_path(cache_file_path) as tmp:
+                df.to_csv(tmp, escapechar="\\")
 
         return df
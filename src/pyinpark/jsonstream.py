@@ -0,0 +1,176 @@
+"""查询响应的增量解析
+
+网关的查询响应形如 `{..., "data": {"column_list": [...], "rows": [[...], ...]}}`.
+`iter_frames` 边接收边解析, 每 `batch_rows` 行产生一个 DataFrame. 原始字节,
+解码后的文本和解析出的行都只保留当前这一批, 内存占用取决于批大小而不是响应大小:
+
+>>> for df in iter_frames(res.iter_content(CHUNK_SIZE)):
+...     df.to_csv(f, header=f.tell() == 0, index=False)
+
+逐个值调用标准库的 `JSONDecoder.raw_decode` 解析 (C 实现的扫描器), 速度与
+`json.loads` 相当. `column_list` 出现在 `rows` 之后时, 之前的行暂存到读取列名为止.
+"""
+from __future__ import annotations
+
+import codecs
+import json
+import re
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Tuple
+
+from pyinpark.lazy import lazy_import
+
+if TYPE_CHECKING:
+    import pandas as pd
+else:
+    pd = lazy_import("pandas")
+
+# 每个 DataFrame 的行数
+BATCH_ROWS = 50_000
+
+# 读取响应体的块大小
+CHUNK_SIZE = 1 << 16
+
+_WS = re.compile(r"[ \t\n\r]*")
+_DECODER = json.JSONDecoder()
+
+
+class _Reader:
+    """在字节块上按 JSON 记号读取, 只保留未消费的文本"""
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._eof = True
+            text = self._decoder.decode(b"", final=True)
+        else:
+            text = self._decoder.decode(chunk)
+        self._buf = self._buf[self._pos :] + text
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        """下一个非空白字符 (不消费)"""
+        while True:
+            self._pos = _WS.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError("unexpected end of JSON response")
+
+    def take(self, expected: str) -> None:
+        ch = self.peek()
+        if ch != expected:
+            raise ValueError(f"expected {expected!r} in JSON response, got {ch!r}")
+        self._pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buf, self._pos)
+                # 数字等值在块的末尾时可能还没有读完
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+    def members(self) -> Iterator[str]:
+        """依次产生对象的键, 调用方读取对应的值"""
+        self.take("{")
+        if self.peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self.take(":")
+            yield key
+            if self.peek() == "}":
+                self._pos += 1
+                return
+            self.take(",")
+
+    def elements(self) -> Iterator[None]:
+        """依次定位到数组的元素, 调用方读取元素的值"""
+        self.take("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield
+            if self.peek() == "]":
+                self._pos += 1
+                return
+            self.take(",")
+
+    def end(self) -> None:
+        self._pos = _WS.match(self._buf, self._pos).end()
+        while self._pos == len(self._buf) and self._fill():
+            self._pos = _WS.match(self._buf, self._pos).end()
+        if self._pos < len(self._buf):
+            raise ValueError("extra data after JSON response")
+
+
+def iter_batches(
+    chunks: Iterable[bytes],
+    batch_rows: int = BATCH_ROWS,
+    data_key: str = "data",
+    rows_key: str = "rows",
+    columns_key: str = "column_list",
+) -> Iterator[Tuple[List[str], List[list]]]:
+    """依次产生 (列名, 不超过 `batch_rows` 行). 没有数据行时产生一个空批"""
+    reader = _Reader(chunks)
+    meta: Dict[str, Any] = {}
+    columns = None
+    pending: List[list] = []
+    emitted = found = False
+
+    for key in reader.members():
+        if key != data_key or reader.peek() != "{":
+            meta[key] = reader.value()
+            continue
+        found = True
+        for name in reader.members():
+            if name == columns_key:
+                columns = reader.value()
+            elif name == rows_key and reader.peek() == "[":
+                for _ in reader.elements():
+                    pending.append(reader.value())
+                    if columns is not None and len(pending) >= batch_rows:
+                        yield columns, pending
+                        pending, emitted = [], True
+            else:
+                reader.value()
+    reader.end()
+
+    if not found or columns is None:
+        detail = {k: v for k, v in meta.items() if not isinstance(v, (dict, list))}
+        raise ValueError(
+            f"response has no {data_key}.{columns_key}: {detail}"
+            if found
+            else f"response has no {data_key!r} object: {detail}"
+        )
+    for start in range(0, len(pending), batch_rows):
+        yield columns, pending[start : start + batch_rows]
+        emitted = True
+    if not emitted:
+        yield columns, []
+
+
+def iter_frames(
+    chunks: Iterable[bytes], batch_rows: int = BATCH_ROWS, **kwargs
+) -> Iterator[pd.DataFrame]:
+    """`iter_batches` 的每一批转为 DataFrame, 参数见 `iter_batches`"""
+    for columns, rows in iter_batches(chunks, batch_rows, **kwargs):
+        yield pd.DataFrame(rows, columns=columns)
@@ -0,0 +1,46 @@
+"""延迟导入
+
+`pandas`, `numpy`, `arrow`, `requests` 等依赖导入耗时较长, 而调度器会在大量短生命周期
+的辅助进程中导入本包. 模块顶层使用 `lazy_import` 代替 `import`, 首次访问属性时才真正
+导入:
+
+>>> pd = lazy_import("pandas")  # 此时尚未导入 pandas
+>>> pd.DataFrame                # 首次访问属性时导入
+<class 'pandas.core.frame.DataFrame'>
+
+类型注解需配合 `from __future__ import annotations` 使用.
+"""
+
+import importlib
+import sys
+from types import ModuleType
+from typing import Any, Optional
+
+
+class LazyModule:
+    def __init__(self, name: str) -> None:
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self) -> ModuleType:
+        module: Optional[ModuleType] = self.__dict__["_module"]
+        if module is None:
+            module = importlib.import_module(self.__dict__["_name"])
+            self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr: str, value: Any) -> None:
+        setattr(self._load(), attr, value)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.__dict__["_module"] is not None else "not loaded"
+        return f"<lazy module {self.__dict__['_name']!r} ({state})>"
+
+
+def lazy_import(name: str) -> Any:
+    """返回模块 `name` 的延迟代理; 模块已导入时直接返回模块本身"""
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)
@@ -0,0 +1,258 @@
+"""网关请求的自适应并发限制
+
+固定的并发数在网关空闲时用不满, 在业务高峰 (网关延迟升高) 时又会加重拥塞.
+`AdaptiveLimiter` 按 AIMD (加性增, 乘性减) 调整同时进行的请求数上限:
+
+- 请求成功且延迟不超过基线的 `tolerance` 倍: 上限增加 `1 / limit`, 即每轮请求约加 1
+- 请求失败 (连接错误, 超时, HTTP 429/5xx) 或延迟超过基线的 `tolerance` 倍:
+  上限乘以 `backoff`. 同一轮中在减小之前发出的请求不再重复减小
+- 上限保持在 [`min_limit`, `max_limit`] 之间
+
+基线按 `slot(key)` 的 `key` (操作和 SQL 指纹) 分别计算, 只与同类请求的历史比较,
+耗时长的查询不会因为比 `describe_table` 慢而被当作过载. 每个 `key` 的基线为最近
+两个窗口 (每个窗口 `window` 个样本) 内的最小延迟: 过载时减小上限后请求数下降, 延迟
+回落, 基线不会随过载一起升高; 网关持续变慢时两个窗口后随之调整.
+
+延迟为发出请求到收到响应头的时间 (`requests.Response.elapsed`), 不包括读取响应体,
+响应的大小不影响判断. 超出上限的请求在 `slot` 中等待.
+
+>>> with get_limiter().slot(("query", fingerprint(sql))) as slot:
+...     res = slot.response(session.post(...))
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Hashable, Iterator, NamedTuple, Optional
+
+# 保留基线的 key 数, 超过时丢弃最久未使用的
+MAX_KEYS = 1024
+
+
+class LimiterStats(NamedTuple):
+    limit: int
+    in_flight: int
+    waiting: int
+    min_limit: int
+    max_limit: int
+    # key -> 基线延迟 (秒)
+    baselines: Dict[Hashable, float]
+    increases: int
+    decreases: int
+
+
+def _overloaded(res: Any) -> bool:
+    status = getattr(res, "status_code", None) or getattr(res, "status", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+def _latency(res: Any) -> Optional[float]:
+    # requests.Response.elapsed: 发出请求到解析完响应头
+    elapsed = getattr(res, "elapsed", None)
+    return elapsed.total_seconds() if elapsed is not None else None
+
+
+class _Baseline:
+    """最近两个窗口内的最小延迟"""
+
+    __slots__ = ("previous", "current", "samples")
+
+    def __init__(self) -> None:
+        self.previous: Optional[float] = None
+        self.current: Optional[float] = None
+        self.samples = 0
+
+    @property
+    def value(self) -> Optional[float]:
+        mins = [m for m in (self.previous, self.current) if m is not None]
+        return min(mins) if mins else None
+
+    def observe(self, latency: float, window: int) -> None:
+        if self.current is None or latency < self.current:
+            self.current = latency
+        self.samples += 1
+        if self.samples >= window:
+            self.previous, self.current = self.current, None
+            self.samples = 0
+
+
+class Slot:
+    """`AdaptiveLimiter.slot` 中的一次请求"""
+
+    def __init__(self, epoch: int, key: Hashable = None) -> None:
+        self.epoch = epoch
+        self.key = key
+        self.started = time.perf_counter()
+        self.latency: Optional[float] = None
+        self.dropped = False
+
+    def response(self, res: Any) -> Any:
+        """记录到响应头的延迟和状态码; 读取响应体的时间不计入延迟"""
+        latency = _latency(res)
+        self.latency = (
+            latency if latency is not None else time.perf_counter() - self.started
+        )
+        self.dropped = self.dropped or _overloaded(res)
+        return res
+
+    def drop(self) -> None:
+        """把本次请求记为过载信号"""
+        self.dropped = True
+
+
+class AdaptiveLimiter:
+    """同时进行的请求数上限按延迟和错误自动调整, 见模块说明
+
+    - `initial`: 初始上限
+    - `min_limit`, `max_limit`: 上限的下界和上界
+    - `backoff`: 过载时上限的乘数
+    - `tolerance`: 延迟超过基线的倍数时视为过载
+    - `window`: 计算基线延迟的窗口样本数
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        backoff: float = 0.7,
+        tolerance: float = 2.0,
+        window: int = 100,
+    ) -> None:
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError(
+                f"require 1 <= min_limit <= max_limit, got {min_limit}, {max_limit}"
+            )
+        if not 0 < backoff < 1:
+            raise ValueError(f"backoff must be in (0, 1), got {backoff}")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.window = window
+        self._limit = float(min(max(initial, min_limit), max_limit))
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self._baselines: "OrderedDict[Hashable, _Baseline]" = OrderedDict()
+        # 每次减小上限加 1, 用于识别同一轮的请求
+        self._epoch = 0
+        self._increases = self._decreases = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def acquire(self, key: Hashable = None, timeout: Optional[float] = None) -> Slot:
+        """等待到同时进行的请求数低于上限; 超时抛出 `TimeoutError`"""
+        with self._cond:
+            self._waiting += 1
+            try:
+                if not self._cond.wait_for(
+                    lambda: self._in_flight < int(self._limit), timeout
+                ):
+                    raise TimeoutError("timed out waiting for a request slot")
+            finally:
+                self._waiting -= 1
+            self._in_flight += 1
+            return Slot(self._epoch, key)
+
+    def release(self, slot: Slot, failed: bool = False) -> None:
+        """`failed` 为请求抛出了连接错误或超时"""
+        latency = slot.latency
+        if latency is None and not failed:
+            latency = time.perf_counter() - slot.started
+        with self._cond:
+            self._in_flight -= 1
+            if failed or slot.dropped:
+                self._decrease(slot)
+            elif latency is not None:
+                baseline = self._baseline(slot.key)
+                usual = baseline.value
+                if usual is not None and latency > self.tolerance * usual:
+                    self._decrease(slot)
+                else:
+                    self._increase()
+                baseline.observe(latency, self.window)
+            self._cond.notify_all()
+
+    def _baseline(self, key: Hashable) -> _Baseline:
+        baseline = self._baselines.get(key)
+        if baseline is None:
+            baseline = self._baselines[key] = _Baseline()
+            if len(self._baselines) > MAX_KEYS:
+                self._baselines.popitem(last=False)
+        else:
+            self._baselines.move_to_end(key)
+        return baseline
+
+    def _increase(self) -> None:
+        # 请求数远低于上限时延迟正常不能说明可以承受更多请求
+        if self._in_flight + 1 >= self._limit / 2 and self._limit < self.max_limit:
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._increases += 1
+
+    def _decrease(self, slot: Slot) -> None:
+        if slot.epoch != self._epoch:
+            return
+        self._limit = max(self.min_limit, self._limit * self.backoff)
+        self._epoch += 1
+        self._decreases += 1
+
+    @contextmanager
+    def slot(
+        self, key: Hashable = None, timeout: Optional[float] = None
+    ) -> Iterator[Slot]:
+        """持有一个请求名额, `key` 为计算基线延迟的分类
+
+        代码块抛出 `OSError` (`requests` 的连接错误和超时) 时视为过载, 其他异常不影响
+        上限.
+        """
+        slot = self.acquire(key, timeout)
+        failed = False
+        try:
+            yield slot
+        except OSError:
+            failed = True
+            raise
+        finally:
+            self.release(slot, failed)
+
+    def stats(self) -> LimiterStats:
+        with self._cond:
+            return LimiterStats(
+                limit=int(self._limit),
+                in_flight=self._in_flight,
+                waiting=self._waiting,
+                min_limit=self.min_limit,
+                max_limit=self.max_limit,
+                baselines={
+                    key: b.value
+                    for key, b in self._baselines.items()
+                    if b.value is not None
+                },
+                increases=self._increases,
+                decreases=self._decreases,
+            )
+
+
+_default: Optional[AdaptiveLimiter] = None
+_default_lock = threading.Lock()
+
+
+def get_limiter() -> AdaptiveLimiter:
+    """进程内共用的 `AdaptiveLimiter`"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = AdaptiveLimiter()
+        return _default
+
+
+def configure_limiter(**kwargs) -> AdaptiveLimiter:
+    """以新的参数 (比如 `max_limit`) 替换进程内共用的 `AdaptiveLimiter`"""
+    global _default
+    with _default_lock:
+        _default = AdaptiveLimiter(**kwargs)
+        return _default
@@ -0,0 +1,355 @@
+"""网关请求的统计指标
+
+按 (操作, SQL 指纹) 记录请求次数, 错误和重试次数, 延迟与响应大小的直方图, 返回的
+行数以及结果缓存的命中情况. `DBClient`, `cmcloud`, `cmcloud2`, `cmcloud3` 和
+`Transport` 的登录/认证都记录到进程内共用的 `get_metrics()` 中.
+
+SQL 指纹: 去掉注释, 把字符串和数字常量替换为 `?`, 合并空白并转为小写后的 sha1 前
+12 位. 只有常量不同的查询属于同一指纹.
+
+>>> with get_metrics().timed("query", sql=sql) as rec:
+...     res = session.post(...)
+...     rec.response(res)
+>>> with get_metrics().timed("query", sql=sql) as rec:   # 流式读取
+...     res = rec.response(session.post(..., stream=True), stream=True)
+...     for chunk in rec.chunks(res): ...
+>>> get_metrics().stats()                     # 统计接口
+>>> get_metrics().write_prometheus(path)      # Prometheus 文本格式
+"""
+
+import hashlib
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from pyinpark.atomic import atomic_open
+
+# 延迟 (秒) 直方图的上界
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# 响应大小 (字节) 直方图的上界
+SIZE_BUCKETS = tuple(1 << n for n in range(10, 31, 2))
+
+# 保存的规范化 SQL 的最大长度
+MAX_SQL_CHARS = 500
+
+_COMMENT = re.compile(r"--[^\n]*|#[^\n]*|/\*.*?\*/", re.S)
+_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    for pattern, repl in [(_COMMENT, " "), (_STRING, "?"), (_NUMBER, "?")]:
+        sql = pattern.sub(repl, sql)
+    return _SPACE.sub(" ", sql).strip().lower()
+
+
+def fingerprint(sql: str) -> str:
+    return hashlib.sha1(normalize_sql(sql).encode("utf8")).hexdigest()[:12]
+
+
+class HistogramStats(NamedTuple):
+    # 各桶的上界, 最后一个为 inf
+    bounds: Tuple[float, ...]
+    # 落入各桶的次数 (非累计)
+    counts: Tuple[int, ...]
+    sum: float
+    count: int
+
+    def quantile(self, q: float) -> float:
+        """按桶估计分位数 (取所在桶的上界)"""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.bounds[-1]
+
+
+class _Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = tuple(bounds) + (float("inf"),)
+        self.counts = [0] * len(self.bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> HistogramStats:
+        return HistogramStats(self.bounds, tuple(self.counts), self.sum, self.count)
+
+
+class SeriesStats(NamedTuple):
+    operation: str
+    fingerprint: str
+    # 规范化后的 SQL, 非查询操作为空
+    sql: str
+    requests: int
+    errors: int
+    retries: int
+    latency: HistogramStats
+    bytes: HistogramStats
+    rows: int
+    cache_hits: int
+    cache_misses: int
+    cache_coalesced: int
+
+    @property
+    def cache_hit_rate(self) -> float:
+        total = self.cache_hits + self.cache_misses + self.cache_coalesced
+        return (self.cache_hits + self.cache_coalesced) / total if total else 0.0
+
+
+class _Series:
+    def __init__(self, sql: str) -> None:
+        self.sql = sql
+        self.requests = self.errors = self.retries = self.rows = 0
+        self.latency = _Histogram(LATENCY_BUCKETS)
+        self.bytes = _Histogram(SIZE_BUCKETS)
+        self.cache = {"hit": 0, "miss": 0, "coalesced": 0}
+
+
+def _response_size(res: Any) -> int:
+    content = getattr(res, "content", None)
+    if content is None:
+        # urllib3.HTTPResponse
+        content = getattr(res, "data", None)
+    return len(content) if content is not None else 0
+
+
+def _response_retries(res: Any) -> int:
+    # requests.Response.raw 或 urllib3.HTTPResponse 上的 urllib3 Retry
+    raw = getattr(res, "raw", res)
+    retries = getattr(raw, "retries", None)
+    history = getattr(retries, "history", None)
+    return len(history) if history else 0
+
+
+def _response_failed(res: Any) -> bool:
+    status = getattr(res, "status_code", None) or getattr(res, "status", None)
+    return isinstance(status, int) and status >= 400
+
+
+class Recorder:
+    """`Metrics.timed` 中记录单次请求的响应"""
+
+    def __init__(self) -> None:
+        self.nbytes = 0
+        self.retries = 0
+        self.failed = False
+
+    def response(self, res: Any, stream: bool = False) -> Any:
+        """`stream=True` 时不读取响应体, 大小由 `chunks` 累计"""
+        if not stream:
+            self.nbytes = _response_size(res)
+        self.retries = _response_retries(res)
+        self.failed = _response_failed(res)
+        return res
+
+    def chunks(self, res: Any, chunk_size: int = 1 << 16) -> Iterator[bytes]:
+        """逐块读取流式响应 (`requests.Response`) 并累计大小"""
+        for chunk in res.iter_content(chunk_size):
+            self.nbytes += len(chunk)
+            yield chunk
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], _Series] = {}
+
+    def _get(self, operation: str, sql: Optional[str]) -> _Series:
+        # 调用方持有锁
+        fp = fingerprint(sql) if sql is not None else ""
+        series = self._series.get((operation, fp))
+        if series is None:
+            text = normalize_sql(sql)[:MAX_SQL_CHARS] if sql is not None else ""
+            series = self._series[(operation, fp)] = _Series(text)
+        return series
+
+    @contextmanager
+    def timed(self, operation: str, sql: Optional[str] = None) -> Iterator[Recorder]:
+        """记录一次请求的延迟; 代码块中抛出异常时记为错误"""
+        rec = Recorder()
+        started = time.perf_counter()
+        failed = True
+        try:
+            yield rec
+            failed = rec.failed
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                series = self._get(operation, sql)
+                series.requests += 1
+                series.errors += failed
+                series.retries += rec.retries
+                series.latency.observe(elapsed)
+                if rec.nbytes:
+                    series.bytes.observe(rec.nbytes)
+
+    def observe_rows(self, operation: str, sql: Optional[str], rows: int) -> None:
+        with self._lock:
+            self._get(operation, sql).rows += rows
+
+    def observe_bytes(self, operation: str, sql: Optional[str], nbytes: int) -> None:
+        """在 `timed` 之外读取完的流式响应的大小"""
+        if nbytes:
+            with self._lock:
+                self._get(operation, sql).bytes.observe(nbytes)
+
+    def observe_cache(self, operation: str, sql: Optional[str], outcome: str) -> None:
+        """`outcome`: "hit" | "miss" | "coalesced", 见 `ResultCache.lookup`"""
+        with self._lock:
+            self._get(operation, sql).cache[outcome] += 1
+
+    def stats(self) -> List[SeriesStats]:
+        with self._lock:
+            return [
+                SeriesStats(
+                    operation=operation,
+                    fingerprint=fp,
+                    sql=s.sql,
+                    requests=s.requests,
+                    errors=s.errors,
+                    retries=s.retries,
+                    latency=s.latency.snapshot(),
+                    bytes=s.bytes.snapshot(),
+                    rows=s.rows,
+                    cache_hits=s.cache["hit"],
+                    cache_misses=s.cache["miss"],
+                    cache_coalesced=s.cache["coalesced"],
+                )
+                for (operation, fp), s in sorted(self._series.items())
+            ]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def to_prometheus(self, cache_stats: Any = None) -> str:
+        """Prometheus 文本格式. `cache_stats` 为 `CacheStats` 时附加结果缓存的容量指标"""
+        return "".join(_prometheus_lines(self.stats(), cache_stats))
+
+    def write_prometheus(self, path: Path, cache_stats: Any = None) -> Path:
+        """写入文件 (先写临时文件再改名), 供 node_exporter 的 textfile 收集器读取"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_open(path, "w", encoding="utf8") as f:
+            f.write(self.to_prometheus(cache_stats))
+        return path
+
+
+# %%
+# Prometheus text format
+# ======================
+
+PREFIX = "pyinpark_gateway"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels: Any) -> str:
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def _header(name: str, kind: str, help_: str) -> str:
+    return f"# HELP {name} {help_}\n# TYPE {name} {kind}\n"
+
+
+def _prometheus_lines(series: List[SeriesStats], cache_stats: Any) -> Iterator[str]:
+    def key(s):
+        return {"operation": s.operation, "fingerprint": s.fingerprint}
+
+    for field, help_ in [
+        ("requests", "Gateway requests."),
+        ("errors", "Gateway requests that raised or returned an HTTP error."),
+        ("retries", "Retries made by the transport."),
+        ("rows", "Rows returned by queries."),
+    ]:
+        name = f"{PREFIX}_{field}_total"
+        yield _header(name, "counter", help_)
+        for s in series:
+            yield f"{name}{_labels(**key(s))} {getattr(s, field)}\n"
+
+    for field, name, help_ in [
+        ("latency", f"{PREFIX}_latency_seconds", "Gateway request latency."),
+        ("bytes", f"{PREFIX}_response_bytes", "Gateway response body size."),
+    ]:
+        yield _header(name, "histogram", help_)
+        for s in series:
+            h: HistogramStats = getattr(s, field)
+            cumulative = 0
+            for bound, n in zip(h.bounds, h.counts):
+                cumulative += n
+                labels = _labels(**key(s), le=_bound(bound))
+                yield f"{name}_bucket{labels} {cumulative}\n"
+            yield f"{name}_sum{_labels(**key(s))} {h.sum!r}\n"
+            yield f"{name}_count{_labels(**key(s))} {h.count}\n"
+
+    name = f"{PREFIX}_cache_lookups_total"
+    yield _header(name, "counter", "Result cache lookups by outcome.")
+    for s in series:
+        for outcome, n in [
+            ("hit", s.cache_hits),
+            ("miss", s.cache_misses),
+            ("coalesced", s.cache_coalesced),
+        ]:
+            yield f"{name}{_labels(**key(s), outcome=outcome)} {n}\n"
+
+    name = f"{PREFIX}_query_info"
+    yield _header(name, "gauge", "Normalized SQL of each fingerprint.")
+    for s in series:
+        if s.sql:
+            yield f"{name}{_labels(fingerprint=s.fingerprint, sql=s.sql)} 1\n"
+
+    if cache_stats is not None:
+        for field, kind in [
+            ("entries", "gauge"),
+            ("bytes", "gauge"),
+            ("max_bytes", "gauge"),
+            ("evictions", "counter"),
+        ]:
+            name = f"pyinpark_cache_{field}" + ("_total" if kind == "counter" else "")
+            yield _header(name, kind, f"Result cache {field.replace('_', ' ')}.")
+            yield f"{name} {getattr(cache_stats, field)}\n"
+
+
+_default: Optional[Metrics] = None
+_default_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """进程内共用的 `Metrics`"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Metrics()
+        return _default
+
+
+def configure_metrics() -> Metrics:
+    """以新的 (空的) `Metrics` 替换进程内共用的实例"""
+    global _default
+    with _default_lock:
+        _default = Metrics()
+        return _default
@@ -1,15 +1,25 @@
+from __future__ import annotations
+
 from operator import methodcaller
 from pathlib import Path
-from typing import Any, Callable
+from typing import TYPE_CHECKING, Any, Callable, Optional, Tuple
 
-import pandas as pd
 import toolz.curried as tz
 
+from pyinpark.lazy import lazy_import
+
 # cspell: disable
 from pyinpark.pyfp import load_jsonc
 
 # cspell: enable
 
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+else:
+    np = lazy_import("numpy")
+    pd = lazy_import("pandas")
+
 
 @tz.curry
 def create_df_from_json(
@@ -66,3 +76,221 @@ def get_value_by_booleans(
 @tz.curry
 def get_rowsValues(df):
     return [v.values for _, v in df.iterrows()]
+
+
+@tz.curry
+def get_values_by_keys(
+    default: Any, key_ser: pd.Series, value_ser: pd.Series, keys: pd.Series
+) -> pd.Series:
+    """`get_value_by_booleans(default, value_ser)(eq_series(key_ser)(k))` 的批量版本
+
+    对 `keys` 中的每个值返回 `key_ser` 中第一个相等的行对应的 `value_ser`,
+    没有相等的行 (包括空值) 时返回 `default`. 先对 `key_ser` 建立索引, 时间复杂度
+    为 O((N + M) log M), 而逐个比较为 O(N·M).
+    """
+    first = (~key_ser.duplicated() & key_ser.notna()).to_numpy()
+    positions = pd.Index(key_ser[first]).get_indexer(keys)
+    values = value_ser[first].to_numpy()
+    if not len(values):
+        return pd.Series(np.full(len(keys), default), index=keys.index)
+    return pd.Series(
+        np.where(positions >= 0, values.take(positions.clip(0)), default),
+        index=keys.index,
+    )
+
+
+# %%
+# interval join
+# =============
+
+
+def _dense_ranks(*sers: pd.Series) -> Tuple[np.ndarray, ...]:
+    """把几组可比较的值一起替换为从 0 开始的密集排名, 空值为 -1"""
+    ranks = (
+        pd.concat(
+            [pd.Series(s).reset_index(drop=True) for s in sers], ignore_index=True
+        )
+        .rank(method="dense")
+        .fillna(0)
+        .to_numpy(dtype="int64")
+        - 1
+    )
+    return tuple(np.split(ranks, np.cumsum([len(s) for s in sers])[:-1]))
+
+
+def _key_codes(
+    left_keys: Optional[pd.Series], value_keys: Optional[pd.Series], m: int, n: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    if left_keys is None and value_keys is None:
+        return np.zeros(m, dtype="int64"), np.zeros(n, dtype="int64")
+    if left_keys is None or value_keys is None:
+        raise ValueError("left_keys and value_keys must be given together")
+    codes, _ = pd.factorize(
+        pd.concat([pd.Series(left_keys), pd.Series(value_keys)], ignore_index=True)
+    )
+    return codes[:m].astype("int64"), codes[m:].astype("int64")
+
+
+def _interval_candidates(left_ser, right_ser, values, left_keys, value_keys):
+    """按 (key, start) 排序区间, 返回每个值的候选区间范围 [first, hi)
+
+    区间按 (key, start) 排序后, 同一 key 内 end 的前缀最大值单调不减. 对值 v,
+    `hi` 是第一个 start > v 的位置, `first` 是第一个 end 前缀最大值 > v 的位置;
+    `first < hi` 时 `first` 就是 start 最早的包含 v 的区间, 其余包含 v 的区间都在
+    [first, hi) 之中. 排名和 key 编码合并为一个整数, 一次二分查找即可.
+    """
+    m, n = len(left_ser), len(values)
+    starts, ends, probes = _dense_ranks(left_ser, right_ser, values)
+    left_codes, value_codes = _key_codes(left_keys, value_keys, m, n)
+    width = max(starts.max(initial=0), ends.max(initial=0), probes.max(initial=0)) + 1
+
+    valid = (starts >= 0) & (ends > starts) & (left_codes >= 0)
+    rows = np.flatnonzero(valid)
+    comp_starts = left_codes[rows] * width + starts[rows]
+    order = np.argsort(comp_starts, kind="stable")
+    rows, comp_starts = rows[order], comp_starts[order]
+    comp_ends = left_codes[rows] * width + ends[rows]
+    max_ends = np.maximum.accumulate(comp_ends) if len(rows) else comp_ends
+
+    comp_values = np.where(
+        (probes >= 0) & (value_codes >= 0), value_codes * width + probes, -1
+    )
+    hi = np.searchsorted(comp_starts, comp_values, side="right")
+    first = np.searchsorted(max_ends, comp_values, side="right")
+    found = (comp_values >= 0) & (first < hi)
+    return rows, comp_ends, comp_values, np.where(found, first, hi), hi
+
+
+@tz.curry
+def interval_pairs(
+    left_ser: pd.Series,
+    right_ser: pd.Series,
+    values: pd.Series,
+    left_keys: Optional[pd.Series] = None,
+    value_keys: Optional[pd.Series] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """`between_series` 的批量版本: 找出每个值所在的全部 [left, right) 区间
+
+    返回 (值的行号, 区间的行号) 两个等长数组, 按值的行号排序, 同一个值的区间按
+    left 排序. 区间可以重叠; 指定 `left_keys` 和 `value_keys` (比如 contract_id) 时
+    只在 key 相同的区间中查找. 空值和 left >= right 的区间不参与匹配.
+
+    候选范围 [first, hi) 中的区间在 end 上建最大值线段树, 只向 end > 值的子树下降,
+    因此只访问真正包含该值的区间: 时间复杂度为 O((N + M + K) log(N + M)),
+    K 为输出的匹配数.
+    """
+    rows, comp_ends, comp_values, first, hi = _interval_candidates(
+        left_ser, right_ser, values, left_keys, value_keys
+    )
+    value_pos = np.flatnonzero(first < hi)
+    if not len(value_pos):
+        return value_pos, rows[:0]
+
+    size = 1 << max(len(rows) - 1, 0).bit_length()
+    tree = np.full(2 * size, -1, dtype=comp_ends.dtype)
+    tree[size : size + len(rows)] = comp_ends
+    level = size
+    while level > 1:
+        level //= 2
+        tree[level : 2 * level] = np.maximum(
+            tree[2 * level : 4 * level : 2], tree[2 * level + 1 : 4 * level : 2]
+        )
+
+    # 逐层下降; 子节点按位置顺序展开, 结果保持按 (值, left) 排序
+    nodes = np.ones(len(value_pos), dtype="int64")
+    span, depth = size, 0
+    while True:
+        lo = (nodes - (1 << depth)) * span
+        keep = (
+            (tree[nodes] > comp_values[value_pos])
+            & (lo < hi[value_pos])
+            & (lo + span > first[value_pos])
+        )
+        nodes, value_pos = nodes[keep], value_pos[keep]
+        if span == 1:
+            break
+        nodes = np.stack([2 * nodes, 2 * nodes + 1], axis=1).ravel()
+        value_pos = np.repeat(value_pos, 2)
+        span, depth = span // 2, depth + 1
+    return value_pos, rows[nodes - size]
+
+
+@tz.curry
+def interval_positions(
+    left_ser: pd.Series,
+    right_ser: pd.Series,
+    values: pd.Series,
+    left_keys: Optional[pd.Series] = None,
+    value_keys: Optional[pd.Series] = None,
+    how: str = "first",
+) -> np.ndarray:
+    """每个值所在区间的行号, 不在任何区间内为 -1
+
+    有多个区间包含同一个值时, `how="first"` 取 left 最早的区间, `how="last"`
+    取 left 最晚的区间. 参数含义同 `interval_pairs`.
+    """
+    if how == "first":
+        rows, _, _, first, hi = _interval_candidates(
+            left_ser, right_ser, values, left_keys, value_keys
+        )
+        if not len(rows):
+            return np.full(len(values), -1)
+        return np.where(first < hi, rows[first.clip(0, len(rows) - 1)], -1)
+    if how == "last":
+        value_pos, interval_pos = interval_pairs(
+            left_ser, right_ser, values, left_keys, value_keys
+        )
+        positions = np.full(len(values), -1)
+        # 同一个值的区间按 left 排序, 后写入的覆盖先写入的
+        positions[value_pos] = interval_pos
+        return positions
+    raise ValueError(f"unknown how: {how}")
+
+
+def interval_join(
+    values_df: pd.DataFrame,
+    intervals_df: pd.DataFrame,
+    on: str,
+    left: str,
+    right: str,
+    by: Optional[str] = None,
+    how: str = "left",
+) -> pd.DataFrame:
+    """按 `values_df[on]` 落在 `intervals_df` 的 [left, right) 区间内连接两个表
+
+    - `by`: 两表共有的分组列 (比如 contract_id), 只连接同组的区间
+    - `how`: "left" 保留没有匹配区间的行, "inner" 只保留有匹配的行
+
+    一个值落在多个重叠区间内时, 每个区间输出一行. 与 `pd.merge` 一样,
+    同名列添加 `_x` / `_y` 后缀.
+    """
+    if how not in ("left", "inner"):
+        raise ValueError(f"unknown how: {how}")
+    value_pos, interval_pos = interval_pairs(
+        intervals_df[left],
+        intervals_df[right],
+        values_df[on],
+        None if by is None else intervals_df[by],
+        None if by is None else values_df[by],
+    )
+    if how == "left":
+        unmatched = np.setdiff1d(np.arange(len(values_df)), value_pos)
+        value_pos = np.concatenate([value_pos, unmatched])
+        interval_pos = np.concatenate([interval_pos, np.full(len(unmatched), -1)])
+        order = np.argsort(value_pos, kind="stable")
+        value_pos, interval_pos = value_pos[order], interval_pos[order]
+
+    # 行号 -1 不是合法标签, reindex 得到空值行, 与 `pd.merge` 左连接一致
+    joined = (
+        intervals_df.drop(columns=[] if by is None else [by])
+        .reset_index(drop=True)
+        .reindex(interval_pos)
+        .reset_index(drop=True)
+    )
+    return pd.merge(
+        values_df.iloc[value_pos].reset_index(drop=True),
+        joined,
+        left_index=True,
+        right_index=True,
+        suffixes=("_x", "_y"),
+    )
@@ -73,6 +73,14 @@ def dump(file_path: Path, data: dict):
         json.dump(data, f, ensure_ascii=False)
 
 
+# loads_jsonc :: str -> dict
+loads_jsonc = tz.compose(
+    json.loads,
+    "".join,
+    partial(filter, lambda s: not s.strip().startswith("//")),
+    methodcaller("splitlines", True),
+)
+
 # load_jsonc :: Path -> dict
 load_jsonc = tz.compose(
     json.loads,
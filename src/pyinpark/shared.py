@@ -0,0 +1,167 @@
+"""进程间共享的只读 DataFrame
+
+发布方把 DataFrame 以 Arrow IPC 文件格式 (不压缩) 写入共享内存目录 (Linux 下为
+`/dev/shm`, 其他系统为临时目录) 一次; 工作进程通过 `SharedRef` 以内存映射的方式
+挂载, Arrow 数据直接引用映射的页面, 不复制, 也不随任务序列化. 多个进程挂载同一份
+数据只占用一份物理内存.
+
+- 挂载得到的数据是只读的, 数值列在 pandas 中同样不可写
+- Arrow 无法表示的列 (比如混合了数字和字符串的 object 列) 退化为 pickle 文件,
+  挂载时读入内存
+- `SharedFrames` 关闭或被回收时删除目录; 异常退出的进程遗留的目录在下次创建
+  `SharedFrames` 时清理
+
+>>> with SharedFrames() as shared:
+...     ref = shared.publish("contract", df)
+...     pool.submit(work, ref)  # 工作进程中: attach(ref)
+"""
+
+from __future__ import annotations
+
+import os
+import secrets
+import shutil
+import tempfile
+import weakref
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Mapping, NamedTuple, Optional
+
+from pyinpark.lazy import lazy_import
+
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+else:
+    pd = lazy_import("pandas")
+    pa = lazy_import("pyarrow")
+    ipc = lazy_import("pyarrow.ipc")
+
+PREFIX = "pyinpark-shared-"
+
+
+class SharedRef(NamedTuple):
+    """已发布的 DataFrame 的句柄, 体积很小, 可以直接传给工作进程"""
+
+    name: str
+    path: str
+    # "arrow" | "pickle"
+    format: str
+    rows: int
+    nbytes: int
+
+
+def default_base() -> Path:
+    shm = Path("/dev/shm")
+    if shm.is_dir() and os.access(shm, os.W_OK):
+        return shm
+    return Path(tempfile.gettempdir())
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        # 进程存在但属于其他用户, 或者当前系统不支持探测
+        return True
+    return True
+
+
+def cleanup_stale(base: Optional[Path] = None) -> List[Path]:
+    """删除发布进程已经不存在的共享目录, 返回被删除的目录"""
+    base = Path(base) if base is not None else default_base()
+    removed = []
+    for d in base.glob(f"{PREFIX}*"):
+        try:
+            pid = int(d.name[len(PREFIX) :].split("-")[0])
+        except ValueError:
+            continue
+        if pid != os.getpid() and not _pid_alive(pid):
+            shutil.rmtree(d, ignore_errors=True)
+            removed.append(d)
+    return removed
+
+
+class SharedFrames:
+    """发布只读 DataFrame 供其他进程挂载
+
+    - `base`: 共享目录的父目录, 默认为 `default_base()`
+    """
+
+    def __init__(self, base: Optional[Path] = None) -> None:
+        base = Path(base) if base is not None else default_base()
+        cleanup_stale(base)
+        self.directory = base / f"{PREFIX}{os.getpid()}-{secrets.token_hex(4)}"
+        self.directory.mkdir(mode=0o700)
+        self.refs: Dict[str, SharedRef] = {}
+        self._finalizer = weakref.finalize(
+            self, shutil.rmtree, str(self.directory), ignore_errors=True
+        )
+
+    def publish(self, name: str, df: pd.DataFrame) -> SharedRef:
+        if not self._finalizer.alive:
+            raise RuntimeError("SharedFrames is closed")
+        if name in self.refs:
+            raise ValueError(f"{name!r} is already published")
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            path, fmt = self.directory / f"{name}.pkl", "pickle"
+            tmp = path.with_name(path.name + ".tmp")
+            df.to_pickle(tmp, protocol=-1)
+        else:
+            path, fmt = self.directory / f"{name}.arrow", "arrow"
+            tmp = path.with_name(path.name + ".tmp")
+            with pa.OSFile(str(tmp), "wb") as sink:
+                with ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        # 写完再改名, 挂载方不会看到写了一半的文件
+        os.replace(tmp, path)
+
+        ref = SharedRef(
+            name=name,
+            path=str(path),
+            format=fmt,
+            rows=len(df),
+            nbytes=path.stat().st_size,
+        )
+        self.refs[name] = ref
+        return ref
+
+    def publish_all(self, frames: Mapping[str, pd.DataFrame]) -> Dict[str, SharedRef]:
+        return {name: self.publish(name, df) for name, df in frames.items()}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(ref.nbytes for ref in self.refs.values())
+
+    def close(self) -> None:
+        """删除全部共享数据. 已挂载的进程在 Linux 下仍可读取到自己解除映射为止"""
+        self._finalizer()
+
+    def __enter__(self) -> "SharedFrames":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def attach_table(ref: SharedRef) -> pa.Table:
+    """以内存映射方式挂载为 Arrow Table, 不复制数据"""
+    if ref.format != "arrow":
+        raise ValueError(f"{ref.name!r} is not stored as arrow")
+    with pa.memory_map(ref.path, "r") as source:
+        return ipc.open_file(source).read_all()
+
+
+def attach(ref: SharedRef) -> pd.DataFrame:
+    """挂载为 DataFrame
+
+    没有空值的数值列直接引用映射的内存 (只读); 字符串等需要转换为 Python 对象的列
+    仍会在当前进程中生成.
+    """
+    if ref.format == "pickle":
+        return pd.read_pickle(ref.path)
+    return attach_table(ref).to_pandas(split_blocks=True)
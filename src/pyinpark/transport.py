@@ -0,0 +1,145 @@
+"""pyinpark 各客户端共用的 HTTP 传输层
+
+`cmcloud`, `cmcloud2`, `cmcloud3` 和 `cmcloud4` 都经由同一个 `Transport` 访问网关:
+
+- 同一个连接池 (keep-alive), 连接数可配置, 避免每次查询重新握手 TCP/TLS
+- 请求默认携带 `Accept-Encoding: gzip, deflate`, 由底层自动解压
+- 登录 (login) -> 认证 (authenticate) 只有 `Transport.sign_in` 一条路径,
+  `X-CSRFToken` 统一由 `csrf_headers` 生成
+- 登录和认证请求记录在 `pyinpark.metrics.get_metrics()` 中
+
+连接池共享, cookie 不共享: `new_session` 返回的会话各自保存登录状态;
+`session` 为无状态会话, 不保存响应中的 cookie, 供 `cmcloud2/3` 这类显式传递
+cookies 的函数式接口使用.
+"""
+
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from typing import Any, Mapping, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pyinpark.metrics import get_metrics
+
+Timeout = Optional[Union[float, Tuple[float, float]]]
+
+# 与原先直接调用 `requests` 一致, 默认不限制等待时间
+DEFAULT_TIMEOUT: Timeout = None
+ACCEPT_ENCODING = {"Accept-Encoding": "gzip, deflate"}
+
+
+def csrf_headers(cookies: Mapping[str, str]) -> dict:
+    return {"X-CSRFToken": cookies["csrftoken"]}
+
+
+class _Session(requests.Session):
+    """未显式指定 timeout 的请求使用传输层的默认超时"""
+
+    def __init__(self, timeout: Timeout) -> None:
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):  # type: ignore[override]
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+class Transport:
+    def __init__(
+        self,
+        pool_connections: int = 4,
+        pool_maxsize: int = 16,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+        max_retries: int = 0,
+    ) -> None:
+        self.timeout = timeout
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=max_retries,
+        )
+        self.session = self.new_session()
+        # 无状态会话: 拒绝保存任何 cookie
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    @property
+    def pool_manager(self):
+        """底层的 urllib3 PoolManager, 供直接使用 urllib3 的 `cmcloud` 复用连接池"""
+        return self.adapter.poolmanager
+
+    def new_session(self) -> requests.Session:
+        session = _Session(self.timeout)
+        session.headers.update(ACCEPT_ENCODING)
+        session.mount("https://", self.adapter)
+        session.mount("http://", self.adapter)
+        return session
+
+    def login(
+        self, login_url: str, session: Optional[requests.Session] = None
+    ) -> requests.Response:
+        with get_metrics().timed("login") as rec:
+            return rec.response((session or self.session).get(login_url))
+
+    def authenticate(
+        self,
+        auth_url: str,
+        username: Optional[str],
+        password: Optional[str],
+        cookies: Any,
+        session: Optional[requests.Session] = None,
+    ) -> requests.Response:
+        with get_metrics().timed("authenticate") as rec:
+            return rec.response(
+                (session or self.session).post(
+                    auth_url,
+                    headers=csrf_headers(cookies),
+                    cookies=cookies,
+                    # cspell: disable-next-line
+                    data={"username": username, "password": password},
+                )
+            )
+
+    def sign_in(
+        self,
+        login_url: str,
+        auth_url: str,
+        username: Optional[str],
+        password: Optional[str],
+        session: Optional[requests.Session] = None,
+    ) -> requests.Response:
+        """登录并认证, 返回认证响应
+
+        传入 `session` 时登录状态保存在该会话中.
+        """
+        login_res = self.login(login_url, session)
+        return self.authenticate(
+            auth_url, username, password, login_res.cookies, session
+        )
+
+    def close(self) -> None:
+        self.session.close()
+        self.adapter.close()
+
+
+_lock = threading.Lock()
+_default: Optional[Transport] = None
+
+
+def get_transport() -> Transport:
+    """进程内共享的默认传输层"""
+    global _default
+    with _lock:
+        if _default is None:
+            _default = Transport()
+        return _default
+
+
+def configure_transport(**kwargs) -> Transport:
+    """按给定参数 (比如 `pool_maxsize`) 重建默认传输层"""
+    global _default
+    with _lock:
+        if _default is not None:
+            _default.close()
+        _default = Transport(**kwargs)
+        return _default